@@ -1,9 +1,19 @@
-import RPi.GPIO as GPIO
+import threading
+
+import hal
+
+# BCM pin -> hardware PWM channel (needs dtoverlay=pwm-2chan with matching pins)
+HW_PWM_CHANNELS = {12: 0, 18: 0, 13: 1, 19: 1}
 
 class io(object):
 
 
-    def __init__(self, ):
+    def __init__(self, gpio=None, clock=None):
+        # RPi.GPIO unless a simulated backend is given, see hal
+        self.gpio = gpio if gpio is not None else hal.rpi_gpio()
+        self.clock = clock if clock is not None else hal.SYSTEM_CLOCK
+        GPIO = self.gpio
+
         # SET GPIO numbering mode to use GPIO designation, NOT pin numbers
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
@@ -130,11 +140,189 @@ class io(object):
         pin = self.pin_map['HTR_PWR1']
         GPIO.setup(pin, GPIO.OUT)
         GPIO.output(pin, 0)
+        self.outputs = {'HTR_PWR1'}  # heater pins set up as GPIO outputs
 
     def turn_heater_on(self):
         pin = self.pin_map['HTR_PWR1']
-        GPIO.output(pin, 1)
+        self.gpio.output(pin, 1)
 
     def turn_heater_off(self):
         pin = self.pin_map['HTR_PWR1']
-        GPIO.output(pin, 0)
+        self.gpio.output(pin, 0)
+
+    def setup_heater(self, pin_name, now=False):
+        """ Heater SSR outputs start low (off).
+
+            A pin that can carry hardware PWM is only set up once set_heater
+            first drives it (or with now=True): GPIO.setup takes it out of
+            the PWM function the pwm-2chan overlay gave it at boot.
+        """
+        pin = self.pin_map[pin_name]
+        if pin in HW_PWM_CHANNELS and not now:
+            return
+        self.gpio.setup(pin, self.gpio.OUT)
+        self.gpio.output(pin, 0)
+        self.outputs.add(pin_name)
+
+    def set_heater(self, pin_name, state):
+        if pin_name not in self.outputs:
+            if not state:
+                return  # never driven as a GPIO; hardware PWM turns itself off on stop
+            self.setup_heater(pin_name, now=True)
+        pin = self.pin_map[pin_name]
+        self.gpio.output(pin, 1 if state else 0)
+
+    def add_edge_callback(self, pin_name, callback):
+        # Open drain alert inputs: pull up and trigger on the falling edge
+        pin = self.pin_map[pin_name]
+        self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.remove_event_detect(pin)
+        self.gpio.add_event_detect(pin, self.gpio.FALLING, callback=callback)
+
+    def remove_edge_callback(self, pin_name):
+        self.gpio.remove_event_detect(self.pin_map[pin_name])
+
+    def set_relay(self, relay, state):
+        # Relay outputs are active low
+        pin = self.pin_map['RELAY' + str(relay)]
+        self.gpio.output(pin, not state)
+
+    def create_pwm(self, mode='soft', period=1.0, resolution=100, mains_hz=60, pins=()):
+        """ Return a PWM driver for heater outputs.
+
+            mode 'soft'      timed software PWM, period split into resolution slots
+            mode 'burst'     zero-cross friendly burst fire, one slot per mains
+                             half cycle with on cycles spread evenly
+            mode 'hardware'  BCM PWM peripheral, only on BCM12/13/18/19
+
+            pins are the heater outputs the driver will get; ValueError if
+            the mode cannot drive one of them. Hardware PWM needs a pin of
+            its own PWM channel per heater, still in its PWM function.
+        """
+        if mode == 'hardware':
+            problems = []
+            owners = {}  # PWM channel -> pin name
+            for pin_name in pins:
+                pin = self.pin_map[pin_name]
+                channel = HW_PWM_CHANNELS.get(pin)
+                if channel is None:
+                    problems.append("no hardware PWM on {} (BCM{})".format(pin_name, pin))
+                elif pin_name in self.outputs:
+                    problems.append("{} (BCM{}) was driven as a GPIO, restart to use hardware PWM".format(
+                        pin_name, pin))
+                elif channel in owners:
+                    problems.append("{} and {} share PWM channel {}".format(owners[channel], pin_name, channel))
+                else:
+                    owners[channel] = pin_name
+            if problems:
+                raise ValueError('; '.join(problems))
+            return HardwarePwm(self, period)
+        if mode == 'burst':
+            return PwmEngine(self, slot=1.0 / (2 * mains_hz), resolution=0)
+        return PwmEngine(self, slot=period / resolution, resolution=resolution)
+
+
+class PwmEngine(threading.Thread):
+    """ One thread that drives every software PWM output.
+
+        Each slot the engine decides the level of each output and only
+        touches the GPIO when that level changes. The controller just calls
+        set_duty(); the float store is atomic so no lock is needed.
+    """
+
+    def __init__(self, io, slot, resolution):
+        super(PwmEngine, self).__init__(name='PwmEngine', daemon=True)
+        self.io = io
+        self.slot = slot
+        self.resolution = resolution  # 0 = burst fire
+        self.duty = {}
+        self.level = {}
+        self.__accumulator = {}
+        self.__stop = threading.Event()
+
+    def set_duty(self, pin_name, duty):
+        if pin_name not in self.duty:
+            self.level[pin_name] = False
+            self.__accumulator[pin_name] = 0.0
+        self.duty[pin_name] = min(1.0, max(0.0, duty))
+
+    def stop(self):
+        self.__stop.set()
+        if self.is_alive():
+            self.join()
+        for pin_name in list(self.duty):
+            self.io.set_heater(pin_name, False)
+            self.level[pin_name] = False
+
+    def run(self):
+        slot_idx = 0
+        clock = self.io.clock
+        deadline = clock.monotonic()
+        while not self.__stop.is_set():
+            for pin_name, duty in list(self.duty.items()):
+                if self.resolution:
+                    # Leading edge PWM: on for the first duty * resolution slots
+                    level = (slot_idx % self.resolution) < round(duty * self.resolution)
+                else:
+                    # First order sigma-delta: spreads on half cycles evenly
+                    acc = self.__accumulator[pin_name] + duty
+                    level = acc >= 1.0
+                    self.__accumulator[pin_name] = acc - 1.0 if level else acc
+                if level != self.level[pin_name]:
+                    self.io.set_heater(pin_name, level)
+                    self.level[pin_name] = level
+            slot_idx += 1
+
+            deadline += self.slot
+            remaining = deadline - clock.monotonic()
+            if remaining > 0:
+                clock.wait(self.__stop, remaining)
+            else:
+                deadline = clock.monotonic()
+
+
+class HardwarePwm(object):
+    """ Heater PWM on the BCM PWM peripheral through /sys/class/pwm. """
+
+    SYSFS = '/sys/class/pwm/pwmchip0'
+
+    def __init__(self, io, period):
+        self.io = io
+        self.period_ns = int(period * 1e9)
+        self.duty = {}
+        self.level = {}
+
+    def __write(self, path, value):
+        with open(self.SYSFS + path, 'w') as f:
+            f.write(str(value))
+
+    def __channel(self, pin_name):
+        pin = self.io.pin_map[pin_name]
+        if pin not in HW_PWM_CHANNELS:
+            raise ValueError("{} (BCM{}) has no hardware PWM".format(pin_name, pin))
+        return HW_PWM_CHANNELS[pin]
+
+    def set_duty(self, pin_name, duty):
+        duty = min(1.0, max(0.0, duty))
+        channel = self.__channel(pin_name)
+        if pin_name not in self.duty:
+            try:
+                self.__write('/export', channel)
+            except OSError:
+                pass  # already exported
+            self.__write('/pwm{}/period'.format(channel), self.period_ns)
+            self.__write('/pwm{}/enable'.format(channel), 1)
+        self.__write('/pwm{}/duty_cycle'.format(channel), int(duty * self.period_ns))
+        self.duty[pin_name] = duty
+        self.level[pin_name] = duty > 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        for pin_name in self.duty:
+            channel = self.__channel(pin_name)
+            self.__write('/pwm{}/duty_cycle'.format(channel), 0)
+            self.__write('/pwm{}/enable'.format(channel), 0)
+        self.duty.clear()
+        self.level.clear()
@@ -9,19 +9,40 @@
 
 import time
 
+import numpy
+
 class PID:
     """ Simple PID control.
 
         This class implements a simplistic PID control algorithm. When first
         instantiated all the gain variables are set to zero, so calling
         the method GenOut will just return zero.
+
+        dt comes from the clock (time.monotonic unless one is injected), or
+        is fixed when the controller is created with dt= for discrete,
+        deterministic stepping. Optional refinements, all off by default:
+
+            GenOut(error, measurement)  derivative on the measurement, so a
+                                        setpoint change gives no kick
+            SetDerivativeFilter(tf)     first order low-pass on the derivative
+            SetOutputLimits(lo, hi)     clamped output; the integral stops
+                                        growing while the output is held at a
+                                        limit (conditional integration)
     """
-    def __init__(self):
+    def __init__(self, clock=time.monotonic, dt=None):
+        # time source in seconds; replay and simulation pass their own
+        self.clock = clock
+        self.dt = dt  # fixed step in seconds, None = measure with the clock
+
         # initialze gains
         self.Kp = 0
         self.Kd = 0
         self.Ki = 0
 
+        self.d_filter = 0.0  # derivative filter time constant, s
+        self.out_min = None
+        self.out_max = None
+
         self.Initialize()
 
     def SetKp(self, invar):
@@ -40,12 +61,22 @@ class PID:
         """ Set previous error value. """
         self.prev_err = preverr
 
+    def SetDerivativeFilter(self, tf):
+        """ Set the derivative low-pass time constant in seconds, 0 = off. """
+        self.d_filter = tf
+
+    def SetOutputLimits(self, out_min, out_max):
+        """ Clamp the output to [out_min, out_max], None = unbounded. """
+        self.out_min = out_min
+        self.out_max = out_max
+
     def Initialize(self):
         # initialize delta t variables
-        self.currtm = time.time()
+        self.currtm = self.clock()
         self.prevtm = self.currtm
 
         self.prev_err = 0
+        self.prev_meas = None
 
         # term result variables
         self.Cp = 0
@@ -53,24 +84,112 @@ class PID:
         self.Cd = 0
 
 
-    def GenOut(self, error):
+    def GenOut(self, error, measurement=None):
         """ Performs a PID computation and returns a control value based on
             the elapsed time (dt) and the error signal from a summing junction
-            (the error parameter).
+            (the error parameter). With measurement given the derivative acts
+            on the measurement instead of the error.
         """
-        self.currtm = time.time()               # get t
-        dt = self.currtm - self.prevtm          # get delta t
-        de = error - self.prev_err              # get delta error
+        self.currtm = self.clock()              # get t
+        if self.dt is None:
+            dt = self.currtm - self.prevtm      # get delta t
+        else:
+            dt = self.dt
+        self.prevtm = self.currtm               # save t for next pass
+        return self.__step(error, measurement, dt, self.out_min, self.out_max)
+
+    def GenOutBatch(self, errors, measurements=None, timestamps=None, out_min=None, out_max=None):
+        """ GenOut for a whole array of errors in one call.
 
+            timestamps give the clock reading of each sample; without them
+            the controller must have a fixed dt. The state afterwards is the
+            same as after calling GenOut once per sample. Returns a NumPy
+            array of outputs. Without output limits or derivative filter the
+            recurrences are linear and evaluated with cumsum.
+
+            out_min / out_max, arrays like errors, are per sample output
+            limits for a setpoint that moves during the batch; otherwise the
+            SetOutputLimits ones apply. Neither changes SetOutputLimits.
+        """
+        errors = numpy.asarray(errors, dtype=float)
+        if len(errors) == 0:
+            return numpy.empty(0)
+        if timestamps is None:
+            if self.dt is None:
+                raise ValueError("GenOutBatch needs timestamps or a fixed dt")
+            steps = numpy.full(len(errors), float(self.dt))
+            last_time = self.prevtm
+        else:
+            timestamps = numpy.asarray(timestamps, dtype=float)
+            steps = numpy.diff(timestamps, prepend=self.prevtm) if self.dt is None \
+                else numpy.full(len(errors), float(self.dt))
+            last_time = timestamps[-1]
+
+        limited = out_min is not None or out_max is not None or \
+            self.out_min is not None or self.out_max is not None
+        if limited or self.d_filter:
+            # Clamping and filtering feed back into the state, step one by one
+            step = self.__step
+            count = len(errors)
+            lows = [self.out_min] * count if out_min is None else numpy.asarray(out_min, dtype=float).tolist()
+            highs = [self.out_max] * count if out_max is None else numpy.asarray(out_max, dtype=float).tolist()
+            if measurements is None:
+                measurements = [None] * count
+            else:
+                measurements = numpy.asarray(measurements, dtype=float).tolist()
+            outputs = [step(e, m, dt, lo, hi) for e, m, dt, lo, hi in
+                       zip(errors.tolist(), measurements, steps.tolist(), lows, highs)]
+            self.prevtm = self.currtm = last_time
+            return numpy.array(outputs)
+
+        if measurements is None:
+            changes = numpy.diff(errors, prepend=self.prev_err)
+            self.prev_meas = None
+        else:
+            measurements = numpy.asarray(measurements, dtype=float)
+            first = measurements[0] if self.prev_meas is None else self.prev_meas
+            changes = -numpy.diff(measurements, prepend=first)
+            self.prev_meas = float(measurements[-1])
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            derivative = numpy.where(steps > 0, changes / steps, 0.0)
+        integral = self.Ci + numpy.cumsum(errors * steps)
+
+        self.Cp = self.Kp * float(errors[-1])
+        self.Ci = float(integral[-1])
+        self.Cd = float(derivative[-1])
+        self.prev_err = float(errors[-1])
+        self.prevtm = self.currtm = last_time
+        return self.Kp * errors + self.Ki * integral + self.Kd * derivative
+
+    def __step(self, error, measurement, dt, out_min, out_max):
         self.Cp = self.Kp * error               # proportional term
-        self.Ci += error * dt                   # integral term
 
-        self.Cd = 0
-        if dt > 0:                              # no div by zero
-            self.Cd = de/dt                     # derivative term
+        if measurement is None:
+            de = error - self.prev_err          # get delta error
+        elif self.prev_meas is None:
+            de = 0                              # no history yet, no kick
+        else:
+            de = self.prev_meas - measurement   # -d(measurement) = d(error) at a fixed setpoint
+        derivative = de / dt if dt > 0 else 0   # no div by zero
+        if self.d_filter > 0 and dt > 0:
+            self.Cd += (derivative - self.Cd) * dt / (self.d_filter + dt)
+        else:
+            self.Cd = derivative                # derivative term
+
+        integral = self.Ci + error * dt         # integral term
+        out = self.Cp + (self.Ki * integral) + (self.Kd * self.Cd)
+        if (out_max is not None and out > out_max and self.Ki * error > 0) or \
+                (out_min is not None and out < out_min and self.Ki * error < 0):
+            integral = self.Ci                  # anti-windup: hold the integral at a limit
+            out = self.Cp + (self.Ki * integral) + (self.Kd * self.Cd)
+        self.Ci = integral
+
+        if out_max is not None and out > out_max:
+            out = out_max
+        elif out_min is not None and out < out_min:
+            out = out_min
 
-        self.prevtm = self.currtm               # save t for next pass
         self.prev_err = error                   # save t-1 error
-
+        self.prev_meas = measurement
         # sum the terms and return the result
-        return self.Cp + (self.Ki * self.Ci) + (self.Kd * self.Cd)
+        return out
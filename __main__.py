@@ -1,48 +1,120 @@
 #!/usr/bin/env python3
 import os
 import sys
-import GPIO_config
-from smbus import SMBus
-from PID import PID
 
-from PyQt5 import QtWidgets
-from PyQt5.QtSql import *
-from PyQt5.QtWidgets import QMessageBox
-
-from frmMainWindow import ApplicationWindow
-from mcp9600 import MCP9600
+from startup_timer import StartupTimer
 
 progname = os.path.basename(sys.argv[0])
 progversion = "0.1"
 
 def main():
-    
-    db = QSqlDatabase.addDatabase("QSQLITE")
-    db.setDatabaseName("HtrTest.db")
-    if not db.open():
-        result = QMessageBox.warning(None, 'HtrTest', "Database Error: %s" % db.lastError().text())
-        print(result)
-        sys.exit(1)
-
-    # create IO object
-    io = GPIO_config.io()
-    pid = PID()
-
-    # create i2c smbus object
-    i2c_bus = SMBus(1)  # 0 = /dev/i2c-0 (port I2C0), 1 = /dev/i2c-1 (port I2C1)
-    # create MCP9600 T/C readout object
-    tc = MCP9600(db, i2c_bus)
-    
-    cid=tc.mcp9600_read_id()
-    print("chip id = %x" % cid)
-
-    qApp = QtWidgets.QApplication(sys.argv)
-    aw = ApplicationWindow(db, tc, io, pid)
-    aw.setWindowTitle("%s" % progname)
-    aw.show()
-    sys.exit(qApp.exec_())
-    i2c_bus.close()
+    if '--headless' in sys.argv[1:]:
+        # Unattended run: PyQt5 and pyqtgraph are never imported
+        import headless
+        sys.exit(headless.main([arg for arg in sys.argv[1:] if arg != '--headless']))
+
+    timing = StartupTimer()
+    with timing.phase('core imports'):
+        from concurrent.futures import ThreadPoolExecutor
+        from parameters import ParameterStore
+
+    # I2C and GPIO setup writes every MCP9600 register; let it run while Qt loads
+    hardware = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hardware')
+    hardware_ready = hardware.submit(start_hardware, timing)
+
+    with timing.phase('Qt imports'):
+        from PyQt5 import QtWidgets
+        from PyQt5.QtCore import QTimer
+        from PyQt5.QtSql import QSqlDatabase
+        from PyQt5.QtWidgets import QMessageBox
+
+    with timing.phase('QApplication'):
+        qApp = QtWidgets.QApplication(sys.argv)
+
+    with timing.phase('database'):
+        db = QSqlDatabase.addDatabase("QSQLITE")
+        db.setDatabaseName("HtrTest.db")
+        if not db.open():
+            result = QMessageBox.warning(None, 'HtrTest', "Database Error: %s" % db.lastError().text())
+            print(result)
+            sys.exit(1)
+
+        # tblParameters is read once and cached, writes are coalesced in the background
+        params = ParameterStore("HtrTest.db")
+
+    with timing.phase('UI imports'):
+        from frmMainWindow import ApplicationWindow
+
+    with timing.phase('window'):
+        aw = ApplicationWindow(db, params)
+        aw.setWindowTitle("%s" % progname)
+
+    with timing.phase('wait for hardware'):
+        manager, logger, worker = hardware_ready.result()
+        hardware.shutdown()
+
+    with timing.phase('attach worker'):
+        aw.attach(worker)
+        aw.show()
+
+    # Prometheus /metrics for the rack, on tblParameters METRICS_PORT
+    from metrics import start_metrics_server
+    metrics = start_metrics_server(worker, params.value('METRICS_PORT', 0))
+    # JSON-lines remote control for a test executive, on API_PORT (0 = off)
+    from remote_api import start_remote_api
+    api = start_remote_api(worker, "HtrTest.db", params.value('API_PORT', 0))
+
+    if '--timing' in sys.argv[1:]:
+        def startup_report():
+            timing.mark('event loop running')
+            print(timing.report())
+        QTimer.singleShot(0, startup_report)
+
+    result = qApp.exec_()
+    if api is not None:
+        api.close()
+    if metrics is not None:
+        metrics.close()
+    worker.shutdown()
+    logger.close()
+    params.close()
+    manager.close()
+    sys.exit(result)
+
+
+def start_hardware(timing):
+    """ GPIO, I2C sensors, run logger and control worker; runs off the GUI thread. """
+    with timing.phase('hardware imports'):
+        import GPIO_config
+        import hal
+        from channel_manager import ChannelManager
+        from control_worker import ControlWorker
+        from run_logger import RunLogger
+
+    with timing.phase('hardware'):
+        # create IO object, or a simulated rack with --simulate
+        if '--simulate' in sys.argv[1:]:
+            simulation = hal.Simulation("HtrTest.db")
+            io, bus_factory = simulation.io, simulation.bus_factory
+        else:
+            io, bus_factory = GPIO_config.io(), hal.smbus_factory
+
+        # create the i2c buses, MCP9600 T/C readouts and PIDs listed in tblChannels.
+        # The file path, not the QSqlDatabase: a Qt connection belongs to the GUI thread
+        manager = ChannelManager("HtrTest.db", io, bus_factory)
+
+        for channel, cid in zip(manager.channels, manager.read_ids()):
+            print("%s chip id = %x" % (channel.name, cid))
+
+    with timing.phase('logger and worker'):
+        # samples, runs and events are written to HtrTest.db in batches on their own thread
+        logger = RunLogger("HtrTest.db")
+        logger.start()
 
+        # control loop runs on its own thread, the GUI only talks to it via queues
+        worker = ControlWorker(manager, logger=logger)
+        worker.start()
+    return manager, logger, worker
 
 if __name__ == "__main__":
     main()
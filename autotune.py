@@ -0,0 +1,103 @@
+import math
+
+from bang_bang import bang_bang
+from sysid import Tuning, pid_gains
+
+# Ziegler-Nichols style closed loop rules: (Kc / Ku, Ti / Tu, Td / Tu)
+RULES = {
+    'classic': (0.6, 1 / 2, 1 / 8),
+    'some_overshoot': (0.33, 1 / 2, 1 / 3),
+    'no_overshoot': (0.2, 1 / 2, 1 / 3),
+}
+
+
+class RelayAutotune(object):
+    """ Relay (Astrom-Hagglund) auto-tune around a setpoint.
+
+        The heater is switched with the same hysteresis rule as bang-bang
+        mode. Each time the heater turns on a cycle ends; its period and the
+        peak to peak swing since the previous turn-on are recorded, so the
+        peak detector needs O(1) work and memory per sample. Once the last
+        `cycles` periods and amplitudes agree within `tolerance` the ultimate
+        gain and period are known:
+
+            Ku = 4 d / (pi * sqrt(a^2 - eps^2)),  Tu = period
+
+        with relay amplitude d (duty units), oscillation amplitude a and
+        hysteresis half width eps.
+    """
+
+    def __init__(self, setpoint, hysteresis, cycles=4, tolerance=0.05, max_cycles=30):
+        self.setpoint = setpoint
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.tolerance = tolerance
+        self.max_cycles = max_cycles
+        self.relay_amplitude = 0.5  # heater switches between duty 0 and 1
+
+        self.heater = False
+        self.done = False
+        self.failed = False
+        self.Ku = None
+        self.Tu = None
+
+        self.__last_on = None
+        self.__max = -math.inf
+        self.__min = math.inf
+        self.periods = []
+        self.amplitudes = []
+
+    def update(self, timestamp, tempc):
+        """ Feed one sample, return the heater state to apply. """
+        if self.done:
+            return False
+
+        self.__max = max(self.__max, tempc)
+        self.__min = min(self.__min, tempc)
+
+        # The worker's bang-bang rule, so the relay switches exactly like that mode
+        heater = bang_bang(self.heater, tempc, self.setpoint, self.hysteresis)
+        if heater and not self.heater:
+            self.__cycle_complete(timestamp)
+        self.heater = heater
+        return self.heater and not self.done
+
+    def __cycle_complete(self, timestamp):
+        if self.__last_on is not None:
+            self.periods.append(timestamp - self.__last_on)
+            self.amplitudes.append((self.__max - self.__min) / 2)
+            self.__check_settled()
+        self.__last_on = timestamp
+        self.__max = -math.inf
+        self.__min = math.inf
+
+    @staticmethod
+    def __spread(values):
+        mean = sum(values) / len(values)
+        return (max(values) - min(values)) / mean if mean else math.inf, mean
+
+    def __check_settled(self):
+        # The first cycle includes the heat-up from ambient, never use it
+        recent_periods = self.periods[1:][-self.cycles:]
+        recent_amplitudes = self.amplitudes[1:][-self.cycles:]
+        if len(recent_periods) >= self.cycles:
+            period_spread, period = self.__spread(recent_periods)
+            amplitude_spread, amplitude = self.__spread(recent_amplitudes)
+            eps = self.hysteresis / 2
+            if period_spread <= self.tolerance and amplitude_spread <= self.tolerance and amplitude > eps:
+                self.Tu = period
+                self.Ku = 4 * self.relay_amplitude / (math.pi * math.sqrt(amplitude ** 2 - eps ** 2))
+                self.done = True
+                return
+        if len(self.periods) >= self.max_cycles:
+            self.done = True
+            self.failed = True
+
+    def tuning(self, rule='classic'):
+        """ PID tuning in duty units from one of RULES. """
+        kc, ti, td = RULES[rule]
+        return Tuning(rule, kc * self.Ku, ti * self.Tu, td * self.Tu)
+
+    def pid_gains(self, rule='classic'):
+        """ Gains for PID.Kp/Ki/Kd, scaled the way ControlWorker uses them. """
+        return pid_gains(self.tuning(rule), self.setpoint)
@@ -0,0 +1,9 @@
+# On/off control rule shared by the worker's bang-bang mode, the relay
+# auto-tune and replay. No imports, so any module can use it.
+
+
+def bang_bang(heater_on, tempc, setpt, hysteresis):
+    """ Next heater state for on/off control in a hysteresis band around setpt. """
+    if not heater_on:
+        return tempc <= setpt - (hysteresis / 2)
+    return tempc < setpt + (hysteresis / 2)
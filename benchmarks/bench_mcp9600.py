@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+""" Per-read overhead of MCP9600.read_tc before and after the compiled register map.
+
+    Runs without hardware or Qt: the register rows are read from HtrTest.db
+    with sqlite3 and the I2C bus is an in-memory stand-in that returns a
+    fixed reading, so only the Python side of a read is measured.
+
+    usage: python benchmarks/bench_mcp9600.py [iterations]
+"""
+import os
+import sqlite3
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mcp9600 import MCP9600, compile_register_map, decode_temperature
+
+
+class MemoryBus(object):
+
+    def read_i2c_block_data(self, addr, reg, length):
+        return [0x12, 0x34, 0x00][:length]
+
+    def write_word_data(self, addr, reg, value):
+        pass
+
+
+def read_table(conn, tblname):
+    cursor = conn.execute("SELECT * FROM " + tblname)
+    names = [column[0] for column in cursor.description]
+    return [dict(zip(names, row)) for row in cursor]
+
+
+def legacy_read_tc(registers, bus, i2c_addr=0x66):
+    # The pre-compiled-map path: linear scan of the register list on every read
+    reg_add = 0
+    for register in registers:
+        if register['NAME'] == 'ThermocoupleHotJunction':
+            reg_add = register['ADDRESS']
+            break
+    data_16 = bus.read_i2c_block_data(i2c_addr, reg_add, 2)
+    return decode_temperature(data_16[0], data_16[1])
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    conn = sqlite3.connect(os.path.join(ROOT, 'HtrTest.db'))
+    registers = read_table(conn, 'tblMcp9600_Registers')
+    reg_map = compile_register_map(registers, read_table(conn, 'tblMCP9600_RegBits'))
+    conn.close()
+
+    bus = MemoryBus()
+    tc = MCP9600(None, bus, register_map=reg_map)
+
+    # Registers near the end of the table show the cost of the scan
+    last = registers[-1]['NAME']
+    cases = [
+        ('legacy scan read_tc', lambda: legacy_read_tc(registers, bus)),
+        ('compiled read_tc', tc.read_tc),
+        ('legacy scan lookup (%s)' % last,
+         lambda: next(r['ADDRESS'] for r in registers if r['NAME'] == last)),
+        ('compiled lookup (%s)' % last, lambda: reg_map[last].address),
+    ]
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=iterations, repeat=5))
+        print("{:<45s} {:8.3f} us/read".format(name, best / iterations * 1e6))
+
+
+if __name__ == "__main__":
+    main()
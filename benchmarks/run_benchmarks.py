@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+""" Hot path benchmark suite: sensor decode, controller, database and plotting.
+
+    Runs on any Linux box: sensors are hal.SimMcp9600 devices on a SimBus,
+    the databases are synthetic copies in a temporary directory and all
+    random data is seeded. Cases needing PyQt5 (quieres, plot drawing) are
+    reported as skipped when it is not installed.
+
+    Each case reports the best of several timeit repeats in microseconds per
+    operation. Results are written as JSON and compared with a stored
+    baseline; a case slower than baseline by more than --threshold is a
+    regression and makes the exit status 1.
+
+        python3 benchmarks/run_benchmarks.py
+        python3 benchmarks/run_benchmarks.py --output results.json
+        python3 benchmarks/run_benchmarks.py --save-baseline
+        python3 benchmarks/run_benchmarks.py --filter pid --quick
+
+    The baseline is only meaningful on the machine that recorded it; record
+    a fresh one with --save-baseline when moving to other hardware.
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy
+
+import dbtables
+import hal
+from control_worker import Sample
+from mcp9600 import MCP9600, decode_temperature, load_register_map
+from parameters import ParameterStore
+from PID import PID
+from ring_buffer import SampleRingBuffer
+from simulator import CERAMIC_150W
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+SYNTHETIC_ROWS = 10000  # rows in the synthetic tables for the table readers
+SERIES_SIZES = (1000, 10000, 100000)  # plotted samples for the plot cases
+
+# A case: name, setup(tmpdir) -> (func, operations per call)
+Case = collections.namedtuple('Case', ['name', 'group', 'setup'])
+CASES = []
+
+
+class Skip(Exception):
+    """ Raised by a setup when the case cannot run here. """
+
+
+def case(name, group):
+    def register(setup):
+        CASES.append(Case(name, group, setup))
+        return setup
+    return register
+
+
+# ----------------------------------------------------------------------
+# Sensor
+# ----------------------------------------------------------------------
+def _sim_sensor(tmpdir):
+    clock = hal.VirtualClock()
+    plant = hal.HeaterPlant(CERAMIC_150W, clock)
+    bus = hal.SimBus({0x60: hal.SimMcp9600(plant, clock)})
+    db = os.path.join(ROOT, 'HtrTest.db')
+    return MCP9600(db, bus, 0x60, register_map=load_register_map(db))
+
+
+@case('mcp9600.read_tc', 'sensor')
+def _read_tc(tmpdir):
+    return _sim_sensor(tmpdir).read_tc, 1
+
+
+@case('mcp9600.decode_temperature', 'sensor')
+def _decode(tmpdir):
+    return lambda: decode_temperature(0x12, 0x34), 1
+
+
+@case('mcp9600.register_lookup', 'sensor')
+def _register_lookup(tmpdir):
+    reg_map = load_register_map(os.path.join(ROOT, 'HtrTest.db'))
+    last = list(reg_map)[-1]
+    return lambda: reg_map[last].address, 1
+
+
+@case('mcp9600.read_snapshot', 'sensor')
+def _read_snapshot(tmpdir):
+    return _sim_sensor(tmpdir).read_snapshot, 1
+
+
+# ----------------------------------------------------------------------
+# Controller
+# ----------------------------------------------------------------------
+def _pid(limits=False, d_filter=0.0):
+    pid = PID(clock=hal.VirtualClock().monotonic, dt=1.0)
+    pid.Kp, pid.Ki, pid.Kd = 5.0, 0.01, 0.5
+    pid.SetDerivativeFilter(d_filter)
+    if limits:
+        pid.SetOutputLimits(0, 300)
+    return pid
+
+
+@case('pid.GenOut', 'controller')
+def _genout(tmpdir):
+    pid = _pid()
+    return lambda: pid.GenOut(2.5, 297.5), 1
+
+
+@case('pid.GenOut limits+filter', 'controller')
+def _genout_limited(tmpdir):
+    pid = _pid(limits=True, d_filter=2.0)
+    return lambda: pid.GenOut(2.5, 297.5), 1
+
+
+@case('pid.GenOutBatch per sample', 'controller')
+def _genout_batch(tmpdir):
+    pid = _pid()
+    measurements = 300 + numpy.random.default_rng(1).normal(0, 0.5, 10000)
+    errors = 300 - measurements
+    return lambda: pid.GenOutBatch(errors, measurements), 10000
+
+
+# ----------------------------------------------------------------------
+# Database
+# ----------------------------------------------------------------------
+def _synthetic_db(tmpdir):
+    path = os.path.join(tmpdir, 'synthetic.db')
+    if not os.path.exists(path):
+        rng = numpy.random.default_rng(2)
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.execute('CREATE TABLE tblSynthetic (PK_ID INTEGER PRIMARY KEY, NAME TEXT, '
+                         'ADDRESS INTEGER, VALUE REAL, DESCRIPTION TEXT)')
+            conn.executemany('INSERT INTO tblSynthetic (NAME, ADDRESS, VALUE, DESCRIPTION) VALUES (?, ?, ?, ?)',
+                             [('reg{}'.format(i), i, float(v), 'row {}'.format(i))
+                              for i, v in enumerate(rng.normal(size=SYNTHETIC_ROWS))])
+        conn.close()
+    return path
+
+
+def _qt_database(path):
+    try:
+        from PyQt5 import QtCore, QtSql
+    except ImportError:
+        raise Skip('PyQt5 not installed')
+    if QtCore.QCoreApplication.instance() is None:
+        _qt_database.app = QtCore.QCoreApplication([])
+    db = QtSql.QSqlDatabase.addDatabase('QSQLITE', 'benchmark')
+    db.setDatabaseName(path)
+    if not db.open():
+        raise Skip('QSQLITE driver not available')
+    return db
+
+
+@case('quieres.db_table_data_to_dictionary @%d rows' % SYNTHETIC_ROWS, 'database')
+def _quieres_dictionary(tmpdir):
+    db = _qt_database(_synthetic_db(tmpdir))
+    import quieres
+    return lambda: quieres.db_table_data_to_dictionary(db, 'tblSynthetic'), 1
+
+
+@case('quieres.db_fetch_table_data @%d rows' % SYNTHETIC_ROWS, 'database')
+def _quieres_fetch(tmpdir):
+    db = _qt_database(_synthetic_db(tmpdir))
+    import quieres
+    return lambda: quieres.db_fetch_table_data(db, 'tblSynthetic'), 1
+
+
+@case('dbtables.table_to_dictionary @%d rows' % SYNTHETIC_ROWS, 'database')
+def _dbtables_dictionary(tmpdir):
+    path = _synthetic_db(tmpdir)
+    return lambda: dbtables.table_to_dictionary(path, 'tblSynthetic'), 1
+
+
+def _parameter_db(tmpdir):
+    path = os.path.join(tmpdir, 'parameters.db')
+    if not os.path.exists(path):
+        shutil.copy(os.path.join(ROOT, 'HtrTest.db'), path)
+    return path
+
+
+@case('tblParameters SELECT per read', 'database')
+def _parameter_select(tmpdir):
+    # What every db_select_parameter cost before the ParameterStore
+    conn = sqlite3.connect(_parameter_db(tmpdir))
+    return lambda: conn.execute("SELECT VALUE FROM tblParameters WHERE PARAMETER = ?", ('SETPT',)).fetchone(), 1
+
+
+@case('ParameterStore.value', 'database')
+def _parameter_value(tmpdir):
+    store = ParameterStore(_parameter_db(tmpdir))
+    return lambda: store.value('SETPT'), 1
+
+
+@case('ParameterStore.set+flush', 'database')
+def _parameter_write(tmpdir):
+    store = ParameterStore(_parameter_db(tmpdir), debounce=3600)
+    values = iter(range(10 ** 9))
+
+    def write():
+        store.set('PLOT_WINDOW', next(values))
+        store.close()  # cancels the debounce timer, then writes
+    return write, 1
+
+
+# ----------------------------------------------------------------------
+# Plotting
+# ----------------------------------------------------------------------
+def _filled_buffer(size):
+    samples = SampleRingBuffer()
+    temperatures = 22 + 278 * (1 - numpy.exp(-numpy.arange(size) / 240.0))
+    samples.extend(Sample(float(i), float(t), 300.0, 0.0, 0.5, False, 0) for i, t in enumerate(temperatures))
+    return samples
+
+
+def _new_samples(start):
+    # One GUI timer's worth: a 100 ms drain at 10 samples/s per channel
+    return [Sample(float(start), 300.0, 300.0, 0.0, 0.5, False, 0)]
+
+
+def _plot_case(size):
+    @case('plot buffer update @%d' % size, 'plot')
+    def setup(tmpdir):
+        samples = _filled_buffer(size)
+
+        def update():
+            samples.extend(_new_samples(samples.count))
+            visible = samples.window(0)
+            return visible['timestamp'], visible['temperature']
+        return update, 1
+
+    @case('plot setData @%d' % size, 'plot')
+    def setup_draw(tmpdir):
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        try:
+            from PyQt5 import QtWidgets
+            import pyqtgraph
+        except ImportError:
+            raise Skip('PyQt5 / pyqtgraph not installed')
+        if QtWidgets.QApplication.instance() is None:
+            setup_draw.app = QtWidgets.QApplication([])
+        widget = pyqtgraph.PlotWidget()
+        plot = widget.plot()
+        samples = _filled_buffer(size)
+
+        def update():
+            samples.extend(_new_samples(samples.count))
+            visible = samples.window(0)
+            plot.setData(visible['timestamp'], visible['temperature'])
+        return update, 1
+
+
+for _size in SERIES_SIZES:
+    _plot_case(_size)
+
+
+# ----------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------
+def measure(func, operations, repeat, min_time):
+    """ Best and median microseconds per operation over `repeat` timings. """
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    times = sorted(timer.repeat(repeat=repeat, number=number))
+    per_op = 1e6 / (number * operations)
+    return {'us_per_op': times[0] * per_op, 'median_us_per_op': times[len(times) // 2] * per_op,
+            'calls': number, 'repeat': repeat}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': numpy.__version__,
+            'machine': platform.machine(), 'processor': platform.processor()}
+
+
+def run(selected, repeat, min_time):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for bench in selected:
+            try:
+                func, operations = bench.setup(tmpdir)
+            except Skip as e:
+                results[bench.name] = {'group': bench.group, 'skipped': str(e)}
+                print("{:<45s} skipped: {}".format(bench.name, e))
+                continue
+            result = measure(func, operations, repeat, min_time)
+            result['group'] = bench.group
+            results[bench.name] = result
+            print("{:<45s} {:12.3f} us/op".format(bench.name, result['us_per_op']))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Print current vs baseline and return the names that regressed. """
+    regressions = []
+    print("\n{:<45s} {:>12s} {:>12s} {:>8s}".format('case', 'baseline', 'current', 'change'))
+    for name, result in results.items():
+        before = baseline.get(name, {})
+        if 'us_per_op' not in result or 'us_per_op' not in before:
+            continue
+        change = result['us_per_op'] / before['us_per_op'] - 1.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print("{:<45s} {:12.3f} {:12.3f} {:+7.1%}{}".format(
+            name, before['us_per_op'], result['us_per_op'], change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the HeaterTest hot paths')
+    parser.add_argument('--output', help='write the results JSON here')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline JSON to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='fractional slowdown counted as a regression (default 0.5)')
+    parser.add_argument('--filter', default='', help='only cases whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='fewer, shorter repeats')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    args = parser.parse_args(argv)
+
+    selected = [bench for bench in CASES if args.filter in bench.name]
+    if args.list:
+        for bench in selected:
+            print("{:<12s} {}".format(bench.group, bench.name))
+        return 0
+
+    repeat, min_time = (3, 0.05) if args.quick else (7, 0.2)
+    report = {'environment': environment(), 'results': run(selected, repeat, min_time)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("\nbaseline saved to {}".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nno baseline at {}, run with --save-baseline to create one".format(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report['results'], baseline['results'], args.threshold)
+    if regressions:
+        print("\n{} regression(s) over {:.0%}".format(len(regressions), args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dbtables
+import hal
+from mcp9600 import MCP9600
+from PID import PID
+
+
+class Channel(object):
+    """ One heater under test: its thermocouple, controller and SSR output. """
+
+    def __init__(self, index, name, bus, tc, pid, heater_pin):
+        self.index = index
+        self.name = name
+        self.bus = bus  # I2C bus number
+        self.tc = tc  # Thermocouple
+        self.pid = pid
+        self.heater_pin = heater_pin  # key into io.pin_map
+        self.heater_on = False
+        self.duty_cycle = 0  # 0.0 - 1.0 heater PWM duty
+        self.correction = 0
+        self.autotune = None  # RelayAutotune while in autotune mode
+        self.temperature = float('nan')
+
+
+CHANNELS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS "tblChannels" (
+        "PK_ID"	INTEGER PRIMARY KEY AUTOINCREMENT,
+        "NAME"	TEXT NOT NULL UNIQUE,
+        "BUS"	INTEGER NOT NULL DEFAULT 1,
+        "ADDRESS"	INTEGER NOT NULL,
+        "HTR_PIN"	TEXT NOT NULL,
+        "ENABLED"	INTEGER NOT NULL DEFAULT 1,
+        "DESCRIPTION"	TEXT
+    )""",
+)
+# The rack as shipped: only CH1, the original single heater, is enabled
+DEFAULT_CHANNELS = (
+    ('CH1', 1, 0x66, 'HTR_PWR1', 1, 'Heater 1, MCP9600 at 0x66'),
+    ('CH2', 1, 0x67, 'BCM5', 0, 'Heater 2, MCP9600 at 0x67'),
+    ('CH3', 1, 0x60, 'BCM6', 0, 'Heater 3, MCP9600 at 0x60'),
+    ('CH4', 1, 0x61, 'BCM12', 0, 'Heater 4, MCP9600 at 0x61'),
+)
+INSERT_CHANNEL = ("INSERT OR IGNORE INTO tblChannels (NAME, BUS, ADDRESS, HTR_PIN, ENABLED, DESCRIPTION) "
+                  "VALUES (?, ?, ?, ?, ?, ?)")
+
+
+def channel_rows(db):
+    """ Rows of tblChannels, creating the table and the default channels if missing. """
+    dbtables.ensure_tables(db, CHANNELS_SCHEMA, [(INSERT_CHANNEL, DEFAULT_CHANNELS)])
+    return dbtables.table_to_dictionary(db, 'tblChannels')
+
+
+class ChannelManager(object):
+    """ Builds the channels listed in tblChannels and reads them in sweeps.
+
+        Each row gives the channel name, I2C bus number, MCP9600 address and
+        the pin_map name of its heater output. db is a QSqlDatabase or, for
+        headless use, the path of the database file. bus_factory(bus number)
+        returns an SMBus or, off-target, a hal.SimBus. Sensors sharing a bus
+        are read back to back in one sweep; separate buses are swept
+        concurrently.
+    """
+
+    def __init__(self, db, io, bus_factory=hal.smbus_factory):
+        self.db = db
+        self.io = io
+        self.buses = {}
+        self.channels = []
+        self.pwm = None
+        self.pwm_config = {'mode': 'soft', 'period': 1.0, 'resolution': 100}
+        self.gpio_seconds = 0.0  # running total spent in heater writes, for latency
+
+        rows = channel_rows(self.db)
+        for row in rows:
+            if not int(row['ENABLED']):
+                continue
+            bus_num = int(row['BUS'])
+            if bus_num not in self.buses:
+                self.buses[bus_num] = bus_factory(bus_num)
+            tc = MCP9600(self.db, self.buses[bus_num], int(row['ADDRESS']))
+            self.io.setup_heater(row['HTR_PIN'])
+            pid = PID(clock=self.io.clock.monotonic)  # same time base as the control loop
+            self.channels.append(Channel(len(self.channels), row['NAME'], bus_num, tc, pid, row['HTR_PIN']))
+
+        self.__by_bus = {}
+        for channel in self.channels:
+            self.__by_bus.setdefault(channel.bus, []).append(channel)
+        self.__pool = None
+        if len(self.__by_bus) > 1:
+            self.__pool = ThreadPoolExecutor(max_workers=len(self.__by_bus))
+
+    def read_ids(self):
+        return [channel.tc.mcp9600_read_id() for channel in self.channels]
+
+    def read_all(self):
+        """ Read every thermocouple once and store it on its channel.
+
+            A channel whose sensor does not answer gets NaN so the caller
+            can fail safe on that channel without losing the others.
+            Returns the channels that were read.
+        """
+        return self.__sweep(self.__sweep_bus)
+
+    def read_updated(self):
+        """ Like read_all, but only reads channels with a new conversion.
+
+            Status and hot junction come from one MCP9600.read_snapshot
+            transfer; only a fresh value costs a second one, the status clear.
+        """
+        return self.__sweep(self.__sweep_bus_updated)
+
+    def set_adc_resolution(self, bits):
+        for channel in self.channels:
+            channel.tc.set_adc_resolution(bits)
+
+    def conversion_time(self):
+        return max(channel.tc.conversion_time() for channel in self.channels)
+
+    def __sweep(self, sweep_bus):
+        if self.__pool is None:
+            results = [sweep_bus(channels) for channels in self.__by_bus.values()]
+        else:
+            results = self.__pool.map(sweep_bus, self.__by_bus.values())
+        return [channel for read in results for channel in read]
+
+    @staticmethod
+    def __sweep_bus(channels):
+        for channel in channels:
+            try:
+                channel.temperature = channel.tc.read_tc()
+            except OSError:
+                channel.temperature = float('nan')
+        return channels
+
+    @staticmethod
+    def __sweep_bus_updated(channels):
+        read = []
+        for channel in channels:
+            try:
+                snapshot = channel.tc.read_snapshot()
+                if snapshot.th_updated:
+                    channel.tc.clear_status()
+                    channel.temperature = snapshot.hot_junction
+                    read.append(channel)
+            except OSError:
+                channel.temperature = float('nan')
+                read.append(channel)
+        return read
+
+    def set_heater(self, channel, state):
+        start = time.perf_counter()
+        self.io.set_heater(channel.heater_pin, state)
+        channel.heater_on = state
+        self.gpio_seconds += time.perf_counter() - start
+
+    def configure_pwm(self, mode, period, resolution):
+        self.pwm_config = {'mode': mode, 'period': period, 'resolution': resolution}
+
+    def start_pwm(self):
+        """ Hand every heater output to a fresh PWM driver. """
+        self.stop_pwm()
+        pins = [channel.heater_pin for channel in self.channels]
+        try:
+            self.pwm = self.io.create_pwm(pins=pins, **self.pwm_config)
+        except ValueError as e:
+            # A PWM_MODE the heater pins cannot use must not stop the run
+            print("PWM mode {} not usable, falling back to soft PWM: {}".format(self.pwm_config['mode'], e),
+                  file=sys.stderr)
+            self.pwm_config = dict(self.pwm_config, mode='soft')
+            self.pwm = self.io.create_pwm(pins=pins, **self.pwm_config)
+        for channel in self.channels:
+            self.pwm.set_duty(channel.heater_pin, 0)
+        self.pwm.start()
+
+    def set_duty(self, channel, duty):
+        if self.pwm is None:
+            self.start_pwm()
+        start = time.perf_counter()
+        self.pwm.set_duty(channel.heater_pin, duty)
+        channel.duty_cycle = self.pwm.duty[channel.heater_pin]
+        channel.heater_on = self.pwm.level[channel.heater_pin]
+        self.gpio_seconds += time.perf_counter() - start
+
+    def stop_pwm(self):
+        if self.pwm is not None:
+            self.pwm.stop()
+            self.pwm = None
+
+    def all_heaters_off(self):
+        self.stop_pwm()
+        for channel in self.channels:
+            self.set_heater(channel, False)
+
+    def close(self):
+        self.stop_pwm()
+        if self.__pool is not None:
+            self.__pool.shutdown()
+        for bus in self.buses.values():
+            bus.close()
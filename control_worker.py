@@ -0,0 +1,482 @@
+import collections
+import json
+import os
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+import latency
+from autotune import RelayAutotune
+from bang_bang import bang_bang
+from run_analytics import ChannelAnalytics
+from setpoint_profile import ProfileRunner
+
+# One record per control tick, produced by the worker and consumed by the GUI.
+Sample = namedtuple('Sample', ['timestamp', 'temperature', 'setpoint', 'output', 'duty', 'heater', 'channel'])
+# Latest state of one channel for monitoring; samples counts since the worker started.
+ChannelStatus = namedtuple('ChannelStatus', ['name', 'timestamp', 'temperature', 'setpoint', 'output', 'duty',
+                                             'heater', 'cp', 'ci', 'cd', 'samples'])
+
+SPIN_THRESHOLD = 0.002  # sleep until this close to a deadline, then spin
+SAMPLE_QUEUE_LEN = 10000  # drop oldest samples if the GUI stops draining
+
+
+class ControlWorker(threading.Thread):
+    """ Real-time acquisition and control thread.
+
+        The worker owns the ChannelManager and through it every MCP9600,
+        PID and heater output. The GUI never touches them directly: it sends
+        commands with send() and drains Sample records from the samples
+        deque. deque.append/popleft are atomic, so neither side takes a lock
+        on the sample path. Each period all sensors are read in one sweep,
+        then every channel runs its own controller.
+
+        SAMPLE_MODE selects what starts a control step:
+            'timer'       fixed period, every channel read each tick
+            'conversion'  status polled at a fraction of the conversion time,
+                          only channels with a fresh hot junction value run
+            'alert'       falling edge on ALERT_PIN wakes the thread; the
+                          MCP9600 alert output must be configured for it
+
+        With a PROFILE the setpoint and PID feed-forward follow a
+        setpoint_profile.ProfileRunner and the run ends with the profile.
+
+        Every sample also updates a run_analytics.ChannelAnalytics; stats
+        is a list of RunStats snapshots, one per channel, replaced whole
+        each tick so readers on other threads never see it half updated.
+        The final snapshot is logged to tblRunStats when the run stops.
+
+        latency times every stage of a tick into latency.LoopLatency
+        histograms; the percentiles are logged as a 'latency' event at the
+        end of each run.
+
+        status (a tuple of ChannelStatus) and relays ({relay: state}) are
+        likewise replaced whole, never mutated, so monitoring threads can
+        read them at any time without touching the hardware or the loop.
+
+        Listeners added with add_listener() are called on the control
+        thread as listener('sample', Sample) and listener('event', (name,
+        channel, data)); they must only hand the item off (append to a
+        deque, wake a loop) and never block or raise.
+
+        An exception in the loop does not end the thread: the run stops
+        with status 'error', every heater is turned off and an ('error',
+        None, message) event is sent.
+    """
+
+    def __init__(self, manager, period=1.0, logger=None):
+        super(ControlWorker, self).__init__(name='ControlWorker', daemon=True)
+        self.manager = manager
+        self.logger = logger  # RunLogger, optional
+        self.io = manager.io
+        self.clock = manager.io.clock  # hal.SystemClock, or a ScaledClock in simulation
+        self.channels = manager.channels
+        self.period = period
+
+        self.samples = collections.deque(maxlen=SAMPLE_QUEUE_LEN)
+        self.events = collections.deque()  # (name, channel index, data) for the GUI
+        self.commands = collections.deque()
+        self.__wake = threading.Event()
+        self.__alert = threading.Event()
+        self.__quit = False
+
+        self.params = {
+            'MODE': 'bang_bang',
+            'SETPT': 0,
+            'HYSTERESIS': 1,
+            'SECONDS': 0,
+            'SAMPLE_MODE': 'timer',
+            'ALERT_PIN': 'BCM17',
+            'AUTOTUNE_RULE': 'classic',
+            'TC_FILTER': 0,
+            'D_FILTER': 0.0,  # PID derivative filter time constant, s
+            'PROFILE': None,  # setpoint_profile.Profile, None = constant SETPT
+            'SETTLE_BAND': 1.0,  # +/- C counted as settled by the analytics
+            'HEATER_WATTS': 0.0,  # heater power for the energy estimate, 0 = unknown
+            'SAMPLE_STORE': 'db',  # where RunLogger keeps samples: db, file or both
+        }
+        self.running = False
+        self.data_idx = 0
+        self.start_time = 0
+        self.runner = None  # ProfileRunner while a profile runs
+        self.setpoint = 0  # SETPT, or the profile setpoint this tick
+        self.feed_forward = 0.0  # duty added to the PID output
+        self.analytics = []  # ChannelAnalytics per channel, control thread only
+        self.stats = []  # RunStats per channel, see the class docstring
+        self.latency = latency.LoopLatency()
+        self.status = tuple(ChannelStatus(channel.name, 0.0, float('nan'), 0, 0, 0.0, False, 0, 0, 0, 0)
+                            for channel in self.channels)
+        self.relays = {}
+        self.ticks = 0  # control ticks since the worker started
+        self.listeners = ()  # replaced, not mutated, see add_listener
+        self.__edge_time = None  # perf_counter of the last ALERT edge
+
+    # ------------------------------------------------------------------
+    # GUI side
+    # ------------------------------------------------------------------
+    def send(self, command, *args):
+        """ Queue a command for the control thread and wake it up. """
+        self.commands.append((command, args))
+        self.__wake.set()
+
+    def drain_samples(self):
+        """ Return all samples produced since the last call. """
+        samples = []
+        while True:
+            try:
+                samples.append(self.samples.popleft())
+            except IndexError:
+                return samples
+
+    def drain_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.popleft())
+            except IndexError:
+                return events
+
+    def add_listener(self, listener):
+        self.listeners = self.listeners + (listener,)
+
+    def remove_listener(self, listener):
+        self.listeners = tuple(item for item in self.listeners if item is not listener)
+
+    def shutdown(self, timeout=2.0):
+        self.send('quit')
+        self.join(timeout)
+
+    # ------------------------------------------------------------------
+    # Control thread
+    # ------------------------------------------------------------------
+    def run(self):
+        self.__set_realtime_priority()
+        deadline = self.clock.monotonic()
+        while not self.__quit:
+            try:
+                deadline = self.__cycle(deadline)
+            except Exception as e:
+                # Never die silently with a heater on; the run ends and the GUI is told
+                traceback.print_exc()
+                self.__fail(e)
+                deadline = self.clock.monotonic()
+
+        self.manager.all_heaters_off()
+
+    def __cycle(self, deadline):
+        """ Commands, then one control step when running; returns the next deadline. """
+        self.__process_commands()
+        if not self.running:
+            # Idle: block until a command arrives instead of ticking
+            self.clock.wait(self.__wake, self.period)
+            self.__wake.clear()
+            return self.clock.monotonic()
+
+        mode = self.params['SAMPLE_MODE']
+        if mode == 'alert':
+            # Sensor edge drives the step; the timeout keeps a stuck alert line safe
+            self.__wait_for_alert(2 * self.manager.conversion_time() + self.period)
+            if self.running:
+                fired = time.perf_counter()
+                if self.__edge_time is not None:
+                    self.latency.record('wake', fired - self.__edge_time)
+                    self.__edge_time = None
+                self.__tick(self.__read(self.manager.read_all), fired)
+            return deadline
+
+        fired = time.perf_counter()
+        self.latency.record('wake', self.clock.monotonic() - deadline)
+        if mode == 'conversion':
+            self.__tick(self.__read(self.manager.read_updated), fired)
+            interval = self.manager.conversion_time() / 4
+        else:
+            self.__tick(self.__read(self.manager.read_all), fired)
+            interval = self.period
+
+        deadline += interval
+        now = self.clock.monotonic()
+        if now > deadline + interval:
+            # Overran by more than a whole period, resync instead of bursting
+            deadline = now
+        self.__sleep_until(deadline)
+        return deadline
+
+    def __fail(self, error):
+        try:
+            if self.running:
+                self.__stop('error')
+            else:
+                self.manager.all_heaters_off()
+        except Exception:
+            traceback.print_exc()
+            self.running = False
+            try:
+                self.manager.all_heaters_off()
+            except Exception:
+                traceback.print_exc()
+        self.__event('error', None, '{}: {}'.format(type(error).__name__, error))
+
+    @staticmethod
+    def __set_realtime_priority():
+        # Best effort: needs CAP_SYS_NICE, silently stays SCHED_OTHER otherwise
+        try:
+            priority = os.sched_get_priority_min(os.SCHED_FIFO) + 10
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except (AttributeError, OSError):
+            pass
+
+    def __sleep_until(self, deadline):
+        while True:
+            remaining = deadline - self.clock.monotonic()
+            if remaining <= 0:
+                return
+            if remaining > SPIN_THRESHOLD:
+                self.clock.wait(self.__wake, remaining - SPIN_THRESHOLD)
+                self.__wake.clear()
+                self.__process_commands()
+                if not self.running or self.__quit:
+                    return
+            else:
+                time.sleep(0)  # spin, but let other threads have the GIL
+
+    def __read(self, read):
+        start = time.perf_counter()
+        channels = read()
+        self.latency.record('i2c_read', time.perf_counter() - start)
+        return channels
+
+    def __wait_for_alert(self, timeout):
+        end = self.clock.monotonic() + timeout
+        while not self.__alert.is_set():
+            remaining = end - self.clock.monotonic()
+            if remaining <= 0:
+                break
+            self.clock.wait(self.__wake, remaining)
+            self.__wake.clear()
+            self.__process_commands()
+            if not self.running or self.__quit:
+                return
+        self.__alert.clear()
+
+    def __process_commands(self):
+        while True:
+            try:
+                command, args = self.commands.popleft()
+            except IndexError:
+                return
+
+            if command == 'start':
+                self.__start(*args)
+            elif command == 'stop':
+                self.__stop('stopped')
+            elif command == 'set':
+                name, value = args
+                previous = self.params.get(name)
+                self.params[name] = value
+                if name == 'MODE' and self.running and value != previous:
+                    # Hand the outputs over cleanly between PWM and on/off control
+                    self.manager.all_heaters_off()
+                    if value == 'autotune':
+                        self.__start_autotune()
+            elif command == 'gains':
+                for channel in self.__select(args[3:]):
+                    channel.pid.Kp, channel.pid.Ki, channel.pid.Kd = args[:3]
+            elif command == 'relay':
+                relay, state = args
+                self.io.set_relay(relay, state)
+                self.relays = dict(self.relays, **{str(relay): bool(state)})
+            elif command == 'pwm':
+                self.manager.configure_pwm(*args)
+            elif command == 'adc_resolution':
+                self.manager.set_adc_resolution(args[0])
+            elif command == 'tc_filter':
+                self.params['TC_FILTER'] = args[0]
+                for channel in self.__select(args[1:]):
+                    channel.tc.write_tc_filter_value(args[0])
+            elif command == 'quit':
+                self.__stop('stopped')
+                self.__quit = True
+
+    def __select(self, index):
+        # Commands address one channel by index, or all of them
+        if index:
+            return [self.channels[index[0]]]
+        return self.channels
+
+    def __alert_edge(self, pin):
+        # Called from the RPi.GPIO event thread
+        self.__edge_time = time.perf_counter()
+        self.__alert.set()
+        self.__wake.set()
+
+    def __start(self, params=None):
+        if params:
+            self.params.update(params)
+        if self.params['SAMPLE_MODE'] == 'alert':
+            self.io.add_edge_callback(self.params['ALERT_PIN'], self.__alert_edge)
+        self.data_idx = 0
+        self.runner = None
+        if self.params['PROFILE'] is not None and self.params['MODE'] != 'autotune':
+            self.runner = ProfileRunner(self.params['PROFILE'])
+        self.setpoint = self.params['SETPT']
+        self.feed_forward = 0.0
+        self.analytics = [ChannelAnalytics(channel.index, self.params['SETTLE_BAND'], self.params['HEATER_WATTS'])
+                          for channel in self.channels]
+        self.stats = []
+        for channel in self.channels:
+            channel.duty_cycle = 0
+            channel.correction = 0
+            channel.pid.SetDerivativeFilter(self.params['D_FILTER'])
+            channel.pid.Initialize()
+            channel.autotune = None
+        if self.params['MODE'] == 'autotune':
+            self.__start_autotune()
+        if self.params['MODE'] == 'pid':
+            self.manager.start_pwm()
+        self.start_time = self.clock.monotonic()
+        self.running = True
+        if self.logger is not None:
+            pid = self.channels[0].pid
+            run_params = dict(self.params, P=pid.Kp, I=pid.Ki, D=pid.Kd,
+                              CHANNELS=[channel.name for channel in self.channels])
+            self.logger.start_run(run_params)
+
+    def __start_autotune(self):
+        # Also used when MODE switches to autotune mid-run; the first cycle is discarded anyway
+        for channel in self.channels:
+            channel.autotune = RelayAutotune(self.params['SETPT'], self.params['HYSTERESIS'])
+
+    def __stop(self, status='complete'):
+        if self.running and self.params['SAMPLE_MODE'] == 'alert':
+            self.io.remove_edge_callback(self.params['ALERT_PIN'])
+        if self.running and self.logger is not None:
+            self.logger.stats(self.stats)
+            self.logger.event('latency', json.dumps(self.latency.snapshot()['stages']))
+            self.logger.end_run(status)
+        was_running = self.running
+        self.running = False
+        self.manager.all_heaters_off()
+        self.status = tuple(status._replace(heater=False, duty=0.0) for status in self.status)
+        if was_running:
+            self.__event('run_finished', None, status)
+
+    def __event(self, name, channel, data):
+        self.events.append((name, channel, data))
+        for listener in self.listeners:
+            listener('event', (name, channel, data))
+        if self.logger is not None:
+            self.logger.event(name, '{} {}'.format(channel, data))
+
+    def __tick(self, channels, fired):
+        control_start = time.perf_counter()
+        gpio_seconds = self.manager.gpio_seconds
+        timestamp = self.clock.monotonic() - self.start_time
+        if channels:
+            self.data_idx += 1
+
+        if self.runner is not None:
+            self.setpoint = self.runner.update(timestamp, [c.temperature for c in self.channels])
+            self.feed_forward = self.runner.feed_forward
+            if self.runner.changed and not self.runner.done:
+                segment = self.runner.segments[self.runner.index]
+                self.__event('segment', None, (self.runner.index, segment.kind, segment.target))
+        else:
+            self.setpoint = self.params['SETPT']
+
+        new_step = None if self.runner is None else self.runner.changed and not self.runner.done
+        status = list(self.status)
+        for channel in channels:
+            tempc = channel.temperature
+            if tempc != tempc:  # NaN, sensor did not answer
+                if self.params['MODE'] == 'pid':
+                    # The PWM engine owns the pin and would keep firing at the last duty
+                    self.manager.set_duty(channel, 0.0)
+                else:
+                    self.manager.set_heater(channel, False)
+            elif self.params['MODE'] == 'pid':
+                self.__pid_step(channel, tempc)
+            elif self.params['MODE'] == 'autotune':
+                self.__autotune_step(channel, tempc, timestamp)
+            else:
+                self.__bang_bang_step(channel, tempc)
+
+            if self.params['MODE'] == 'pid':
+                duty = channel.duty_cycle
+            else:
+                duty = 1.0 if channel.heater_on else 0.0
+            sample = Sample(timestamp, tempc, self.setpoint, channel.correction,
+                            duty, channel.heater_on, channel.index)
+            self.samples.append(sample)
+            # A profile ramp moves the setpoint every tick, only a new segment is a new step
+            self.analytics[channel.index].update(sample, new_step)
+            for listener in self.listeners:
+                listener('sample', sample)
+            pid = channel.pid
+            status[channel.index] = ChannelStatus(channel.name, timestamp, tempc, self.setpoint, channel.correction,
+                                                  duty, channel.heater_on, pid.Cp, pid.Ci, pid.Cd,
+                                                  status[channel.index].samples + 1)
+            if self.logger is not None:
+                self.logger.log(sample)
+        if channels:
+            self.stats = [analytics.snapshot() for analytics in self.analytics]
+            self.status = tuple(status)
+        self.ticks += 1
+
+        end = time.perf_counter()
+        gpio_seconds = self.manager.gpio_seconds - gpio_seconds
+        self.latency.record('gpio_write', gpio_seconds)
+        self.latency.record('control', end - control_start - gpio_seconds)
+        self.latency.record('tick', end - fired)
+
+        if self.logger is not None and self.logger.error is not None:
+            # The database has refused the run's rows for too long, stop instead of queueing them forever
+            self.__stop('error')
+            self.__event('error', None, 'Run log: {}'.format(self.logger.error))
+        elif self.runner is not None:
+            # A profile ends the run itself, SECONDS does not apply
+            if self.runner.done:
+                self.__stop(self.runner.status)
+        elif timestamp > self.params['SECONDS']:
+            self.__stop()
+        elif self.params['MODE'] == 'autotune' and all(c.autotune.done for c in self.channels):
+            self.__stop()
+
+    def __bang_bang_step(self, channel, tempc):
+        setpt = self.setpoint
+
+        proc_error = setpt - tempc
+        channel.correction = channel.pid.GenOut(proc_error)
+
+        heater = bang_bang(channel.heater_on, tempc, setpt, self.params['HYSTERESIS'])
+        if heater != channel.heater_on:
+            self.manager.set_heater(channel, heater)
+
+    def __autotune_step(self, channel, tempc, timestamp):
+        tuner = channel.autotune
+        if tuner.done:
+            return
+        heater = tuner.update(timestamp, tempc)
+        if heater != channel.heater_on:
+            self.manager.set_heater(channel, heater)
+        if tuner.done:
+            if tuner.failed:
+                self.__event('autotune_failed', channel.index, None)
+            else:
+                gains = tuner.pid_gains(self.params['AUTOTUNE_RULE'])
+                channel.pid.Kp, channel.pid.Ki, channel.pid.Kd = gains
+                self.__event('autotune', channel.index, gains)
+
+    def __pid_step(self, channel, tempc):
+        # The PWM engine owns the heater output, the controller only sets duty
+        setpt = self.setpoint
+        if setpt <= 0:
+            self.manager.set_duty(channel, 0.0)
+            return
+        error = setpt - tempc
+        # duty 0..1 is feed-forward + correction / SETPT; clamping the PID to
+        # that range stops integral windup
+        ff = self.feed_forward
+        channel.pid.SetOutputLimits(-ff * setpt, (1.0 - ff) * setpt)
+        channel.correction = channel.pid.GenOut(error, tempc)
+        self.manager.set_duty(channel, ff + channel.correction / setpt)
@@ -0,0 +1,50 @@
+import sqlite3
+
+
+def database_name(db):
+    """ File name of a QSqlDatabase, or the path itself when given a path. """
+    if isinstance(db, str):
+        return db
+    return db.databaseName()
+
+
+def ensure_tables(db, schema, seeds=()):
+    """ Create missing tables and add missing seed rows.
+
+        schema is a list of CREATE ... IF NOT EXISTS statements, seeds a list
+        of (INSERT OR IGNORE statement, rows). Rows already in the database
+        are never changed, so user settings survive.
+    """
+    conn = sqlite3.connect(database_name(db))
+    try:
+        for statement in schema:
+            conn.execute(statement)
+        for statement, rows in seeds:
+            conn.executemany(statement, rows)
+        # An ignored insert still rewrites the file header, leave an up to date file untouched
+        if conn.total_changes:
+            conn.commit()
+        else:
+            conn.rollback()
+    finally:
+        conn.close()
+
+
+def table_to_dictionary(db, tblname):
+    """ Rows of tblname as a list of {column: value} dictionaries.
+
+        db is either an open QSqlDatabase, read through quieres, or the path
+        of the SQLite file, read with the sqlite3 module so that headless
+        code never has to import PyQt5.
+    """
+    if not isinstance(db, str):
+        import quieres
+        return quieres.db_table_data_to_dictionary(db, tblname)
+
+    conn = sqlite3.connect(db)
+    try:
+        cursor = conn.execute("SELECT * FROM " + tblname)
+        column_names = [column[0] for column in cursor.description]
+        return [dict(zip(column_names, row)) for row in cursor]
+    finally:
+        conn.close()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+""" Export recorded runs from HtrTest.db.
+
+    Samples are streamed out of tblSamples with fetchmany, so memory use is
+    bounded by the chunk size whatever the length of the run. A run logged
+    with SAMPLE_STORE 'file' has no tblSamples rows; its samples are read
+    from the sample_file named by the run's 'sample_file' event instead.
+    The output format follows the file name:
+
+        .csv / .csv.gz        streaming CSV, metadata in a .json sidecar
+        .parquet              Apache Parquet, zstd compressed row groups
+        .arrow / .feather     Arrow IPC file, zstd compressed record batches
+        .h5 / .hdf5           HDF5, one chunked gzip dataset per column
+
+    Parquet/Arrow need pyarrow and HDF5 needs h5py; they are only imported
+    when that format is asked for.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sqlite3
+
+COLUMNS = ('timestamp', 'channel', 'temperature', 'setpoint', 'output', 'duty', 'heater')
+SELECT_SAMPLES = ("SELECT TIMESTAMP, CHANNEL, TEMPERATURE, SETPOINT, OUTPUT, DUTY, HEATER "
+                  "FROM tblSamples WHERE FK_RUN_ID = ?")
+
+
+def run_metadata(conn, run_id):
+    """ The run row (mode, setpoint, gains, TC filter...) plus the current tblParameters. """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tblRuns'").fetchone() is None:
+        raise ValueError("No runs have been logged to this database")
+    cursor = conn.execute("SELECT * FROM tblRuns WHERE PK_ID = ?", (run_id,))
+    row = cursor.fetchone()
+    if row is None:
+        raise ValueError("No run {} in tblRuns".format(run_id))
+    metadata = dict(zip([column[0] for column in cursor.description], row))
+    if metadata.get('PARAMS'):
+        metadata['PARAMS'] = json.loads(metadata['PARAMS'])
+    metadata['parameters'] = dict(conn.execute("SELECT PARAMETER, VALUE FROM tblParameters"))
+    return metadata
+
+
+def sample_file_path(conn, run_id):
+    """ Path of the run's sample file, None if it was not recorded to one. """
+    row = conn.execute("SELECT DETAIL FROM tblEvents WHERE FK_RUN_ID = ? AND NAME = 'sample_file' "
+                       "ORDER BY PK_ID DESC LIMIT 1", (run_id,)).fetchone()
+    return row[0] if row else None
+
+
+def iter_file_chunks(path, channel=None, chunk=50000):
+    """ iter_chunks rows read from a sample_file, one channel after the other. """
+    from sample_file import SampleFile
+    recording = SampleFile(path)
+    records = recording.records
+    channels = range(max(1, len(recording.channels))) if channel is None else [channel]
+    for index in channels:
+        # Channels are interleaved, so scan the file once per channel a block at a time
+        for start in range(0, len(records), chunk):
+            block = records[start:start + chunk]
+            block = block[block['channel'] == index]
+            if len(block):
+                yield list(zip(*(block[column].tolist() for column in COLUMNS)))
+
+
+def iter_chunks(conn, run_id, channel=None, chunk=50000):
+    """ Yield lists of sample rows in timestamp order, at most `chunk` at a time. """
+    if conn.execute("SELECT 1 FROM tblSamples WHERE FK_RUN_ID = ? LIMIT 1", (run_id,)).fetchone() is None:
+        path = sample_file_path(conn, run_id)
+        if path is not None:
+            if not os.path.exists(path):
+                raise ValueError("Samples of run {} are in {}, which does not exist".format(run_id, path))
+            yield from iter_file_chunks(path, channel, chunk)
+            return
+    query = SELECT_SAMPLES
+    args = [run_id]
+    if channel is not None:
+        query += " AND CHANNEL = ?"
+        args.append(channel)
+    cursor = conn.execute(query + " ORDER BY CHANNEL, TIMESTAMP", args)
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            return
+        yield rows
+
+
+def export_csv(chunks, path, metadata):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for rows in chunks:
+            writer.writerows(rows)
+    with open(path + '.json', 'w') as f:
+        json.dump(metadata, f, indent=2, default=str)
+
+
+def _arrow_batches(chunks):
+    import pyarrow
+    types = (pyarrow.float64(), pyarrow.uint8(), pyarrow.float64(), pyarrow.float64(),
+             pyarrow.float64(), pyarrow.float64(), pyarrow.uint8())
+    schema = pyarrow.schema(list(zip(COLUMNS, types)))
+    batches = (pyarrow.record_batch([pyarrow.array(column, type=t) for column, t in zip(zip(*rows), types)],
+                                    schema=schema)
+               for rows in chunks)
+    return schema, batches
+
+
+def export_parquet(chunks, path, metadata):
+    import pyarrow.parquet
+    schema, batches = _arrow_batches(chunks)
+    schema = schema.with_metadata({'heatertest': json.dumps(metadata, default=str)})
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def export_arrow(chunks, path, metadata):
+    import pyarrow
+    import pyarrow.ipc
+    schema, batches = _arrow_batches(chunks)
+    schema = schema.with_metadata({'heatertest': json.dumps(metadata, default=str)})
+    options = pyarrow.ipc.IpcWriteOptions(compression='zstd')
+    with pyarrow.OSFile(path, 'wb') as sink, pyarrow.ipc.new_file(sink, schema, options=options) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def export_hdf5(chunks, path, metadata, chunk=50000):
+    import h5py
+    import numpy
+    types = ('f8', 'u1', 'f8', 'f8', 'f8', 'f8', 'u1')
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('samples')
+        datasets = [group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=t,
+                                         chunks=(min(chunk, 65536),), compression='gzip', shuffle=True)
+                    for name, t in zip(COLUMNS, types)]
+        for rows in chunks:
+            start = datasets[0].shape[0]
+            for dataset, column in zip(datasets, zip(*rows)):
+                dataset.resize((start + len(rows),))
+                dataset[start:] = numpy.asarray(column, dtype=dataset.dtype)
+        f.attrs['metadata'] = json.dumps(metadata, default=str)
+
+
+EXPORTERS = (
+    ('.csv.gz', export_csv),
+    ('.csv', export_csv),
+    ('.parquet', export_parquet),
+    ('.arrow', export_arrow),
+    ('.feather', export_arrow),
+    ('.h5', export_hdf5),
+    ('.hdf5', export_hdf5),
+)
+
+
+def export_run(db_path, run_id, path, channel=None, chunk=50000):
+    for suffix, exporter in EXPORTERS:
+        if path.endswith(suffix):
+            break
+    else:
+        raise ValueError("Unknown export format for {}".format(path))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        metadata = run_metadata(conn, run_id)
+        exporter(iter_chunks(conn, run_id, channel, chunk), path, metadata)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a recorded heater run')
+    parser.add_argument('run_id', type=int)
+    parser.add_argument('output', help='.csv, .csv.gz, .parquet, .arrow, .feather, .h5 or .hdf5')
+    parser.add_argument('--db', default='HtrTest.db')
+    parser.add_argument('--channel', type=int, default=None)
+    parser.add_argument('--chunk', type=int, default=50000)
+    args = parser.parse_args()
+    export_run(args.db, args.run_id, args.output, args.channel, args.chunk)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from PyQt5 import QtCore, QtWidgets
+
+import latency
+
+COLUMNS = ('count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'p999_ms', 'max_ms')
+
+
+class DiagnosticsDialog(QtWidgets.QDialog):
+    """ Live control loop latency percentiles from a latency.LoopLatency. """
+
+    def __init__(self, loop_latency, parent=None):
+        super(DiagnosticsDialog, self).__init__(parent)
+        self.latency = loop_latency
+        self.setWindowTitle("Control Loop Latency")
+        self.resize(640, 260)
+
+        self.table = QtWidgets.QTableWidget(len(latency.STAGES), len(COLUMNS), self)
+        self.table.setVerticalHeaderLabels(latency.STAGES)
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+
+        self.btnSave = QtWidgets.QPushButton("Save JSON...", self)
+        self.btnSave.released.connect(self.__save)
+        self.btnReset = QtWidgets.QPushButton("Reset", self)
+        self.btnReset.released.connect(self.__reset)
+
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addStretch()
+        buttons.addWidget(self.btnReset)
+        buttons.addWidget(self.btnSave)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+
+        # Percentiles are computed from a copy of the counts, once a second is plenty
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    def refresh(self):
+        stages = self.latency.snapshot()['stages']
+        for row, stage in enumerate(latency.STAGES):
+            for column, key in enumerate(COLUMNS):
+                value = stages[stage][key]
+                text = '--' if value is None else str(value) if key == 'count' else "{:.3f}".format(value)
+                self.table.setItem(row, column, QtWidgets.QTableWidgetItem(text))
+
+    def __reset(self):
+        self.latency.reset()
+        self.refresh()
+
+    def __save(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save latency", "latency.json", "JSON (*.json)")
+        if path:
+            self.latency.dump(path)
@@ -1,41 +1,59 @@
-import RPi.GPIO as GPIO
-import numpy
-from PyQt5 import QtCore, QtWidgets, uic
+import time
+
+from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtCore import QTimer
-from PyQt5.QtSql import QSqlQuery
-from PyQt5.QtWidgets import QApplication
+from frmDiagnostics import DiagnosticsDialog
+from frmRecording import RecordingDialog
 from QLed import QLed
+from ring_buffer import SampleRingBuffer
+import run_analytics
+import setpoint_profile
+import uicache
+
+MAX_PLOT_POINTS = 2000  # samples drawn per redraw, whatever the run length
+
+# mainwindow.ui compiled to ui_mainwindow.py on first use, see uicache
+Ui_MainWindow = uicache.load_ui('mainwindow.ui', 'ui_mainwindow').Ui_MainWindow
 
-class ApplicationWindow(QtWidgets.QMainWindow):
+class ApplicationWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
-    def __init__(self, db, tc, io, pid):
+    def __init__(self, db, params, worker=None):
         super(ApplicationWindow, self).__init__()
         self.db = db
-        self.tc = tc  # Thermocouple
-        self.io = io
-        self.pid = pid
-        self.temperature_data = [] # list of tempeatures to be plotted
+        self.worker = None  # owns the thermocouple, PID and GPIO, see attach()
+        self.params = params  # cached tblParameters
+        self.samples = SampleRingBuffer()  # samples to be plotted
+        self.channel = 0  # channel shown on the plot and LCD
+        self.plot_window = 0  # seconds of data shown, 0 = whole test
+        self.plot_decimate = 1  # plot every n-th sample
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
         self.control_mode = 'bang_bang'
-        self.win = uic.loadUi('mainwindow.ui', self)
-        self.duty_cycle = 0
+        self.setupUi(self)
+        self.win = self
 
         # dict = quieres.db_fetch_table_data(self.db, 'tblPlotSettings')
 
-        self.show()
-
         self.__plot_config()
-        self.data_idx = 0
-        self.seconds_elapsed = [0]
 
-        self.pid.Initialize()
         self.__init_ui()
 
-        self.set_callback_ftns()
-        self.read_params_from_db()
-
+        # Style before the first show, restyling a visible window repolishes every widget
         self.setStyleSheet(open("HeaterTest.css", "r").read())
         self.timer = QTimer(self)
+        self.timer.timeout.connect(self.__process_samples)
+        if worker is not None:
+            self.attach(worker)
+
+    def attach(self, worker):
+        """ Connect the control worker once the hardware is up.
+
+            The window can be built while the I2C buses are still being
+            initialized; nothing talks to the worker before this call.
+        """
+        self.worker = worker
+        self.set_callback_ftns()
+        self.read_params_from_db()
+        self.timer.start(100)
 
     def set_callback_ftns(self):
 
@@ -62,10 +80,28 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
         hysteresis = int(self.db_select_parameter('HYSTERESIS'))
         self.win.spinHysteresisC.setValue(hysteresis)
+        self.worker.send('set', 'HYSTERESIS', hysteresis)
 
         tc_filter = int(self.db_select_parameter('TC_FILTER'))
         self.win.dialTcFilter.setValue(tc_filter)
-        self.tc.write_tc_filter_value(tc_filter)
+        self.worker.send('tc_filter', tc_filter)
+
+        adc_resolution = int(self.db_select_parameter('ADC_RES', 18))
+        self.worker.send('adc_resolution', adc_resolution)
+        self.worker.send('set', 'SAMPLE_MODE', self.db_select_parameter('SAMPLE_MODE', 'timer'))
+        self.worker.send('set', 'ALERT_PIN', self.db_select_parameter('ALERT_PIN', 'BCM17'))
+
+        self.worker.send('set', 'AUTOTUNE_RULE', self.db_select_parameter('AUTOTUNE_RULE', 'classic'))
+        self.worker.send('set', 'D_FILTER', float(self.db_select_parameter('D_FILTER', 0.0)))
+        self.worker.send('set', 'SETTLE_BAND', float(self.db_select_parameter('SETTLE_BAND', 1.0)))
+        self.worker.send('set', 'HEATER_WATTS', float(self.db_select_parameter('HEATER_WATTS', 0.0)))
+        self.worker.send('set', 'SAMPLE_STORE', self.db_select_parameter('SAMPLE_STORE', 'db'))
+        self.worker.send('pwm', self.db_select_parameter('PWM_MODE', 'soft'),
+                         float(self.db_select_parameter('PWM_PERIOD', 1.0)),
+                         int(self.db_select_parameter('PWM_RESOLUTION', 100)))
+
+        self.plot_window = int(self.db_select_parameter('PLOT_WINDOW', 0))
+        self.plot_decimate = max(1, int(self.db_select_parameter('PLOT_DECIMATE', 1)))
 
         max_temp = int(self.db_select_parameter('MAX_TEMP'))
         self.win.spinMaxTempC.setValue(max_temp)
@@ -84,14 +120,10 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
         self.__set_control_mode()
 
-        self.pid.Kp = float(self.db_select_parameter('P'))
-        self.win.spinP.setValue(self.pid.Kp)
-
-        self.pid.Ki = float(self.db_select_parameter('I'))
-        self.win.spinI.setValue(self.pid.Ki)
-
-        self.pid.Kd = float(self.db_select_parameter('D'))
-        self.win.spinD.setValue(self.pid.Kd)
+        self.win.spinP.setValue(float(self.db_select_parameter('P')))
+        self.win.spinI.setValue(float(self.db_select_parameter('I')))
+        self.win.spinD.setValue(float(self.db_select_parameter('D')))
+        self.__send_gains()
 
         for i in range(1, 4, 1):
             r_state = int(self.db_select_parameter('RELAY' + str(i)))
@@ -101,8 +133,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
                 self.win.chkRelay2.setChecked(r_state)
             elif i == 3:
                 self.win.chkRelay3.setChecked(r_state)
-            pin = self.io.pin_map['RELAY' + str(i)]
-            GPIO.output(pin, not r_state)
+            self.worker.send('relay', i, r_state)
 
     def __init_ui(self):
         self.slide_switch_config()
@@ -115,9 +146,16 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         self.setWindowTitle("Aux Heater Test")
 
         self.file_menu = QtWidgets.QMenu('&File', self)
+        self.file_menu.addAction('Open &Recording...', self.open_recording)
         self.file_menu.addAction('&Quit', self.file_quit, QtCore.Qt.CTRL + QtCore.Qt.Key_Q)
         self.menuBar().addMenu(self.file_menu)
 
+        self.tools_menu = QtWidgets.QMenu('&Tools', self)
+        self.tools_menu.addAction('&Auto Tune PID', self.start_autotune)
+        self.tools_menu.addAction('Run &Profile...', self.start_profile)
+        self.tools_menu.addAction('&Diagnostics...', self.show_diagnostics)
+        self.menuBar().addMenu(self.tools_menu)
+
         self.help_menu = QtWidgets.QMenu('&Help', self)
         self.menuBar().addSeparator()
         self.menuBar().addMenu(self.help_menu)
@@ -261,11 +299,12 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
     def __update_hysteresis(self):
         value = self.win.spinHysteresisC.value()
+        self.worker.send('set', 'HYSTERESIS', value)
         self.db_update_parameter("HYSTERESIS", str(value))
 
     def __tc_filter_change(self):
         value = self.win.dialTcFilter.value()
-        self.tc.write_tc_filter_value(value)
+        self.worker.send('tc_filter', value)
         self.db_update_parameter("TC_FILTER", str(value))
 
     def __relay1_operate(self):
@@ -275,9 +314,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             relay_state = 0
 
         self.db_update_parameter("RELAY1", str(relay_state))
-
-        pin = self.io.pin_map['RELAY1']
-        GPIO.output(pin, not relay_state)
+        self.worker.send('relay', 1, relay_state)
 
     def __relay2_operate(self):
         if self.win.chkRelay2.isChecked():
@@ -286,9 +323,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             relay_state = 0
 
         self.db_update_parameter("RELAY2", str(relay_state))
-
-        pin = self.io.pin_map['RELAY2']
-        GPIO.output(pin, not relay_state)
+        self.worker.send('relay', 2, relay_state)
 
     def __relay3_operate(self):
         if self.win.chkRelay3.isChecked():
@@ -297,35 +332,42 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             relay_state = 0
 
         self.db_update_parameter("RELAY3", str(relay_state))
+        self.worker.send('relay', 3, relay_state)
 
-        pin = self.io.pin_map['RELAY3']
-        GPIO.output(pin, not relay_state)
+    def __send_gains(self):
+        self.worker.send('gains', self.win.spinP.value(), self.win.spinI.value(), self.win.spinD.value())
 
     def __set_p(self):
+        self.__send_gains()
         self.db_update_parameter('P', self.win.spinP.value())
 
     def __set_i(self):
+        self.__send_gains()
         self.db_update_parameter('I', self.win.spinI.value())
 
     def __set_d(self):
+        self.__send_gains()
         self.db_update_parameter('D', self.win.spinD.value())
 
     def __update_setpoint(self):
+        self.worker.send('set', 'SETPT', self.win.spinSetptC.value())
         self.db_update_parameter('SETPT', self.win.spinSetptC.value())
 
     def __update_duration(self):
+        self.worker.send('set', 'SECONDS', self.win.spinTestSeconds.value())
         self.db_update_parameter('SECONDS', self.win.spinTestSeconds.value())
 
     def __update_max_temp(self):
         self.db_update_parameter('MAX_TEMP', self.win.spinMaxTempC.value())
 
     def file_quit(self):
-        self.io.turn_heater_off()
         self.close()
 
     def closeEvent(self, ce):
-        self.io.turn_heater_off()
-        self.file_quit()
+        self.timer.stop()
+        if self.worker is not None:
+            self.worker.shutdown()
+        self.params.close()
 
     def about(self):
         QtWidgets.QMessageBox.about(self, "About",
@@ -339,6 +381,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         # Using Bang Bang Mode
         if self.win.slide_bb_pid.isChecked() == True:
             self.control_mode = 'bang_bang'
+            self.worker.send('set', 'MODE', 'bang_bang')
             self.db_update_parameter('MODE', 'bang_bang')
             self.win.spinHysteresisC.show()
             self.win.lblHysteresis.show()
@@ -351,6 +394,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         # Using PID Mode
         else:
             self.control_mode = 'pid'
+            self.worker.send('set', 'MODE', 'pid')
             self.db_update_parameter('MODE', 'pid')
             self.win.spinHysteresisC.hide()
             self.win.lblHysteresis.hide()
@@ -362,117 +406,140 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             self.win.lblD.show()
 
     def start_heater_test(self):
-        self.temperature_data.clear()
-
-        self.seconds_elapsed.clear()
-        self.seconds_elapsed = [0]
-        self.data_idx = 0
+        self.samples.clear()
         xmax = self.spinTestSeconds.value()
         ymax = self.spinSetptC.value() + 20
 
         self.graphicsView.setXRange(0, xmax)
         self.graphicsView.setYRange(20, ymax)
-        if self.control_mode == 'bang_bang':
-            self.timer.timeout.connect(self.__process_bang_bang_loop)
-        if self.control_mode == 'pid':
-            self.timer.timeout.connect(self.__process_pid_loop)
-        self.timer.start(1000)
+        self.worker.send('start', {
+            'MODE': self.control_mode,
+            'SETPT': self.spinSetptC.value(),
+            'HYSTERESIS': self.spinHysteresisC.value(),
+            'SECONDS': self.spinTestSeconds.value(),
+            'PROFILE': None,
+        })
+
+    def start_profile(self):
+        # Ramp/soak program from tblProfiles; the profile decides when the run ends
+        names = setpoint_profile.profile_names(self.db)
+        if not names:
+            self.statusBar().showMessage("No profiles in tblProfiles", 5000)
+            return
+        name, ok = QtWidgets.QInputDialog.getItem(self, "Run Profile", "Profile:", names, 0, False)
+        if not ok:
+            return
+        try:
+            profile = setpoint_profile.load_profile(self.db, name)
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self, "Run Profile", str(e))
+            return
+        self.samples.clear()
+        self.graphicsView.enableAutoRange()
+        self.worker.send('start', {
+            'MODE': self.control_mode,
+            'SETPT': self.spinSetptC.value(),
+            'HYSTERESIS': self.spinHysteresisC.value(),
+            'SECONDS': self.spinTestSeconds.value(),
+            'PROFILE': profile,
+        })
+        self.statusBar().showMessage("Profile {} running...".format(name))
+
+    def start_autotune(self):
+        # Relay oscillation around the setpoint, gains are stored when it settles
+        self.samples.clear()
+        self.graphicsView.setXRange(0, self.spinTestSeconds.value())
+        self.graphicsView.setYRange(20, self.spinSetptC.value() + 20)
+        self.worker.send('start', {
+            'MODE': 'autotune',
+            'SETPT': self.spinSetptC.value(),
+            'HYSTERESIS': self.spinHysteresisC.value(),
+            'SECONDS': self.spinTestSeconds.value(),
+            'PROFILE': None,
+        })
+        self.statusBar().showMessage("Auto tune running...")
+
+    def __process_events(self):
+        for name, channel, data in self.worker.drain_events():
+            # Run wide events carry no channel
+            if channel is None:
+                if name == 'segment':
+                    self.statusBar().showMessage("Profile segment {}: {} to {}".format(*data))
+                elif name == 'run_finished':
+                    self.win.widget_led.value = False
+                    self.statusBar().showMessage("Run {}".format(data), 10000)
+                elif name == 'error':
+                    self.win.widget_led.value = False
+                    self.statusBar().showMessage("Control error, heaters off: {}".format(data))
+                continue
+            if channel != self.channel:
+                continue
+            if name == 'autotune':
+                # The worker already applied the gains per channel, only store them
+                for spin, parameter, value in zip((self.win.spinP, self.win.spinI, self.win.spinD),
+                                                  ('P', 'I', 'D'), data):
+                    spin.blockSignals(True)
+                    spin.setValue(value)
+                    spin.blockSignals(False)
+                    self.db_update_parameter(parameter, value)
+                self.statusBar().showMessage(
+                    "Auto tune done: P={:.3f} I={:.5f} D={:.3f}".format(*data), 10000)
+            elif name == 'autotune_failed':
+                self.statusBar().showMessage("Auto tune failed: oscillation did not settle", 10000)
+
+    def show_diagnostics(self):
+        dialog = DiagnosticsDialog(self.worker.latency, self)
+        dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        dialog.show()
+
+    def open_recording(self):
+        # Sample files of runs with SAMPLE_STORE file or both, see run_logger
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Recording", "samples", "Sample files (*.hts)")
+        if not path:
+            return
+        try:
+            dialog = RecordingDialog(path, self)
+        except (OSError, ValueError) as e:
+            QtWidgets.QMessageBox.warning(self, "Open Recording", str(e))
+            return
+        dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        dialog.show()
 
     def stop_heater_test(self):
-        self.timer.stop()
-        self.io.turn_heater_off()
+        self.worker.send('stop')
         self.win.widget_led.value = False
 
-    def __process_bang_bang_loop(self):
-
-        tempc = self.tc.read_tc()
-        self.temperature_data.append(tempc)
-        self.win.lcdThermoCouple.display(tempc)
-        self.plot.setData(self.seconds_elapsed, self.temperature_data, clear=True)
-
-        self.data_idx += 1
-        self.seconds_elapsed.append(self.data_idx)
-
-        proc_error = self.win.spinSetptC.value() - tempc
-        control_value = self.pid.GenOut(proc_error)
-        print(control_value)
-
-        hysteresis = self.spinHysteresisC.value()
-        htr_pwr = self.io.pin_map['HTR_PWR1']
-
-        if GPIO.input(htr_pwr) == 0:  # Heater is off
-            if tempc <= self.spinSetptC.value() - (hysteresis / 2):
-                self.io.turn_heater_on()
-                self.win.widget_led.value = True
-
-        if GPIO.input(htr_pwr) == 1:  # Heater is on
-            if tempc >= self.spinSetptC.value() + (hysteresis / 2):
-                self.io.turn_heater_off()
-                self.win.widget_led.value = False
-
-        if self.data_idx > self.spinTestSeconds.value():
-            self.stop_heater_test()
-
-        QApplication.processEvents()
-
-    def __process_pid_loop(self):
-
-        self.pid.Kp = self.win.spinP.value()
-        self.pid.Ki = self.win.spinI.value()
-        self.pid.Kd = self.win.spinD.value()
-
-        period = 10.0  # PWM period is 10 seconds
-
-        tempc = self.tc.read_tc()
-        self.temperature_data.append(tempc)
-        self.win.lcdThermoCouple.display(tempc)
-        self.plot.setData(self.seconds_elapsed, self.temperature_data, clear=True)
-
-        self.data_idx += 1
-        self.seconds_elapsed.append(self.data_idx)
-
-        htr_pwr = self.io.pin_map['HTR_PWR1']
-
-        if self.data_idx % 10 == 0 or self.data_idx == 0:
-            error = self.win.spinSetptC.value() - tempc
-            correction = self.pid.GenOut(error)
-            self.win.lblPidCorrection.setText("{:.1f}".format(correction))
-
-            control_percent = (correction / self.win.spinSetptC.value()) * 100
-
+    def __process_samples(self):
+        # Runs on the GUI thread; only consumes what the control worker produced
+        start = time.perf_counter()
+        self.__process_events()
+        samples = [s for s in self.worker.drain_samples() if s.channel == self.channel]
+        if not samples:
+            return
+
+        self.samples.extend(samples)
+
+        last = samples[-1]
+        self.win.lcdThermoCouple.display(last.temperature)
+        self.win.widget_led.value = last.heater
+        if self.control_mode == 'pid' and last.setpoint:
+            self.win.lblPidCorrection.setText("{:.1f}".format(last.output))
+            control_percent = (last.output / last.setpoint) * 100
             self.win.lblPidControlPercent.setText("{:.1f}".format(control_percent))
+        stats = self.worker.stats
+        if self.channel < len(stats):
+            self.win.lblRunStats.setText(run_analytics.summary(stats[self.channel]))
 
-            self.duty_cycle = (control_percent / 100) * period
-
-        i = self.data_idx % 10
-        print(i)
-        if i <= self.duty_cycle:
-            GPIO.output(htr_pwr, 1)
-            self.win.widget_led.value = True
-        else:
-            GPIO.output(htr_pwr, 0)
-            self.win.widget_led.value = False
-
-        if self.data_idx > self.spinTestSeconds.value():
-            self.stop_heater_test()
-
-        QApplication.processEvents()
+        # At most MAX_PLOT_POINTS are redrawn, even for the whole test (PLOT_WINDOW 0)
+        visible = self.samples.window(self.plot_window, self.plot_decimate, MAX_PLOT_POINTS)
+        self.plot.setData(visible['timestamp'], visible['temperature'])
+        if self.plot_window > 0:
+            self.graphicsView.setXRange(max(0, last.timestamp - self.plot_window), last.timestamp)
+        self.worker.latency.record('plot_update', time.perf_counter() - start)
 
     def db_update_parameter(self, parameter, value):
-        query = QSqlQuery(self.db)
-        qrytxt = ('UPDATE tblParameters '
-                  'SET VALUE = \'{v}\' '
-                  'WHERE PARAMETER = \'{p}\'') \
-            .format(v=value, p=parameter)
-        query.exec(qrytxt)
-
-    def db_select_parameter(self, parameter):
-        query = QSqlQuery(self.db)
-        qrytxt = ("SELECT VALUE from tblParameters WHERE PARAMETER = '{p}'") \
-            .format(p=parameter)
-
-        query.exec(qrytxt)
-        lst = []
-        while query.next():
-            lst.append(query.value(0))
-        return lst[0]
+        # Memory first; the store coalesces and writes to tblParameters in the background
+        self.params.set(parameter, value)
+
+    def db_select_parameter(self, parameter, default=None):
+        return self.params.get(parameter, default)
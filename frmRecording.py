@@ -0,0 +1,73 @@
+import os
+
+import pyqtgraph
+from PyQt5 import QtCore, QtWidgets
+
+import run_analytics
+from sample_file import SampleFile
+
+MAX_POINTS = 5000  # samples drawn per redraw, whatever the zoom
+
+
+class RecordingDialog(QtWidgets.QDialog):
+    """ Browse a sample_file recording of any length.
+
+        Only the visible time range is read, found through the file index
+        and decimated to about MAX_POINTS, so panning a week-long soak run
+        costs the same as a short one.
+    """
+
+    def __init__(self, path, parent=None):
+        super(RecordingDialog, self).__init__(parent)
+        self.recording = SampleFile(path)
+        self.setWindowTitle(os.path.basename(path))
+        self.resize(900, 520)
+
+        self.cmbChannel = QtWidgets.QComboBox(self)
+        self.cmbChannel.addItems(self.recording.channels or ['0'])
+        self.cmbChannel.currentIndexChanged.connect(self.__redraw)
+        self.lblStats = QtWidgets.QLabel(self)
+        self.btnAnalyse = QtWidgets.QPushButton("Analyse View", self)
+        self.btnAnalyse.released.connect(self.__analyse)
+
+        self.graphicsView = pyqtgraph.PlotWidget(self)
+        self.graphicsView.setBackground('w')
+        self.graphicsView.showGrid(x=True, y=True)
+        self.graphicsView.getAxis('bottom').setLabel("<b>Time</b>", "<b>Seconds</b>")
+        self.graphicsView.getAxis('left').setLabel("<b>Temperature</b>", "<b>°C</b>")
+        self.plot = self.graphicsView.plot(pen=(255, 0, 0))
+
+        controls = QtWidgets.QHBoxLayout()
+        controls.addWidget(self.cmbChannel)
+        controls.addWidget(self.lblStats, 1)
+        controls.addWidget(self.btnAnalyse)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.graphicsView)
+        layout.addLayout(controls)
+
+        # Panning changes the range on every mouse move, redraw once it pauses
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(50)
+        self.timer.timeout.connect(self.__redraw)
+        self.graphicsView.getViewBox().sigXRangeChanged.connect(lambda *args: self.timer.start())
+
+        span = self.recording.time_range()
+        if span is None:
+            self.lblStats.setText("No samples recorded")
+            return
+        self.graphicsView.setXRange(*span, padding=0)
+        self.__redraw()
+
+    def __view(self, max_points=None):
+        start, end = self.graphicsView.viewRange()[0]
+        return self.recording.window(start, end, self.cmbChannel.currentIndex(), max_points)
+
+    def __redraw(self):
+        visible = self.__view(MAX_POINTS)
+        self.plot.setData(visible['timestamp'], visible['temperature'])
+
+    def __analyse(self):
+        # Every sample in view, not the decimated plot
+        stats = run_analytics.analyse(self.__view())
+        self.lblStats.setText(run_analytics.summary(stats[0]) if stats else "No samples in view")
@@ -0,0 +1,309 @@
+""" Hardware backends: real Raspberry Pi GPIO / I2C, or a simulated rack.
+
+    GPIO_config.io takes a gpio object with the RPi.GPIO module interface and
+    a clock; ChannelManager takes a bus_factory returning SMBus-like objects.
+    The real backends import RPi.GPIO and smbus2 (or smbus) only when they
+    are used, so everything else imports on any Linux box.
+
+    The simulation wires one FOPDT thermal plant (simulator.ThermalPlant) to
+    each enabled channel: the plant is heated by that channel's heater pin on
+    SimGpio and read back by an emulated MCP9600 on SimBus. With a
+    ScaledClock the whole loop, PWM included, runs `speed` times faster than
+    real time.
+"""
+import collections
+import math
+import random
+import threading
+import time
+
+from mcp9600 import (ADC_RESOLUTION, CONVERSION_TIME, REG_COLD_JUNCTION, REG_HOT_JUNCTION,
+                     REG_JUNCTION_DELTA, REG_RAW_ADC, REG_STATUS, STATUS_TH_UPDATED)
+from simulator import CERAMIC_150W
+
+REG_DEVICE_CONFIGURATION = 0x06
+REG_DEVICE_ID = 0x20
+DEVICE_ID = (0x40, 0x11)  # MCP9600, revision 1.1
+READ_ONLY_REGISTERS = (REG_HOT_JUNCTION, REG_JUNCTION_DELTA, REG_COLD_JUNCTION, REG_RAW_ADC, REG_DEVICE_ID)
+ADC_BITS = {code: bits for bits, code in ADC_RESOLUTION.items()}  # AdcResolution field -> bits
+
+
+# ----------------------------------------------------------------------
+# Clocks
+# ----------------------------------------------------------------------
+class SystemClock(object):
+    """ Real time. Every timed wait in the control path goes through a clock. """
+
+    @staticmethod
+    def monotonic():
+        return time.monotonic()
+
+    @staticmethod
+    def wait(event, timeout):
+        return event.wait(timeout)
+
+
+class ScaledClock(object):
+    """ Time running `speed` times faster than the wall clock.
+
+        Every thread that uses the same clock sees the same accelerated time,
+        so the control loop, PWM engine and plant stay consistent.
+    """
+
+    def __init__(self, speed=1.0):
+        self.speed = float(speed)
+        self.__origin = time.monotonic()
+
+    def monotonic(self):
+        return (time.monotonic() - self.__origin) * self.speed
+
+    def wait(self, event, timeout):
+        return event.wait(None if timeout is None else max(0.0, timeout) / self.speed)
+
+
+class VirtualClock(object):
+    """ Time that only moves when told to, for replaying recorded runs. """
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def wait(self, event, timeout):
+        if not event.is_set() and timeout is not None:
+            self.now += max(0.0, timeout)
+        return event.is_set()
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+# ----------------------------------------------------------------------
+# Real backends
+# ----------------------------------------------------------------------
+def rpi_gpio():
+    import RPi.GPIO as GPIO
+    return GPIO
+
+
+def smbus_factory(bus_num):
+    # smbus2 is a drop-in SMBus that adds the I2C_RDWR combined transfers
+    # MCP9600.read_snapshot uses; plain smbus still works, one read per register
+    try:
+        from smbus2 import SMBus
+    except ImportError:
+        from smbus import SMBus
+    return SMBus(bus_num)
+
+
+# ----------------------------------------------------------------------
+# Simulated backends
+# ----------------------------------------------------------------------
+class SimGpio(object):
+    """ In-memory stand-in for the RPi.GPIO module.
+
+        Output changes are passed to watchers (the heater plants), falling
+        edges on inputs can be injected with trigger().
+    """
+    BCM = 11
+    OUT = 0
+    IN = 1
+    PUD_UP = 22
+    FALLING = 32
+
+    def __init__(self):
+        self.levels = {}
+        self.__watchers = {}
+        self.__edge_callbacks = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self.levels.setdefault(pin, 1 if pull_up_down == self.PUD_UP else 0)
+
+    def output(self, pin, value):
+        value = 1 if value else 0
+        self.levels[pin] = value
+        for callback in self.__watchers.get(pin, ()):
+            callback(value)
+
+    def input(self, pin):
+        return self.levels.get(pin, 0)
+
+    def add_event_detect(self, pin, edge, callback=None):
+        self.__edge_callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.__edge_callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self.__edge_callbacks.clear()
+
+    def watch(self, pin, callback):
+        """ Call callback(level) whenever pin is written. """
+        self.__watchers.setdefault(pin, []).append(callback)
+
+    def trigger(self, pin):
+        callback = self.__edge_callbacks.get(pin)
+        if callback is not None:
+            callback(pin)
+
+
+class HeaterPlant(object):
+    """ One heater and its thermocouple, stepped lazily on the shared clock.
+
+        The heater level is integrated exactly between steps, so software
+        PWM and burst fire average out as on the real element. Each step of
+        dt seconds uses the same discrete FOPDT update as simulator.simulate.
+    """
+
+    def __init__(self, model, clock, dt=0.1, noise=0.0):
+        self.model = model
+        self.clock = clock
+        self.dt = dt
+        self.noise = noise
+        self.level = 0
+        self.__a = math.exp(-dt / model.tau)
+        self.__temperature = float(model.ambient)
+        self.__delay = collections.deque([0.0] * (int(round(model.dead_time / dt)) + 1))
+        self.__step_start = self.__last = clock.monotonic()
+        self.__on_time = 0.0
+        self.__lock = threading.Lock()
+
+    def set_level(self, level):
+        with self.__lock:
+            self.__advance(self.clock.monotonic())
+            self.level = level
+
+    def temperature(self):
+        with self.__lock:
+            self.__advance(self.clock.monotonic())
+            temperature = self.__temperature
+        if self.noise:
+            temperature += random.gauss(0.0, self.noise)
+        return temperature
+
+    def __advance(self, now):
+        while True:
+            step_end = self.__step_start + self.dt
+            if now < step_end:
+                self.__on_time += (now - self.__last) * self.level
+                self.__last = now
+                return
+            self.__on_time += (step_end - self.__last) * self.level
+            self.__delay.append(self.__on_time / self.dt)
+            duty = self.__delay.popleft()
+            ambient = self.model.ambient
+            self.__temperature = ambient + self.__a * (self.__temperature - ambient) \
+                + (1.0 - self.__a) * self.model.gain * duty
+            self.__on_time = 0.0
+            self.__last = self.__step_start = step_end
+
+
+def _encode_temperature(tempc):
+    # Inverse of mcp9600.decode_temperature, 0.0625 C/LSB two's complement
+    raw = int(round(tempc * 16)) & 0xFFFF
+    return [raw >> 8, raw & 0xFF]
+
+
+class SimMcp9600(object):
+    """ Register level MCP9600 emulation reading a HeaterPlant.
+
+        Configuration registers keep what was written to them. The TH update
+        status flag sets once a conversion time has passed since it was last
+        cleared, using the conversion time of the configured ADC resolution.
+    """
+
+    def __init__(self, plant, clock):
+        self.plant = plant
+        self.clock = clock
+        self.registers = {REG_DEVICE_ID: list(DEVICE_ID)}
+        self.__cleared = clock.monotonic()
+
+    def conversion_time(self):
+        code = (self.registers.get(REG_DEVICE_CONFIGURATION, [0])[0] >> 5) & 0x03
+        return CONVERSION_TIME[ADC_BITS[code]]
+
+    def read(self, register, length):
+        if register == REG_HOT_JUNCTION:
+            data = _encode_temperature(self.plant.temperature())
+        elif register == REG_COLD_JUNCTION:
+            data = _encode_temperature(self.plant.model.ambient)
+        elif register == REG_JUNCTION_DELTA:
+            data = _encode_temperature(self.plant.temperature() - self.plant.model.ambient)
+        elif register == REG_STATUS:
+            ready = self.clock.monotonic() - self.__cleared >= self.conversion_time()
+            data = [STATUS_TH_UPDATED if ready else 0]
+        else:
+            data = self.registers.get(register, [])
+        return (list(data) + [0] * length)[:length]
+
+    def write(self, register, data):
+        if register == REG_STATUS:
+            self.__cleared = self.clock.monotonic()
+        elif register not in READ_ONLY_REGISTERS:
+            self.registers[register] = list(data)
+
+
+class SimBus(object):
+    """ SMBus interface over a set of emulated devices, {address: device}. """
+
+    def __init__(self, devices):
+        self.devices = devices
+
+    def __device(self, i2c_addr):
+        try:
+            return self.devices[i2c_addr]
+        except KeyError:
+            raise OSError(121, "Remote I/O error: no device at 0x{:02x}".format(i2c_addr))
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        return self.__device(i2c_addr).read(register, length)
+
+    def read_byte_data(self, i2c_addr, register):
+        return self.__device(i2c_addr).read(register, 1)[0]
+
+    def write_byte_data(self, i2c_addr, register, value):
+        self.__device(i2c_addr).write(register, [value & 0xFF])
+
+    def write_word_data(self, i2c_addr, register, value):
+        # SMBus words go out low byte first
+        self.__device(i2c_addr).write(register, [value & 0xFF, (value >> 8) & 0xFF])
+
+    def close(self):
+        pass
+
+
+class Simulation(object):
+    """ Simulated rack built from the enabled rows of tblChannels.
+
+        Use io and bus_factory in place of the real ones:
+
+            sim = hal.Simulation('HtrTest.db', speed=50)
+            manager = ChannelManager('HtrTest.db', sim.io, bus_factory=sim.bus_factory)
+    """
+
+    def __init__(self, db, model=CERAMIC_150W, speed=1.0, noise=0.0, dt=0.1):
+        import channel_manager  # both import this module
+        import GPIO_config
+
+        self.clock = ScaledClock(speed) if speed != 1.0 else SYSTEM_CLOCK
+        self.gpio = SimGpio()
+        self.io = GPIO_config.io(gpio=self.gpio, clock=self.clock)
+        self.plants = {}  # heater pin name -> HeaterPlant
+        self.devices = {}  # bus number -> {address: SimMcp9600}
+        for row in channel_manager.channel_rows(db):
+            if not int(row['ENABLED']):
+                continue
+            plant = HeaterPlant(model, self.clock, dt, noise)
+            self.plants[row['HTR_PIN']] = plant
+            self.gpio.watch(self.io.pin_map[row['HTR_PIN']], plant.set_level)
+            self.devices.setdefault(int(row['BUS']), {})[int(row['ADDRESS'])] = SimMcp9600(plant, self.clock)
+
+    def bus_factory(self, bus_num):
+        return SimBus(self.devices.get(bus_num, {}))
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+""" Unattended heater test without the GUI.
+
+    Only the sensor, controller, GPIO and logging layers are loaded; PyQt5
+    and pyqtgraph are never imported. Settings come from tblParameters,
+    overridden by an optional JSON profile and then by the command line:
+
+        python3 headless.py --profile soak300.json
+        python3 . --headless --setpoint 300 --seconds 1800 --mode pid
+        python3 headless.py --profile soak300.json --simulate 100
+
+    A profile holds tblParameters names, e.g.
+
+        {"MODE": "pid", "SETPT": 300, "SECONDS": 1800, "P": 1.2, "I": 0.01,
+         "D": 0.5, "TOLERANCE": 2.0, "SETTLE_SECONDS": 600, "MAX_TEMP": 350}
+
+    "PROFILE": "QUAL_CYCLE" (or --setpoint-profile) runs a ramp/soak
+    profile from tblProfiles instead of a constant SETPT; the run ends with
+    the profile and SECONDS is ignored. SETTLE_SECONDS then counts from each
+    setpoint change, so ramps are not checked against TOLERANCE.
+
+    --mode autotune stores the tuned P, I and D of the first channel in
+    tblParameters, as the GUI does.
+
+    --simulate runs against hal.Simulation instead of the I2C sensors and
+    GPIO, that many times faster than real time.
+
+    --serve [PORT] runs no test itself: the station waits for a test
+    executive on the remote_api JSON-lines port (API_PORT, else 9106)
+    until SIGTERM or Ctrl-C.
+
+    Exit status is 0 when every check passed, 1 when one failed and 2 when
+    the test could not be run.
+"""
+import argparse
+import json
+import math
+import signal
+import sqlite3
+import sys
+import threading
+
+import GPIO_config
+import hal
+import latency
+import run_analytics
+from channel_manager import ChannelManager
+from control_worker import ControlWorker
+from parameters import ParameterStore
+from metrics import start_metrics_server
+from remote_api import DEFAULT_PORT, start_remote_api
+from run_logger import RunLogger
+from setpoint_profile import load_profile
+
+EXIT_PASS = 0
+EXIT_FAIL = 1
+EXIT_ERROR = 2
+# What a missing or broken rig raises while it is set up: no RPi.GPIO or
+# smbus, not a Pi, no I2C device, an unknown pin name, an unreadable database
+SETUP_ERRORS = (ImportError, OSError, RuntimeError, KeyError, ValueError, sqlite3.Error)
+
+# Worker parameters a profile may set, with their defaults
+RUN_DEFAULTS = {
+    'MODE': 'pid',
+    'SETPT': 0,
+    'HYSTERESIS': 1,
+    'SECONDS': 0,
+    'SAMPLE_MODE': 'timer',
+    'ALERT_PIN': 'BCM17',
+    'AUTOTUNE_RULE': 'classic',
+    'D_FILTER': 0.0,
+    'SETTLE_BAND': 1.0,
+    'HEATER_WATTS': 0.0,
+    'SAMPLE_STORE': 'db',
+}
+# Pass/fail checks, with their defaults
+CHECK_DEFAULTS = {
+    'TOLERANCE': 2.0,  # max |temperature - setpoint| once settled, C
+    'SETTLE_SECONDS': 0.0,  # samples before this are not checked against TOLERANCE
+    'MAX_TEMP': math.inf,  # any sample above this aborts the run
+    'PROFILE': None,  # tblProfiles NAME, None = constant SETPT
+}
+
+
+class ChannelResult(object):
+    """ Running pass/fail state of one channel, updated sample by sample. """
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.max_error = 0.0
+        self.failures = []
+        self.__setpoint = None
+        self.__setpoint_since = 0.0  # time the setpoint last changed
+
+    def update(self, sample, checks):
+        self.samples += 1
+        tempc = sample.temperature
+        if tempc != tempc:
+            self.fail("no reading at {:.1f} s".format(sample.timestamp))
+            return
+        self.minimum = min(self.minimum, tempc)
+        self.maximum = max(self.maximum, tempc)
+        if tempc > checks['MAX_TEMP']:
+            self.fail("{:.1f} C above MAX_TEMP at {:.1f} s".format(tempc, sample.timestamp))
+        if sample.setpoint != self.__setpoint:
+            if self.__setpoint is not None:
+                self.__setpoint_since = sample.timestamp
+            self.__setpoint = sample.setpoint
+        if sample.timestamp - self.__setpoint_since >= checks['SETTLE_SECONDS']:
+            self.max_error = max(self.max_error, abs(tempc - sample.setpoint))
+
+    def fail(self, reason):
+        # Keep the first few reasons only, a dead sensor fails every tick
+        if len(self.failures) < 5:
+            self.failures.append(reason)
+
+    def finish(self, checks):
+        if not self.samples:
+            self.fail("no samples")
+        elif self.max_error > checks['TOLERANCE']:
+            self.fail("error {:.2f} C exceeds TOLERANCE {} C".format(self.max_error, checks['TOLERANCE']))
+
+    @property
+    def passed(self):
+        return not self.failures
+
+    def __str__(self):
+        line = "{:<6s} {:>6d} samples  min {:7.2f}  max {:7.2f}  max error {:6.2f}  {}".format(
+            self.name, self.samples, self.minimum, self.maximum, self.max_error,
+            'PASS' if self.passed else 'FAIL')
+        return '\n'.join([line] + ["       " + reason for reason in self.failures])
+
+
+def load_settings(params, profile=None, overrides=None):
+    """ tblParameters, then the profile file, then command line values. """
+    settings = {}
+    for name, default in list(RUN_DEFAULTS.items()) + list(CHECK_DEFAULTS.items()):
+        settings[name] = params.value(name, default)
+    for name in ('P', 'I', 'D', 'TC_FILTER', 'ADC_RES', 'PWM_MODE', 'PWM_PERIOD', 'PWM_RESOLUTION'):
+        settings[name] = params.value(name)
+    if profile:
+        with open(profile) as f:
+            settings.update(json.load(f))
+    if overrides:
+        settings.update((name, value) for name, value in overrides.items() if value is not None)
+    return settings
+
+
+def configure(worker, settings):
+    """ The same setup commands the main window sends from read_params_from_db. """
+    if settings.get('TC_FILTER') is not None:
+        worker.send('tc_filter', int(settings['TC_FILTER']))
+    if settings.get('ADC_RES') is not None:
+        worker.send('adc_resolution', int(settings['ADC_RES']))
+    worker.send('pwm', settings.get('PWM_MODE') or 'soft',
+                float(settings.get('PWM_PERIOD') or 1.0),
+                int(settings.get('PWM_RESOLUTION') or 100))
+    if None not in (settings.get('P'), settings.get('I'), settings.get('D')):
+        worker.send('gains', float(settings['P']), float(settings['I']), float(settings['D']))
+
+
+def run_test(worker, settings, profile=None, poll=0.25, params=None):
+    """ Run one test to completion and return (status, [ChannelResult]).
+
+        profile is a setpoint_profile.Profile, or None for a constant SETPT.
+        Auto-tuned gains are stored in params (a ParameterStore) if given.
+    """
+    results = [ChannelResult(channel.name) for channel in worker.channels]
+    stop = threading.Event()
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    run_params = {name: settings[name] for name in RUN_DEFAULTS}
+    run_params['PROFILE'] = profile
+    worker.send('start', run_params)
+    status = None
+    try:
+        while status is None:
+            try:
+                stopped = stop.wait(poll)
+            except KeyboardInterrupt:
+                stopped = True
+            if stopped:
+                worker.send('stop')
+                stop.clear()
+
+            for sample in worker.drain_samples():
+                results[sample.channel].update(sample, settings)
+                if sample.temperature > settings['MAX_TEMP']:
+                    worker.send('stop')
+
+            for name, channel, data in worker.drain_events():
+                if name == 'autotune':
+                    print("{} auto tune: P={:.3f} I={:.5f} D={:.3f}".format(results[channel].name, *data))
+                    # The worker already applied them per channel; like the GUI, store the first channel's
+                    if params is not None and channel == 0:
+                        for parameter, value in zip(('P', 'I', 'D'), data):
+                            params.set(parameter, value)
+                elif name == 'autotune_failed':
+                    results[channel].fail("auto tune did not settle")
+                elif name == 'segment':
+                    print("segment {} {} {}".format(*data))
+                elif name == 'error':
+                    print("Control error, heaters off: {}".format(data), file=sys.stderr)
+                elif name == 'run_finished':
+                    status = data
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+    # Samples produced between the last poll and the stop
+    for sample in worker.drain_samples():
+        results[sample.channel].update(sample, settings)
+    for result in results:
+        result.finish(settings)
+        if status != 'complete':
+            result.fail("run {}".format(status))
+    return status, results
+
+
+def serve(worker, db, port, poll=0.5):
+    """ Station mode: the worker is driven over remote_api until SIGTERM or Ctrl-C. """
+    api = start_remote_api(worker, db, port)
+    if api is None:
+        return EXIT_ERROR
+    stop = threading.Event()
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    print("Remote API listening on port {}".format(api.port))
+    try:
+        while not stop.wait(poll):
+            # Nobody else reads the GUI queues here, keep them empty
+            worker.drain_samples()
+            worker.drain_events()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        api.close()
+    return EXIT_PASS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a heater test without the GUI')
+    parser.add_argument('--db', default='HtrTest.db')
+    parser.add_argument('--profile', help='JSON file of tblParameters overrides and checks')
+    parser.add_argument('--mode', choices=('pid', 'bang_bang', 'autotune'))
+    parser.add_argument('--setpoint', type=float)
+    parser.add_argument('--seconds', type=float)
+    parser.add_argument('--setpoint-profile', help='tblProfiles NAME to run instead of a constant setpoint')
+    parser.add_argument('--tolerance', type=float)
+    parser.add_argument('--settle', type=float, help='seconds before the tolerance check starts')
+    parser.add_argument('--max-temp', type=float)
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus /metrics here, 0 = off (default tblParameters METRICS_PORT)')
+    parser.add_argument('--latency-json', metavar='PATH', help='write the control loop latency histograms here')
+    parser.add_argument('--serve', type=int, nargs='?', const=0, metavar='PORT',
+                        help='wait for remote_api commands instead of running a test')
+    parser.add_argument('--simulate', type=float, metavar='SPEED',
+                        help='simulated heaters and sensors, SPEED times faster than real time')
+    args = parser.parse_args(argv)
+
+    try:
+        params = ParameterStore(args.db)
+    except sqlite3.Error as e:
+        print("Cannot read settings from {}: {}".format(args.db, e), file=sys.stderr)
+        return EXIT_ERROR
+    try:
+        settings = load_settings(params, args.profile, {
+            'MODE': args.mode, 'SETPT': args.setpoint, 'SECONDS': args.seconds,
+            'TOLERANCE': args.tolerance, 'SETTLE_SECONDS': args.settle, 'MAX_TEMP': args.max_temp,
+            'PROFILE': args.setpoint_profile,
+        })
+        profile = load_profile(args.db, settings['PROFILE']) if settings['PROFILE'] else None
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print("Profile error: {}".format(e), file=sys.stderr)
+        params.close()
+        return EXIT_ERROR
+
+    try:
+        if args.simulate:
+            simulation = hal.Simulation(args.db, speed=args.simulate)
+            io, bus_factory = simulation.io, simulation.bus_factory
+        else:
+            io, bus_factory = GPIO_config.io(), hal.smbus_factory
+        manager = ChannelManager(args.db, io, bus_factory)
+    except SETUP_ERRORS as e:
+        print("Test rig not available: {}: {}".format(type(e).__name__, e), file=sys.stderr)
+        params.close()
+        return EXIT_ERROR
+    if not manager.channels:
+        print("No enabled channels in tblChannels", file=sys.stderr)
+        params.close()
+        manager.close()
+        return EXIT_ERROR
+
+    logger = RunLogger(args.db)
+    logger.start()
+    if not logger.wait_ready():
+        print("Cannot log to {}: {}".format(args.db, logger.error), file=sys.stderr)
+        params.close()
+        manager.close()
+        return EXIT_ERROR
+    worker = ControlWorker(manager, logger=logger)
+    worker.start()
+    metrics = start_metrics_server(worker, params.value('METRICS_PORT', 0) if args.metrics_port is None
+                                   else args.metrics_port)
+    try:
+        configure(worker, settings)
+        if args.serve is not None:
+            exit_status = serve(worker, args.db, args.serve or params.value('API_PORT', 0) or DEFAULT_PORT)
+        elif profile:
+            print("{} run: profile {}, tolerance {} C after {} s".format(
+                settings['MODE'], profile.name, settings['TOLERANCE'], settings['SETTLE_SECONDS']))
+        else:
+            print("{} run: setpoint {} C for {} s, tolerance {} C after {} s".format(
+                settings['MODE'], settings['SETPT'], settings['SECONDS'],
+                settings['TOLERANCE'], settings['SETTLE_SECONDS']))
+        if args.serve is None:
+            status, results = run_test(worker, settings, profile, params=params)
+    finally:
+        if metrics is not None:
+            metrics.close()
+        worker.shutdown()
+    if args.serve is not None:
+        logger.close()
+        params.close()
+        manager.close()
+        return exit_status
+
+    passed = all(result.passed for result in results)
+    for result, stats in zip(results, worker.stats or [None] * len(results)):
+        print(result)
+        if stats is not None:
+            print('\n'.join("       " + line for line in run_analytics.summary(stats).split('\n')))
+    print(latency.format_table(worker.latency.snapshot()))
+    if args.latency_json:
+        worker.latency.dump(args.latency_json)
+    print("Run {} {}: {}".format(logger.run_id, status, 'PASS' if passed else 'FAIL'))
+    logger.event('headless_result', json.dumps({result.name: result.failures for result in results}))
+    logger.close()
+    params.close()
+    manager.close()
+    return EXIT_PASS if passed else EXIT_FAIL
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+""" Control loop latency and jitter histograms.
+
+    LatencyHistogram is HDR style: microsecond values fall into log-linear
+    buckets (128 linear sub-buckets per power of two, under 1% relative
+    error) held in a preallocated list, so recording is a few integer
+    operations and memory does not grow with the run. Each histogram has a
+    single writer thread and readers work on a copy of the counts, so no
+    lock is taken on the hot path.
+
+    LoopLatency holds one histogram per stage of a control tick:
+
+        wake         timer deadline (or ALERT edge) to the control thread running
+        i2c_read     sensor sweep, first read start to last read end
+        control      controllers, profile and analytics, GPIO writes excluded
+        gpio_write   heater output and PWM duty writes of the tick
+        tick         wake to the samples being queued, end to end
+        plot_update  GUI drain and redraw, recorded by the GUI thread
+
+    wake is measured on the loop's clock, so under a hal.ScaledClock it is
+    in simulated seconds; every other stage is real time.
+"""
+import bisect
+import itertools
+import json
+import math
+import time
+
+STAGES = ('wake', 'i2c_read', 'control', 'gpio_write', 'tick', 'plot_update')
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram(object):
+    """ Fixed size histogram of durations from 1 us up to highest seconds. """
+
+    def __init__(self, highest=60.0, sub_bucket_bits=8):
+        self.__sub_bits = sub_bucket_bits
+        self.__half = 1 << (sub_bucket_bits - 1)
+        self.__highest = int(highest * 1e6)
+        self.counts = [0] * (self.__index(self.__highest) + 1)
+        self.total = 0  # us
+        self.max = 0  # us, exact even above highest
+
+    def __index(self, us):
+        shift = us.bit_length() - self.__sub_bits
+        if shift <= 0:
+            return us
+        return shift * self.__half + (us >> shift)
+
+    def __upper(self, index):
+        # Highest value that lands in bucket index
+        if index < 2 * self.__half:
+            return index
+        shift = index // self.__half - 1
+        return ((index - shift * self.__half) << shift) + (1 << shift) - 1
+
+    def record(self, seconds):
+        us = int(seconds * 1e6 + 0.5)
+        if us < 0:
+            us = 0
+        if us > self.max:
+            self.max = us
+        self.total += us
+        self.counts[self.__index(min(us, self.__highest))] += 1
+
+    def snapshot(self):
+        """ count, mean and percentiles in ms, from a copy of the counts. """
+        counts = list(self.counts)
+        cumulative = list(itertools.accumulate(counts))
+        count = cumulative[-1]
+        result = {'count': count, 'mean_ms': self.total / count / 1000.0 if count else None}
+        for p in PERCENTILES:
+            key = 'p{:g}_ms'.format(p).replace('.', '')
+            if not count:
+                result[key] = None
+                continue
+            index = bisect.bisect_left(cumulative, max(1, math.ceil(p / 100.0 * count)))
+            result[key] = min(self.__upper(index), self.max) / 1000.0
+        result['max_ms'] = self.max / 1000.0 if count else None
+        return result
+
+
+class LoopLatency(object):
+    """ One LatencyHistogram per entry of STAGES. """
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+
+    def record(self, stage, seconds):
+        self.histograms[stage].record(seconds)
+
+    def reset(self):
+        # Swap in fresh histograms; a writer mid-record lands in the old set
+        self.started = time.time()
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+
+    def snapshot(self):
+        histograms = self.histograms
+        return {'since': self.started, 'stages': {stage: histograms[stage].snapshot() for stage in STAGES}}
+
+    def dump(self, path):
+        """ Write snapshot() as JSON. """
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+def format_table(snapshot):
+    """ Text table of a LoopLatency snapshot. """
+    lines = ["{:<12s} {:>8s} {:>9s} {:>9s} {:>9s}".format('stage', 'count', 'p50 ms', 'p99 ms', 'max ms')]
+    for stage, stats in snapshot['stages'].items():
+        lines.append("{:<12s} {:>8d} {:>9s} {:>9s} {:>9s}".format(
+            stage, stats['count'], *('--' if stats[key] is None else '{:.3f}'.format(stats[key])
+                                     for key in ('p50_ms', 'p99_ms', 'max_ms'))))
+    return '\n'.join(lines)
@@ -1,30 +1,127 @@
-import quieres
+from collections import namedtuple
+from types import MappingProxyType
+
+import dbtables
+
+# Compiled, read-only view of tblMCP9600_Registers / tblMCP9600_RegBits
+Register = namedtuple('Register', ['name', 'address', 'size', 'value', 'writable', 'bits'])
+RegisterBits = namedtuple('RegisterBits', ['name', 'mask', 'shift', 'value'])
+
+# Everything read_snapshot returns, decoded
+Snapshot = namedtuple('Snapshot', ['hot_junction', 'junction_delta', 'cold_junction', 'raw_adc', 'status',
+                                   'th_updated', 'burst_complete', 'input_range', 'alerts'])
+
+# Hot registers, addressed directly by the fast path in read_tc and friends
+REG_HOT_JUNCTION = 0x00
+REG_JUNCTION_DELTA = 0x01
+REG_COLD_JUNCTION = 0x02
+REG_RAW_ADC = 0x03
+REG_STATUS = 0x04
+
+# (address, bytes) of the registers in a snapshot, in read order. Status
+# goes first: a conversion ending mid-transfer then leaves TH updated set
+# for the next poll instead of flagging the hot junction value read before it.
+SNAPSHOT_REGISTERS = (
+    (REG_STATUS, 1),
+    (REG_HOT_JUNCTION, 2),
+    (REG_JUNCTION_DELTA, 2),
+    (REG_COLD_JUNCTION, 2),
+    (REG_RAW_ADC, 3),
+)
+
+# Status register flags
+STATUS_ALERTS = 0x0F
+STATUS_INPUT_RANGE = 0x10
+STATUS_TH_UPDATED = 0x40
+STATUS_BURST_COMPLETE = 0x80
+
+# Device configuration AdcResolution field code and typical conversion time
+# (seconds) for each ADC resolution in bits
+ADC_RESOLUTION = {18: 0, 16: 1, 14: 2, 12: 3}
+CONVERSION_TIME = {18: 0.320, 16: 0.080, 14: 0.020, 12: 0.005}
+
+_register_map_cache = {}
+
+
+def compile_register_map(registers, reg_bits):
+    """ Build an immutable NAME -> Register index from the raw table rows.
+
+        Each Register carries its bit fields as an immutable NAME -> RegisterBits
+        mapping, so neither registers nor fields need a scan at run time.
+    """
+    fields = {}
+    for bit in reg_bits:
+        fields.setdefault(bit['FK_PARENT_ID'], {})[bit['NAME']] = \
+            RegisterBits(bit['NAME'], bit['MASK'], bit['SHIFT'], bit['VALUE'])
+
+    reg_map = {}
+    for register in registers:
+        reg_map[register['NAME']] = Register(register['NAME'], register['ADDRESS'], register['BYTES'],
+                                             register['VALUE'], bool(register['WRITE']),
+                                             MappingProxyType(fields.get(register['ADDRESS'], {})))
+    return MappingProxyType(reg_map)
+
+
+def load_register_map(db):
+    """ Read and compile the register tables once per database (QSqlDatabase or path). """
+    key = dbtables.database_name(db)
+    if key not in _register_map_cache:
+        registers = dbtables.table_to_dictionary(db, 'tblMcp9600_Registers')
+        reg_bits = dbtables.table_to_dictionary(db, 'tblMCP9600_RegBits')
+        _register_map_cache[key] = compile_register_map(registers, reg_bits)
+    return _register_map_cache[key]
+
+
+def decode_temperature(msb, lsb):
+    # 0.0625 C/LSB two's complement, shared by hot, delta and cold junction
+    if msb & 0x80 == 0x80:  # Tempearture < 0C
+        return ((msb * 16.0) + (lsb / 16.0)) - 4096.0
+    return (msb * 16.0) + (lsb / 16.0)
+
+
+def decode_raw_adc(upper, middle, lower):
+    # 18 bit ADC result, sign extended to 24 bits
+    value = upper << 16 | middle << 8 | lower
+    if value & 0x800000:
+        value -= 0x1000000
+    return value
+
+
+def decode_snapshot(status, hot, delta, cold, adc):
+    status = status[0]
+    return Snapshot(decode_temperature(hot[0], hot[1]),
+                    decode_temperature(delta[0], delta[1]),
+                    decode_temperature(cold[0], cold[1]),
+                    decode_raw_adc(adc[0], adc[1], adc[2]),
+                    status,
+                    bool(status & STATUS_TH_UPDATED),
+                    bool(status & STATUS_BURST_COMPLETE),
+                    bool(status & STATUS_INPUT_RANGE),
+                    status & STATUS_ALERTS)
+
+
+def get_field(raw, field):
+    return (raw >> field.shift) & field.mask
 
 
 class MCP9600(object):
 
 
-    def __init__(self, db, i2c_bus):
+    def __init__(self, db, i2c_bus, i2c_addr=0x66, register_map=None):
 
         self.db = db
-        self.i2c_addr = 0x66
+        self.i2c_addr = i2c_addr
         self.i2c_bus = i2c_bus
-        self.registers = []
+        self.reg_map = register_map
+        self.adc_resolution = 18
         self.__mcp9600_initialize()
 
     def __mcp9600_initialize(self):
-        # Read register table from database and store it in a list of dictionaries
-        self.registers = quieres.db_table_data_to_dictionary(self.db, 'tblMcp9600_Registers')
-        for register in self.registers:
-            self.__mcp9600_write_word(register['NAME'], register['VALUE'])
-            if register['NAME'] == 'ThermocoupleSensorConfiguration':
-                data_16 = self.__mcp9600_read_word(register['NAME'])
-                UpperByte = data_16[1]
-                LowerByte = data_16[0]
-                value = UpperByte << 8 | LowerByte
-
-                print(value)
-
+        # Compile the register tables from the database once, shared by all channels
+        if self.reg_map is None:
+            self.reg_map = load_register_map(self.db)
+        for register in self.reg_map.values():
+            self.__mcp9600_write_word(register.name, register.value)
 
     def mcp9600_read_id(self):
         data_16 = self.__mcp9600_read_word('DeviceId')
@@ -38,45 +135,89 @@ class MCP9600(object):
         return chip_id
 
     def read_tc(self):
-        data_16 = self.__mcp9600_read_word('ThermocoupleHotJunction')
-        UpperByte = data_16[1]
-        LowerByte = data_16[0]
-        if LowerByte & 0x80 == 0x80: # Tempearture < 0C
-            temperature = (((LowerByte * 16.0) + (UpperByte/16.0))) - 4096.0
-        else: # Temperature >= 0C
-            temperature = ((LowerByte * 16.0) + (UpperByte/16.0))
-        return temperature
+        data_16 = self.i2c_bus.read_i2c_block_data(self.i2c_addr, REG_HOT_JUNCTION, 2)
+        return decode_temperature(data_16[0], data_16[1])
+
+    def read_cold_junction(self):
+        data_16 = self.i2c_bus.read_i2c_block_data(self.i2c_addr, REG_COLD_JUNCTION, 2)
+        return decode_temperature(data_16[0], data_16[1])
+
+    def read_status(self):
+        return self.i2c_bus.read_i2c_block_data(self.i2c_addr, REG_STATUS, 1)[0]
+
+    def read_snapshot(self):
+        """ Read hot junction, delta, cold junction, raw ADC and status at once.
+
+            The MCP9600 does not auto-increment its register pointer, so each
+            register needs its own pointer write. On an smbus2 bus (what
+            hal.smbus_factory opens when smbus2 is installed) all five
+            write/read pairs go out as one I2C_RDWR transfer joined by repeated
+            starts; plain smbus and hal.SimBus fall back to one block read per
+            register.
+        """
+        if hasattr(self.i2c_bus, 'i2c_rdwr'):
+            raw = self.__read_registers_rdwr(SNAPSHOT_REGISTERS)
+        else:
+            raw = [self.i2c_bus.read_i2c_block_data(self.i2c_addr, reg_add, size)
+                   for reg_add, size in SNAPSHOT_REGISTERS]
+        return decode_snapshot(*raw)
+
+    def clear_status(self):
+        # Writing 0 clears the TH update and burst complete flags
+        self.i2c_bus.write_byte_data(self.i2c_addr, REG_STATUS, 0)
+
+    def conversion_ready(self):
+        """ True, and the flag cleared, if a new hot junction value is available. """
+        if self.read_status() & STATUS_TH_UPDATED:
+            self.clear_status()
+            return True
+        return False
+
+    def conversion_time(self):
+        return CONVERSION_TIME[self.adc_resolution]
+
+    def set_adc_resolution(self, bits):
+        """ Select 18, 16, 14 or 12 bit ADC resolution; fewer bits convert faster. """
+        self.write_field('DeviceConguration', 'AdcResolution', ADC_RESOLUTION[bits])
+        self.adc_resolution = bits
+
+    def read_field(self, reg_name, field_name):
+        field = self.reg_map[reg_name].bits[field_name]
+        data_16 = self.__mcp9600_read_word(reg_name)
+        return get_field(data_16[0], field)
+
+    def write_field(self, reg_name, field_name, value):
+        # Read-modify-write of one bit field in a single byte config register
+        register = self.reg_map[reg_name]
+        field = register.bits[field_name]
+        data = self.i2c_bus.read_i2c_block_data(self.i2c_addr, register.address, 1)[0]
+        data &= ~(field.mask << field.shift) & 0xFF
+        data |= (value & field.mask) << field.shift
+        self.i2c_bus.write_byte_data(self.i2c_addr, register.address, data)
 
     def read_tc_filter(self):
-        data_16 = self.__mcp9600_read_word('ThermocoupleSensorConfiguration')
-        UpperByte = data_16[1]
-        LowerByte = data_16[0]
-        filter_setting = LowerByte & 0x07
-        return filter_setting
+        return self.read_field('ThermocoupleSensorConfiguration', 'FilterCoefficients')
 
     def write_tc_filter_value(self, value):
-        data_16 = self.__mcp9600_read_word('ThermocoupleHotJunction')
-        UpperByte = data_16[1]
-        LowerByte = data_16[0]
-        LowerByte = LowerByte & 0xF8
-        LowerByte - LowerByte | value
-        data_16 = UpperByte << 8 | LowerByte
-
-        self.__mcp9600_write_word('ThermocoupleHotJunction', data_16)
-
-
-    def __search_reg_address_from_name(self, reg_name):
-        for register in self.registers:
-            if register['NAME'] == reg_name:
-                return register['ADDRESS']
-        return 0
+        self.write_field('ThermocoupleSensorConfiguration', 'FilterCoefficients', value)
+
+    def __read_registers_rdwr(self, registers):
+        from smbus2 import i2c_msg
+        msgs = []
+        reads = []
+        for reg_add, size in registers:
+            read = i2c_msg.read(self.i2c_addr, size)
+            msgs.append(i2c_msg.write(self.i2c_addr, [reg_add]))
+            msgs.append(read)
+            reads.append(read)
+        self.i2c_bus.i2c_rdwr(*msgs)
+        return [list(read) for read in reads]
 
     def __mcp9600_read_word(self, reg_name):
-        reg_add = self.__search_reg_address_from_name(reg_name)
+        reg_add = self.reg_map[reg_name].address
         data_16 = self.i2c_bus.read_i2c_block_data(self.i2c_addr, reg_add, 2)
         return data_16
 
     def __mcp9600_write_word(self, reg_name, data_16):
-        reg_add = self.__search_reg_address_from_name(reg_name)
+        reg_add = self.reg_map[reg_name].address
         self.i2c_bus.write_word_data(self.i2c_addr, reg_add, data_16)
-
@@ -0,0 +1,167 @@
+""" Prometheus / OpenMetrics endpoint for rack monitoring.
+
+    MetricsServer serves GET /metrics on a local port from its own thread.
+    Every value comes from the snapshots the control worker replaces whole
+    each tick (status, relays, stats, latency), so a scrape never reads the
+    I2C bus, takes a lock the loop needs or waits for a tick:
+
+        curl http://heater-pi-3:9105/metrics
+
+    The Prometheus text format (0.0.4) is the default; a client asking for
+    application/openmetrics-text gets OpenMetrics 1.0.
+"""
+import http.server
+import math
+import sys
+import threading
+
+import latency
+
+PREFIX = 'heatertest_'
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+QUANTILES = (('0.5', 'p50_ms'), ('0.9', 'p90_ms'), ('0.99', 'p99_ms'), ('0.999', 'p999_ms'))
+
+# name, help, ChannelStatus field
+CHANNEL_GAUGES = (
+    ('temperature_celsius', 'Hot junction temperature, NaN when the sensor did not answer', 'temperature'),
+    ('setpoint_celsius', 'Setpoint of the last tick', 'setpoint'),
+    ('duty_ratio', 'Heater duty 0..1', 'duty'),
+    ('pid_output', 'PID correction of the last tick', 'output'),
+    ('heater_on', 'Heater output level, 1 = on', 'heater'),
+)
+
+
+def _value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    # Both formats spell these NaN, +Inf and -Inf; repr gives nan and inf
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                          for name, value in labels.items()) + '}'
+
+
+def render(worker, openmetrics=False):
+    """ Exposition text for the current worker snapshots. """
+    lines = []
+
+    def family(name, kind, text):
+        # OpenMetrics names a counter family without its _total suffix
+        if openmetrics and kind == 'counter':
+            name = name[:-len('_total')]
+        lines.append('# HELP {}{} {}'.format(PREFIX, name, text))
+        lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+
+    def sample(name, value, **labels):
+        lines.append('{}{}{} {}'.format(PREFIX, name, _labels(**labels) if labels else '', _value(value)))
+
+    status = worker.status
+    family('running', 'gauge', 'A test run is in progress')
+    sample('running', worker.running)
+
+    for name, text, field in CHANNEL_GAUGES:
+        family(name, 'gauge', text)
+        for channel in status:
+            sample(name, getattr(channel, field), channel=channel.name)
+
+    family('pid_term', 'gauge', 'PID state: p = Cp, i = Ci (integral), d = Cd (filtered derivative)')
+    for channel in status:
+        for term, value in (('p', channel.cp), ('i', channel.ci), ('d', channel.cd)):
+            sample('pid_term', value, channel=channel.name, term=term)
+
+    family('sample_timestamp_seconds', 'gauge', 'Run time of the last sample of each channel')
+    for channel in status:
+        sample('sample_timestamp_seconds', channel.timestamp, channel=channel.name)
+
+    family('samples_total', 'counter', 'Samples taken per channel since start')
+    for channel in status:
+        sample('samples_total', channel.samples, channel=channel.name)
+
+    family('ticks_total', 'counter', 'Control loop ticks since start')
+    sample('ticks_total', worker.ticks)
+
+    family('relay_closed', 'gauge', 'Relay state, 1 = closed')
+    for relay, state in sorted(worker.relays.items()):
+        sample('relay_closed', state, relay=relay)
+
+    stats = worker.stats
+    family('run_steady_stddev_celsius', 'gauge', 'Steady state temperature stddev of the current run')
+    for channel, run in zip(status, stats):
+        sample('run_steady_stddev_celsius', run.steady_stddev, channel=channel.name)
+
+    stages = worker.latency.snapshot()['stages']
+    family('loop_latency_seconds', 'summary', 'Control loop stage latency, see latency.STAGES')
+    for stage in latency.STAGES:
+        histogram = stages[stage]
+        for quantile, key in QUANTILES:
+            value = histogram[key]
+            sample('loop_latency_seconds', None if value is None else value / 1000.0, stage=stage, quantile=quantile)
+        mean = histogram['mean_ms'] or 0.0
+        sample('loop_latency_seconds_count', histogram['count'], stage=stage)
+        sample('loop_latency_seconds_sum', mean * histogram['count'] / 1000.0, stage=stage)
+
+    if openmetrics:
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(threading.Thread):
+    """ HTTP server for /metrics on its own daemon thread. """
+
+    def __init__(self, worker, port=9105, host=''):
+        super(MetricsServer, self).__init__(name='MetricsServer', daemon=True)
+        self.worker = worker
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+                body = render(server.worker, openmetrics).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # one line per scrape is noise
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+
+    def run(self):
+        self.httpd.serve_forever(poll_interval=0.5)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_metrics_server(worker, port, host=''):
+    """ Running MetricsServer, or None when port is 0 or cannot be bound. """
+    if not port:
+        return None
+    try:
+        server = MetricsServer(worker, port, host)
+    except OSError as e:
+        print("Metrics server not started on port {}: {}".format(port, e), file=sys.stderr)
+        return None
+    server.start()
+    return server
@@ -0,0 +1,183 @@
+import sqlite3
+import sys
+import threading
+
+import dbtables
+
+# Python type of each tblParameters VALUE, everything else is a string
+PARAMETER_TYPES = {
+    'SECONDS': int,
+    'HYSTERESIS': int,
+    'MAX_TEMP': int,
+    'SETPT': int,
+    'P': float,
+    'I': float,
+    'D': float,
+    'D_FILTER': float,
+    'RELAY1': int,
+    'RELAY2': int,
+    'RELAY3': int,
+    'TC_FILTER': int,
+    'PLOT_WINDOW': int,
+    'PLOT_DECIMATE': int,
+    'ADC_RES': int,
+    'PWM_PERIOD': float,
+    'PWM_RESOLUTION': int,
+    'SETTLE_BAND': float,
+    'HEATER_WATTS': float,
+    'METRICS_PORT': int,
+    'API_PORT': int,
+}
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS "tblParameters" (
+        "PKID"	INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        "PARAMETER"	TEXT NOT NULL UNIQUE,
+        "VALUE"	TEXT NOT NULL
+    )""",
+)
+
+# Rows a new or older database starts with; stored values are left alone
+DEFAULTS = (
+    ('TEMP_UNITS', 'C'),
+    ('SECONDS', '4000'),
+    ('HYSTERESIS', '1'),
+    ('MAX_TEMP', '418'),
+    ('P', '5.0'),
+    ('I', '0.001'),
+    ('D', '0.0'),
+    ('SETPT', '300'),
+    ('MODE', 'pid'),
+    ('RELAY1', '1'),
+    ('RELAY2', '0'),
+    ('RELAY3', '0'),
+    ('TC_FILTER', '0'),
+    ('PLOT_WINDOW', '0'),
+    ('PLOT_DECIMATE', '1'),
+    ('SAMPLE_MODE', 'timer'),
+    ('ADC_RES', '18'),
+    ('ALERT_PIN', 'BCM17'),
+    ('PWM_MODE', 'soft'),
+    ('PWM_PERIOD', '1.0'),
+    ('PWM_RESOLUTION', '100'),
+    ('AUTOTUNE_RULE', 'classic'),
+    ('D_FILTER', '0.0'),
+    ('SETTLE_BAND', '2.0'),
+    ('HEATER_WATTS', '150'),
+    ('METRICS_PORT', '9105'),
+    ('API_PORT', '0'),
+    ('SAMPLE_STORE', 'db'),
+)
+
+INSERT_DEFAULT = "INSERT OR IGNORE INTO tblParameters (PARAMETER, VALUE) VALUES (?, ?)"
+
+UPSERT = ("INSERT INTO tblParameters (PARAMETER, VALUE) VALUES (?, ?) "
+          "ON CONFLICT(PARAMETER) DO UPDATE SET VALUE = excluded.VALUE")
+
+
+class ParameterStore(object):
+    """ In-memory copy of tblParameters with write-behind.
+
+        All rows are loaded with one query. Reads never touch the database.
+        set() updates memory, notifies subscribers and (re)arms a debounce
+        timer; when the value has been quiet for `debounce` seconds every
+        pending change is written in a single transaction. Dragging a dial
+        therefore costs one write, not one per valueChanged.
+    """
+
+    def __init__(self, path, debounce=0.5):
+        self.path = path
+        self.debounce = debounce
+        self.__values = {}
+        self.__dirty = {}
+        self.__subscribers = []
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()  # keeps flushes, and so writes, in order
+        self.__timer = None
+        self.__closed = False
+        self.load()
+
+    def load(self):
+        dbtables.ensure_tables(self.path, SCHEMA, [(INSERT_DEFAULT, DEFAULTS)])
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute("SELECT PARAMETER, VALUE FROM tblParameters").fetchall()
+        finally:
+            conn.close()
+        with self.__lock:
+            self.__values = dict(rows)
+
+    def get(self, parameter, default=None):
+        """ Stored text value, as the old per-call SELECT returned it. """
+        return self.__values.get(parameter, default)
+
+    def value(self, parameter, default=None):
+        """ Value converted with PARAMETER_TYPES. """
+        text = self.__values.get(parameter)
+        if text is None:
+            return default
+        return PARAMETER_TYPES.get(parameter, str)(text)
+
+    def __getitem__(self, parameter):
+        if parameter not in self.__values:
+            raise KeyError(parameter)
+        return self.value(parameter)
+
+    def set(self, parameter, value):
+        text = str(value)
+        with self.__lock:
+            if self.__values.get(parameter) == text:
+                return
+            self.__values[parameter] = text
+            self.__dirty[parameter] = text
+            self.__arm()
+        for callback, names in self.__subscribers:
+            if names is None or parameter in names:
+                callback(parameter, self.value(parameter))
+
+    def subscribe(self, callback, names=None):
+        """ Call callback(parameter, typed value) on every change, in the setter's thread. """
+        self.__subscribers.append((callback, frozenset(names) if names else None))
+
+    def flush(self):
+        """ Write pending changes; False if the database refused them, they are then retried. """
+        with self.__flush_lock:
+            with self.__lock:
+                pending = list(self.__dirty.items())
+                self.__timer = None
+            if not pending:
+                return True
+            try:
+                conn = sqlite3.connect(self.path)
+                try:
+                    with conn:
+                        conn.executemany(UPSERT, pending)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print('Cannot save settings to {}: {}'.format(self.path, e), file=sys.stderr)
+                with self.__lock:
+                    if not self.__closed and self.__timer is None:
+                        self.__arm()
+                return False
+            with self.__lock:
+                # Only what was written, a set() during the write stays dirty
+                for parameter, text in pending:
+                    if self.__dirty.get(parameter) == text:
+                        del self.__dirty[parameter]
+            return True
+
+    def close(self):
+        with self.__lock:
+            self.__closed = True
+            if self.__timer is not None:
+                self.__timer.cancel()
+        self.flush()
+
+    def __arm(self):
+        # Caller holds __lock
+        if self.__timer is not None:
+            self.__timer.cancel()
+        self.__timer = threading.Timer(self.debounce, self.flush)
+        self.__timer.daemon = True
+        self.__timer.start()
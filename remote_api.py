@@ -0,0 +1,312 @@
+""" JSON-lines remote control API for a central test executive.
+
+    One JSON object per line over TCP, served by asyncio on its own thread.
+    Requests carry an optional id that is echoed in the reply:
+
+        {"id": 1, "cmd": "start", "args": {"MODE": "pid", "SETPT": 300, "SECONDS": 1800}}
+        {"id": 2, "cmd": "start", "args": {"MODE": "pid", "PROFILE": "QUAL_CYCLE"}}
+        {"id": 3, "cmd": "set", "args": {"name": "SETPT", "value": 250}}
+        {"id": 4, "cmd": "gains", "args": {"P": 5.0, "I": 0.001, "D": 0.0, "channel": 0}}
+        {"id": 5, "cmd": "subscribe", "args": {"channels": [0, 1]}}
+        {"id": 6, "cmd": "stop"}
+        also "status", "unsubscribe" and "ping"
+
+    Replies are {"id": .., "ok": true, "result": ..} or {"id": .., "ok":
+    false, "error": ".."}. Subscribers then receive {"type": "sample", ..}
+    and {"type": "event", ..} lines.
+
+    The control thread only appends to a deque and wakes the event loop
+    once per burst (see ControlWorker.add_listener); each sample is encoded
+    once and fanned out here. Every client has its own bounded stream
+    buffer and writer task, so a slow client only fills its own buffer:
+    the oldest lines are dropped and a {"type": "dropped", "count": n}
+    line tells it how many. Replies are never dropped.
+
+    There is no authentication; serve it on the rack network only.
+"""
+import asyncio
+import collections
+import json
+import math
+import sys
+import threading
+
+from setpoint_profile import load_profile
+
+DEFAULT_PORT = 9106
+CLIENT_QUEUE_LEN = 1000  # stream lines buffered per client before dropping
+WRITE_BATCH = 256  # lines written per drain
+MODES = ('pid', 'bang_bang', 'autotune')
+SAMPLE_STORES = ('db', 'file', 'both')
+ALL = 'all'  # Client.channels when subscribed to every channel
+# Worker parameters a client may set, all numeric except MODE and SAMPLE_STORE
+SETTABLE = ('MODE', 'SETPT', 'HYSTERESIS', 'SECONDS', 'D_FILTER', 'SETTLE_BAND', 'HEATER_WATTS', 'SAMPLE_STORE')
+START_PARAMS = ('MODE', 'SETPT', 'HYSTERESIS', 'SECONDS', 'SAMPLE_STORE')
+# PID gain limits, those of the main window's spin boxes
+GAIN_RANGES = {'P': (0.0, 100.0), 'I': (0.0, 10.0), 'D': (0.0, 10.0)}
+
+
+class ApiError(Exception):
+    pass
+
+
+def _finite(value):
+    # JSON has no NaN; a missing reading goes out as null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def encode(message):
+    return (json.dumps(message, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+
+
+def check_param(name, value):
+    """ Validated worker parameter value; a bad one must never reach the control thread. """
+    if name not in SETTABLE:
+        raise ApiError("{} cannot be set".format(name))
+    if name == 'MODE':
+        if value not in MODES:
+            raise ApiError("MODE must be one of {}".format(', '.join(MODES)))
+        return value
+    if name == 'SAMPLE_STORE':
+        if value not in SAMPLE_STORES:
+            raise ApiError("SAMPLE_STORE must be one of {}".format(', '.join(SAMPLE_STORES)))
+        return value
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ApiError("{} must be a number".format(name))
+    return value
+
+
+def check_gain(name, value):
+    """ Validated PID gain, within the range the GUI allows. """
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ApiError("{} must be a number".format(name))
+    low, high = GAIN_RANGES[name]
+    if not low <= value <= high:
+        raise ApiError("{} must be between {} and {}".format(name, low, high))
+    return float(value)
+
+
+class Client(object):
+    """ One connection: replies, a bounded stream buffer and one writer task. """
+
+    def __init__(self, writer, queue_len):
+        self.writer = writer
+        self.replies = collections.deque()
+        self.stream = collections.deque(maxlen=queue_len)
+        self.channels = None  # None = not subscribed, else frozenset of indexes or ALL
+        self.dropped = 0
+        self.wake = asyncio.Event()
+
+    def push(self, line):
+        if len(self.stream) == self.stream.maxlen:
+            self.dropped += 1
+        self.stream.append(line)
+        self.wake.set()
+
+    def reply(self, message):
+        self.replies.append(encode(message))
+        self.wake.set()
+
+    async def write_loop(self):
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            while self.replies or self.stream:
+                lines = list(self.replies)
+                self.replies.clear()
+                if self.dropped:
+                    lines.append(encode({'type': 'dropped', 'count': self.dropped}))
+                    self.dropped = 0
+                for _ in range(min(WRITE_BATCH, len(self.stream))):
+                    lines.append(self.stream.popleft())
+                self.writer.writelines(lines)
+                await self.writer.drain()
+
+
+class RemoteApi(threading.Thread):
+    """ asyncio JSON-lines server for a ControlWorker on its own thread.
+
+        db is the database path, used to load profiles by name.
+    """
+
+    def __init__(self, worker, db, port=DEFAULT_PORT, host='', queue_len=CLIENT_QUEUE_LEN):
+        super(RemoteApi, self).__init__(name='RemoteApi', daemon=True)
+        self.worker = worker
+        self.db = db
+        self.port = port
+        self.host = host
+        self.queue_len = queue_len
+        self.clients = set()
+        self.error = None  # OSError if the port could not be bound
+        self.__pending = collections.deque()  # (kind, item) from the control thread
+        self.__scheduled = False
+        self.__loop = None
+        self.__stopping = None
+        self.__ready = threading.Event()
+
+    def wait_ready(self, timeout=5.0):
+        """ Block until listening; False if the server failed to start. """
+        self.__ready.wait(timeout)
+        return self.__ready.is_set() and self.error is None
+
+    def close(self, timeout=2.0):
+        self.__ready.wait(timeout)
+        if self.__loop is not None and self.__stopping is not None:
+            try:
+                self.__loop.call_soon_threadsafe(self.__stopping.set)
+            except RuntimeError:
+                pass  # loop already closed
+        self.join(timeout)
+
+    # ------------------------------------------------------------------
+    # Control thread side
+    # ------------------------------------------------------------------
+    def __listener(self, kind, item):
+        self.__pending.append((kind, item))
+        if not self.__scheduled:
+            self.__scheduled = True
+            try:
+                self.__loop.call_soon_threadsafe(self.__dispatch)
+            except RuntimeError:
+                pass  # shutting down
+
+    # ------------------------------------------------------------------
+    # Event loop thread
+    # ------------------------------------------------------------------
+    def run(self):
+        asyncio.run(self.__serve())
+
+    async def __serve(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self.__client, self.host, self.port)
+        except OSError as e:
+            self.error = e
+            self.__ready.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        self.worker.add_listener(self.__listener)
+        self.__ready.set()
+        try:
+            async with server:
+                await self.__stopping.wait()
+                for client in list(self.clients):
+                    client.writer.close()
+        finally:
+            self.worker.remove_listener(self.__listener)
+
+    def __dispatch(self):
+        self.__scheduled = False
+        subscribers = [client for client in self.clients if client.channels is not None]
+        while True:
+            try:
+                kind, item = self.__pending.popleft()
+            except IndexError:
+                return
+            if not subscribers:
+                continue
+            if kind == 'sample':
+                message = {name: _finite(value) for name, value in item._asdict().items()}
+                message['type'] = 'sample'
+                line = encode(message)
+                for client in subscribers:
+                    if client.channels is ALL or item.channel in client.channels:
+                        client.push(line)
+            else:
+                name, channel, data = item
+                line = encode({'type': 'event', 'name': name, 'channel': channel, 'data': data})
+                for client in subscribers:
+                    client.push(line)
+
+    async def __client(self, reader, writer):
+        client = Client(writer, self.queue_len)
+        self.clients.add(client)
+        writer_task = asyncio.ensure_future(client.write_loop())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ApiError("request must be a JSON object")
+                    result = self.__command(client, request.get('cmd'), request.get('args') or {})
+                    client.reply({'id': request.get('id'), 'ok': True, 'result': result})
+                except (ApiError, ValueError, KeyError, TypeError) as e:
+                    client.reply({'id': request.get('id') if isinstance(request, dict) else None,
+                                  'ok': False, 'error': str(e) or type(e).__name__})
+        except (ConnectionError, ValueError):
+            pass  # reset by peer, or a line over the stream limit
+        finally:
+            self.clients.discard(client)
+            writer_task.cancel()
+            writer.close()
+
+    def __command(self, client, cmd, args):
+        worker = self.worker
+        if cmd == 'ping':
+            return 'pong'
+        if cmd == 'status':
+            return self.__status()
+        if cmd == 'start':
+            params = {name: check_param(name, args[name]) for name in START_PARAMS if name in args}
+            profile = args.get('PROFILE')
+            params['PROFILE'] = load_profile(self.db, profile) if profile else None
+            worker.send('start', params)
+            return None
+        if cmd == 'stop':
+            worker.send('stop')
+            return None
+        if cmd == 'set':
+            worker.send('set', args['name'], check_param(args['name'], args['value']))
+            return None
+        if cmd == 'gains':
+            gains = [check_gain(name, args[name]) for name in ('P', 'I', 'D')]
+            channel = args.get('channel')
+            if channel is not None:
+                channel = int(channel)
+                if not 0 <= channel < len(worker.channels):
+                    raise ApiError("no channel {}".format(channel))
+                gains.append(channel)
+            worker.send('gains', *gains)
+            return None
+        if cmd == 'subscribe':
+            channels = args.get('channels')
+            client.channels = ALL if channels is None else frozenset(int(channel) for channel in channels)
+            return {'queue': self.queue_len}
+        if cmd == 'unsubscribe':
+            client.channels = None
+            client.stream.clear()
+            return None
+        raise ApiError("unknown command {}".format(cmd))
+
+    def __status(self):
+        worker = self.worker
+        return {
+            'running': worker.running,
+            'params': {name: worker.params[name] for name in SETTABLE},
+            'profile': worker.params['PROFILE'].name if worker.params['PROFILE'] is not None else None,
+            'setpoint': worker.setpoint,
+            'channels': [{name: _finite(value) for name, value in status._asdict().items()}
+                         for status in worker.status],
+            'relays': worker.relays,
+            'ticks': worker.ticks,
+            'clients': len(self.clients),
+        }
+
+
+def start_remote_api(worker, db, port, host=''):
+    """ Running RemoteApi, or None when port is 0 or cannot be bound. """
+    if not port:
+        return None
+    api = RemoteApi(worker, db, port, host)
+    api.start()
+    if not api.wait_ready():
+        print("Remote API not started on port {}: {}".format(port, api.error), file=sys.stderr)
+        return None
+    return api
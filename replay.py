@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+""" Replay a recorded run through the controllers on a virtual clock.
+
+    Each recorded temperature is fed, at its recorded timestamp, to a fresh
+    PID.GenOut / bang-bang controller configured with the gains and mode to
+    try. The clock is a hal.VirtualClock, so dt is exactly what the run saw
+    and the replay runs as fast as the loop allows.
+
+    A pid run that followed a profile is replayed with the feed-forward it
+    applied, recovered from each sample as duty - output / setpoint, and
+    the PID limits the worker derived from it.
+
+    This is open loop: the temperatures are the ones the original controller
+    produced, so the report answers "what would these settings have decided
+    on this data", not how the heater would then have responded. For closed
+    loop what-ifs use simulator.py or headless.py --simulate.
+
+        python3 replay.py 42 --P 2.0 --I 0.01 --D 0
+        python3 replay.py 42 --mode bang_bang --hysteresis 4
+"""
+import argparse
+import json
+import math
+import sqlite3
+from collections import namedtuple
+
+import numpy
+
+import exporter
+import hal
+from bang_bang import bang_bang
+from PID import PID
+
+# Per channel comparison of the recorded and replayed actuator decisions
+ReplayResult = namedtuple('ReplayResult', [
+    'channel', 'samples', 'differing', 'first_difference', 'duty_mae', 'duty_max_error',
+    'changes_recorded', 'changes_replayed', 'on_seconds_recorded', 'on_seconds_replayed'])
+
+
+class ReplayController(object):
+    """ The ControlWorker pid / bang-bang step for one channel, without hardware. """
+
+    def __init__(self, mode, Kp, Ki, Kd, hysteresis, clock, d_filter=0.0):
+        self.mode = mode
+        self.hysteresis = hysteresis
+        self.clock = clock
+        self.pid = PID(clock=clock.monotonic)
+        self.pid.Kp, self.pid.Ki, self.pid.Kd = Kp, Ki, Kd
+        self.pid.SetDerivativeFilter(d_filter)
+        self.heater_on = False
+        self.duty = 0.0
+
+    def step(self, tempc, setpt, feed_forward=0.0):
+        """ Return the duty (0..1) the worker would apply for this sample. """
+        if tempc != tempc:
+            # NaN: the worker turns the heater off, in pid mode through a zero duty
+            self.heater_on = False
+            self.duty = 0.0
+            return 0.0
+        if self.mode == 'pid':
+            if setpt <= 0:
+                self.duty = 0.0
+                return 0.0
+            # As ControlWorker.__pid_step: duty = feed-forward + correction / setpoint
+            self.pid.SetOutputLimits(-feed_forward * setpt, (1.0 - feed_forward) * setpt)
+            correction = self.pid.GenOut(setpt - tempc, tempc)
+            self.duty = min(1.0, max(0.0, feed_forward + correction / setpt))
+            return self.duty
+        # Bang-bang runs GenOut only to display the correction, it decides nothing
+        self.heater_on = bang_bang(self.heater_on, tempc, setpt, self.hysteresis)
+        return 1.0 if self.heater_on else 0.0
+
+    def run(self, timestamps, temperatures, setpoints, feed_forwards=None):
+        """ step() for every sample, advancing the virtual clock to each timestamp. """
+        if self.mode == 'pid':
+            if feed_forwards is None:
+                feed_forwards = numpy.zeros(len(timestamps))
+            return self.__run_pid(numpy.asarray(timestamps, dtype=float), numpy.asarray(temperatures, dtype=float),
+                                  numpy.asarray(setpoints, dtype=float), numpy.asarray(feed_forwards, dtype=float))
+        clock = self.clock
+        step = self.step
+        duties = []
+        append = duties.append
+        for timestamp, tempc, setpt in zip(timestamps, temperatures, setpoints):
+            clock.now = timestamp
+            append(step(tempc, setpt))
+        return duties
+
+    def __run_pid(self, timestamps, temperatures, setpoints, feed_forwards):
+        # One GenOutBatch call with per sample limits, however often the setpoint
+        # moves; NaN samples and setpoints <= 0 skip the controller and get
+        # zero duty, as in the worker
+        duties = numpy.zeros(len(timestamps))
+        index = numpy.flatnonzero((temperatures == temperatures) & (setpoints > 0))
+        if len(index):
+            setpts = setpoints[index]
+            ff = feed_forwards[index]
+            outputs = self.pid.GenOutBatch(setpts - temperatures[index], temperatures[index], timestamps[index],
+                                           -ff * setpts, (1.0 - ff) * setpts)
+            duties[index] = numpy.clip(ff + outputs / setpts, 0.0, 1.0)
+        if len(duties):
+            self.duty = float(duties[-1])
+            self.clock.now = float(timestamps[-1])
+        return duties.tolist()
+
+
+class ChannelComparison(object):
+    """ Running difference between recorded and replayed duty.
+
+        Updated one chunk at a time with NumPy; only the last sample of the
+        previous chunk is carried over, so memory is bounded by the chunk.
+    """
+
+    def __init__(self, channel, tolerance):
+        self.channel = channel
+        self.tolerance = tolerance
+        self.samples = 0
+        self.differing = 0
+        self.first_difference = None
+        self.abs_error = 0.0
+        self.max_error = 0.0
+        self.changes = numpy.zeros(2, dtype=int)
+        self.on_seconds = numpy.zeros(2)
+        self.__previous = None  # last (timestamp, recorded duty, replayed duty)
+
+    def update(self, timestamps, recorded, replayed):
+        error = numpy.abs(recorded - replayed)
+        differing = numpy.flatnonzero(error > self.tolerance)
+        if len(differing) and self.first_difference is None:
+            self.first_difference = float(timestamps[differing[0]])
+        self.samples += len(timestamps)
+        self.differing += len(differing)
+        self.abs_error += float(error.sum())
+        self.max_error = max(self.max_error, float(error.max()))
+
+        duties = numpy.stack([recorded, replayed])
+        if self.__previous is not None:
+            timestamps = numpy.concatenate([[self.__previous[0]], timestamps])
+            duties = numpy.concatenate([numpy.array(self.__previous[1:]).reshape(2, 1), duties], axis=1)
+        # Duty holds until the next sample, like the PWM engine
+        self.on_seconds += (duties[:, :-1] * numpy.diff(timestamps)).sum(axis=1)
+        self.changes += (numpy.abs(numpy.diff(duties, axis=1)) > self.tolerance).sum(axis=1)
+        self.__previous = (timestamps[-1], duties[0, -1], duties[1, -1])
+
+    def result(self):
+        return ReplayResult(self.channel, self.samples, self.differing, self.first_difference,
+                            self.abs_error / self.samples if self.samples else 0.0, self.max_error,
+                            int(self.changes[0]), int(self.changes[1]),
+                            float(self.on_seconds[0]), float(self.on_seconds[1]))
+
+
+def replay(chunks, mode, Kp, Ki, Kd, hysteresis=1.0, setpoint=None, tolerance=0.01, d_filter=0.0,
+           feed_forward=False):
+    """ Replay sample rows (exporter.COLUMNS order) and return [ReplayResult].
+
+        Rows must be grouped by channel and in timestamp order within a
+        channel, as exporter.iter_chunks returns them. setpoint overrides
+        the recorded one. feed_forward applies the feed-forward recorded
+        in pid samples, see the module docstring.
+    """
+    clock = hal.VirtualClock()
+    comparisons = {}
+    controllers = {}
+    for rows in chunks:
+        timestamp, channel, tempc, row_setpoint, output, duty, heater = \
+            numpy.array(rows, dtype=float).T
+        if setpoint is not None:
+            row_setpoint = numpy.full_like(tempc, setpoint)
+        feed_forwards = numpy.zeros_like(tempc)
+        if feed_forward:
+            # The worker recorded duty = ff + output / setpoint
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                feed_forwards = numpy.where(row_setpoint > 0, duty - output / row_setpoint, 0.0)
+            feed_forwards = numpy.clip(numpy.nan_to_num(feed_forwards), 0.0, 1.0)
+        # One segment per run of rows from the same channel
+        bounds = [0] + list(numpy.flatnonzero(numpy.diff(channel)) + 1) + [len(rows)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            ch = int(channel[start])
+            if ch not in controllers:
+                clock.now = 0.0  # the worker initializes its PIDs at the run start
+                controllers[ch] = ReplayController(mode, Kp, Ki, Kd, hysteresis, clock, d_filter)
+                comparisons[ch] = ChannelComparison(ch, tolerance)
+            replayed = controllers[ch].run(timestamp[start:end].tolist(), tempc[start:end].tolist(),
+                                           row_setpoint[start:end].tolist(), feed_forwards[start:end])
+            comparisons[ch].update(timestamp[start:end], duty[start:end], numpy.array(replayed))
+    return [comparisons[ch].result() for ch in sorted(comparisons)]
+
+
+def replay_run(db_path, run_id, mode=None, Kp=None, Ki=None, Kd=None, hysteresis=None, setpoint=None,
+               channel=None, tolerance=0.01):
+    """ Replay a run's samples; settings not given are the run's own.
+
+        The samples come from tblSamples or the run's sample file, see
+        exporter.iter_chunks. ValueError if there are none, or for a pid
+        replay of a profile run whose feed-forward was not recorded.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        metadata = exporter.run_metadata(conn, run_id)
+        params = metadata.get('PARAMS') or {}
+        mode = mode or metadata['MODE']
+        # Only pid samples carry the feed-forward a profile added to the duty
+        profile_run = setpoint is None and params.get('PROFILE') is not None
+        if profile_run and mode == 'pid' and metadata['MODE'] != 'pid':
+            raise ValueError("run {} followed a profile in {} mode, its feed-forward was not recorded; "
+                             "replay it with --setpoint".format(run_id, metadata['MODE']))
+        results = replay(exporter.iter_chunks(conn, run_id, channel),
+                         mode,
+                         metadata['P'] if Kp is None else Kp,
+                         metadata['I'] if Ki is None else Ki,
+                         metadata['D'] if Kd is None else Kd,
+                         params.get('HYSTERESIS', 1) if hysteresis is None else hysteresis,
+                         setpoint, tolerance, params.get('D_FILTER', 0.0), profile_run)
+    finally:
+        conn.close()
+    if not results:
+        raise ValueError("run {} has no samples{}".format(
+            run_id, '' if channel is None else ' on channel {}'.format(channel)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded run with other controller settings')
+    parser.add_argument('run_id', type=int)
+    parser.add_argument('--db', default='HtrTest.db')
+    parser.add_argument('--mode', choices=('pid', 'bang_bang'))
+    parser.add_argument('--P', type=float)
+    parser.add_argument('--I', type=float)
+    parser.add_argument('--D', type=float)
+    parser.add_argument('--hysteresis', type=float)
+    parser.add_argument('--setpoint', type=float)
+    parser.add_argument('--channel', type=int)
+    parser.add_argument('--tolerance', type=float, default=0.01, help='duty difference counted as a change')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        results = replay_run(args.db, args.run_id, args.mode, args.P, args.I, args.D, args.hysteresis,
+                             args.setpoint, args.channel, args.tolerance)
+    except ValueError as e:
+        parser.exit(1, "replay: {}\n".format(e))
+    if args.json:
+        print(json.dumps([result._asdict() for result in results], indent=2))
+        return
+    for result in results:
+        first = 'never' if result.first_difference is None else '{:.1f} s'.format(result.first_difference)
+        print("channel {}: {} samples, {} differing decisions ({:.1%}), first at {}".format(
+            result.channel, result.samples, result.differing,
+            result.differing / result.samples if result.samples else math.nan, first))
+        print("    duty error mean {:.4f} max {:.4f}".format(result.duty_mae, result.duty_max_error))
+        print("    actuator changes {} recorded, {} replayed".format(result.changes_recorded, result.changes_replayed))
+        print("    heater on time {:.0f} s recorded, {:.0f} s replayed".format(
+            result.on_seconds_recorded, result.on_seconds_replayed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import numpy
+
+SAMPLE_DTYPE = numpy.dtype([
+    ('timestamp', 'f8'),
+    ('temperature', 'f8'),
+    ('setpoint', 'f8'),
+    ('output', 'f8'),
+    ('duty', 'f8'),
+    ('heater', 'u1'),
+    ('channel', 'u1'),
+])
+
+
+class SampleRingBuffer(object):
+    """ Preallocated sample store of fixed capacity.
+
+        Every record is written twice, at i and i + capacity, so the newest
+        n <= capacity samples always sit in one contiguous slice. All read
+        methods therefore return NumPy views into the buffer, never copies.
+        Views are only valid until the writer wraps around them.
+    """
+
+    def __init__(self, capacity=1 << 17, dtype=SAMPLE_DTYPE):
+        self.capacity = capacity
+        self.data = numpy.zeros(2 * capacity, dtype=dtype)
+        self.count = 0  # total number of samples ever appended
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def clear(self):
+        self.count = 0
+
+    def append(self, sample):
+        i = self.count % self.capacity
+        self.data[i] = tuple(sample)
+        self.data[i + self.capacity] = self.data[i]
+        self.count += 1
+
+    def extend(self, samples):
+        for sample in samples:
+            self.append(sample)
+
+    def latest(self, n=None, step=1):
+        """ View of the newest n samples, every step-th one.
+
+            Decimation is aligned to the absolute sample index so the
+            plotted points do not shift as new samples arrive.
+        """
+        size = len(self)
+        n = size if n is None else min(n, size)
+        if self.count < self.capacity:
+            end = self.count
+        else:
+            end = self.capacity + self.count % self.capacity
+        start = end - n
+        start += (n - self.count) % step
+        return self.data[start:end:step]
+
+    def window(self, seconds, step=1, max_points=None):
+        """ View of the samples in the last `seconds` of data, 0 = all.
+
+            With max_points the step is doubled until no more than that many
+            samples are returned. Steps stay powers of two times the given
+            one, so the chosen points only change when the step does.
+        """
+        recent = self.latest()
+        n = len(recent)
+        if seconds > 0 and n:
+            n -= numpy.searchsorted(recent['timestamp'], recent['timestamp'][-1] - seconds)
+        if max_points:
+            while n > max_points * step:
+                step *= 2
+        return self.latest(n, step)
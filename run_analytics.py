@@ -0,0 +1,277 @@
+""" Online run analytics, updated sample by sample in O(1) memory.
+
+    Every statistic is incremental: Welford for mean/stddev, the P-squared
+    algorithm (Jain & Chlamtac 1985) for percentiles, and running maxima
+    and timestamps for the step response. Nothing is kept per sample, so a
+    run of any length costs the same few hundred bytes per channel and the
+    results are ready the moment the run stops.
+
+    Step response figures refer to the last step, which for a constant
+    SETPT run is the run start. A setpoint that jumps by more than
+    step_threshold between samples starts a step; smaller moves are a ramp
+    and extend the current step to the new setpoint, so a profile ramp is
+    measured once, not restarted every tick. The control worker instead
+    passes new_step when a profile segment begins.
+        rise_time      10% to 90% of the step; None after a ramp, whose
+                       rise is set by its rate
+        overshoot      furthest past the setpoint, C and % of the step
+        settling_time  from the step until the temperature last entered
+                       setpoint +/- band; None while outside it
+        steady_*       temperature and |error| since it last entered the band
+"""
+import bisect
+import math
+from collections import namedtuple
+
+# Snapshot of one channel, also the columns of tblRunStats. None = not
+# reached yet (no step, not settled, heater power unknown).
+RunStats = namedtuple('RunStats', [
+    'channel', 'samples', 'minimum', 'maximum',
+    'rise_time', 'overshoot', 'overshoot_pct', 'settling_time',
+    'steady_mean', 'steady_stddev', 'error_p50', 'error_p95',
+    'duty_mean', 'duty_stddev', 'duty_p95', 'on_seconds', 'energy_j'])
+
+STEP_THRESHOLD = 5.0  # C, a smaller setpoint move between samples is a ramp
+
+
+class Welford(object):
+    """ Running count, mean, variance, min and max. """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.minimum:
+            self.minimum = x
+        if x > self.maximum:
+            self.maximum = x
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+
+class P2Quantile(object):
+    """ Streaming estimate of the p-quantile from five markers. """
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.__heights = []
+        self.__positions = [1, 2, 3, 4, 5]
+        self.__desired = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]
+        self.__increments = (0.0, p / 2, p, (1 + p) / 2, 1.0)
+
+    def add(self, x):
+        self.count += 1
+        q = self.__heights
+        if self.count <= 5:
+            bisect.insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+        n = self.__positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        desired = self.__desired
+        for i in range(5):
+            desired[i] += self.__increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            delta = desired[i] - n[i]
+            if (delta >= 1 and n[i + 1] - n[i] > 1) or (delta <= -1 and n[i - 1] - n[i] < -1):
+                s = 1 if delta > 0 else -1
+                height = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + s * (q[i + s] - q[i]) / (n[i + s] - n[i])  # linear fallback
+                q[i] = height
+                n[i] += s
+
+    def value(self):
+        if not self.count:
+            return None
+        if self.count <= 5:
+            return self.__heights[int(round(self.p * (self.count - 1)))]
+        return self.__heights[2]
+
+
+class ChannelAnalytics(object):
+    """ Step response, steady state, duty and energy of one channel.
+
+        band is the settling band in C, watts the heater power for the
+        energy estimate (0 = unknown), step_threshold the setpoint jump in C
+        that starts a new step.
+    """
+
+    def __init__(self, channel, band=1.0, watts=0.0, step_threshold=STEP_THRESHOLD):
+        self.channel = channel
+        self.band = band
+        self.step_threshold = max(step_threshold, band)
+        self.watts = watts
+        self.samples = 0
+        self.temperature = Welford()
+        self.duty = Welford()
+        self.duty_p95 = P2Quantile(0.95)
+        self.on_seconds = 0.0  # duty integrated over time
+        self.__last_time = None
+        self.__last_duty = 0.0
+        self.__setpoint = None
+        self.__step_time = 0.0
+        self.__step_temperature = 0.0
+        self.__step_size = 0.0
+        self.__direction = 1
+        self.__t10 = None
+        self.__t90 = None
+        self.__ramped = False
+        self.__overshoot = 0.0
+        self.__entered = None  # time the temperature last entered the band
+        self.__steady = Welford()
+        self.__error_p50 = P2Quantile(0.5)
+        self.__error_p95 = P2Quantile(0.95)
+
+    def update(self, sample, new_step=None):
+        """ Add a sample. new_step True/False overrides the jump detection. """
+        timestamp = sample.timestamp
+        self.samples += 1
+        # The duty holds until the next sample, as on the PWM engine
+        if self.__last_time is not None:
+            self.on_seconds += self.__last_duty * (timestamp - self.__last_time)
+        self.__last_time = timestamp
+        self.__last_duty = sample.duty
+        self.duty.add(sample.duty)
+        self.duty_p95.add(sample.duty)
+
+        tempc = sample.temperature
+        if tempc != tempc:  # NaN, no reading
+            return
+        self.temperature.add(tempc)
+        setpt = sample.setpoint
+        if new_step is None:
+            new_step = self.__setpoint is not None and abs(setpt - self.__setpoint) > self.step_threshold
+        if new_step or self.__setpoint is None:
+            self.__new_step(timestamp, tempc, setpt)
+        elif setpt != self.__setpoint:
+            self.__ramp(setpt)
+
+        progress = self.__direction * (tempc - self.__step_temperature)
+        if self.__t10 is None and progress >= 0.1 * self.__step_size:
+            self.__t10 = timestamp
+        if self.__t90 is None and progress >= 0.9 * self.__step_size:
+            self.__t90 = timestamp
+        error = tempc - setpt
+        self.__overshoot = max(self.__overshoot, self.__direction * error)
+
+        if abs(error) <= self.band:
+            if self.__entered is None:
+                self.__entered = timestamp
+                self.__steady = Welford()
+                self.__error_p50 = P2Quantile(0.5)
+                self.__error_p95 = P2Quantile(0.95)
+            self.__steady.add(tempc)
+            self.__error_p50.add(abs(error))
+            self.__error_p95.add(abs(error))
+        else:
+            self.__entered = None
+
+    def __new_step(self, timestamp, tempc, setpt):
+        self.__setpoint = setpt
+        self.__step_time = timestamp
+        self.__step_temperature = tempc
+        self.__step_size = abs(setpt - tempc)
+        self.__direction = 1 if setpt >= tempc else -1
+        self.__t10 = self.__t90 = None
+        self.__ramped = False
+        self.__overshoot = 0.0
+        self.__entered = None
+
+    def __ramp(self, setpt):
+        # The step now ends at setpt
+        self.__setpoint = setpt
+        self.__ramped = True
+        size = abs(setpt - self.__step_temperature)
+        if size > self.__step_size:
+            self.__step_size = size
+            self.__direction = 1 if setpt >= self.__step_temperature else -1
+
+    def snapshot(self):
+        """ RunStats of everything seen so far. """
+        step = self.__step_size > self.band  # a step inside the band has no response to measure
+        rise_time = self.__t90 - self.__t10 if step and not self.__ramped and self.__t90 is not None else None
+        settled = self.__entered is not None
+        temperature = self.temperature
+        return RunStats(
+            self.channel, self.samples,
+            temperature.minimum if temperature.count else None,
+            temperature.maximum if temperature.count else None,
+            rise_time,
+            self.__overshoot if step else None,
+            100.0 * self.__overshoot / self.__step_size if step else None,
+            self.__entered - self.__step_time if settled else None,
+            self.__steady.mean if settled else None,
+            self.__steady.stddev if settled else None,
+            self.__error_p50.value() if settled else None,
+            self.__error_p95.value() if settled else None,
+            self.duty.mean if self.duty.count else None,
+            self.duty.stddev if self.duty.count else None,
+            self.duty_p95.value(),
+            self.on_seconds,
+            self.on_seconds * self.watts if self.watts else None)
+
+
+def analyse(records, band=1.0, watts=0.0, chunk=65536):
+    """ RunStats per channel, in channel order, of a structured array of samples.
+
+        For recordings, e.g. a sample_file.SampleFile window; the records
+        are converted a chunk at a time, so a memory-mapped file is never
+        read whole.
+    """
+    Record = namedtuple('Record', records.dtype.names)
+    analytics = {}
+    for start in range(0, len(records), chunk):
+        for sample in map(Record._make, records[start:start + chunk].tolist()):
+            channel = analytics.get(sample.channel)
+            if channel is None:
+                channel = analytics[sample.channel] = ChannelAnalytics(sample.channel, band, watts)
+            channel.update(sample)
+    return [analytics[channel].snapshot() for channel in sorted(analytics)]
+
+
+def _format(value, spec):
+    return '--' if value is None else format(value, spec)
+
+
+def summary(stats):
+    """ Three short lines describing a RunStats, for the GUI and console. """
+    return '\n'.join([
+        "rise {} s  overshoot {} C ({}%)".format(
+            _format(stats.rise_time, '.0f'), _format(stats.overshoot, '.1f'), _format(stats.overshoot_pct, '.1f')),
+        "settled {} s  mean {} sd {}  p95 err {}".format(
+            _format(stats.settling_time, '.0f'), _format(stats.steady_mean, '.2f'),
+            _format(stats.steady_stddev, '.2f'), _format(stats.error_p95, '.2f')),
+        "duty {}% p95 {}%  energy {} Wh".format(
+            _format(None if stats.duty_mean is None else 100 * stats.duty_mean, '.0f'),
+            _format(None if stats.duty_p95 is None else 100 * stats.duty_p95, '.0f'),
+            _format(None if stats.energy_j is None else stats.energy_j / 3600, '.1f')),
+    ])
@@ -0,0 +1,318 @@
+import collections
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from run_analytics import RunStats
+from sample_file import SampleFileWriter, run_file
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS "tblRuns" (
+        "PK_ID"	INTEGER PRIMARY KEY AUTOINCREMENT,
+        "STARTED"	TEXT NOT NULL,
+        "ENDED"	TEXT,
+        "STATUS"	TEXT NOT NULL DEFAULT 'running',
+        "MODE"	TEXT,
+        "SETPT"	REAL,
+        "P"	REAL,
+        "I"	REAL,
+        "D"	REAL,
+        "TC_FILTER"	INTEGER,
+        "PARAMS"	TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS "tblSamples" (
+        "FK_RUN_ID"	INTEGER NOT NULL,
+        "CHANNEL"	INTEGER NOT NULL,
+        "TIMESTAMP"	REAL NOT NULL,
+        "TEMPERATURE"	REAL,
+        "SETPOINT"	REAL,
+        "OUTPUT"	REAL,
+        "DUTY"	REAL,
+        "HEATER"	INTEGER
+    )""",
+    """CREATE INDEX IF NOT EXISTS "idxSamplesRun" ON "tblSamples" ("FK_RUN_ID", "CHANNEL", "TIMESTAMP")""",
+    """CREATE TABLE IF NOT EXISTS "tblRunStats" (
+        "FK_RUN_ID"	INTEGER NOT NULL,
+        "CHANNEL"	INTEGER NOT NULL,
+        "SAMPLES"	INTEGER,
+        "MINIMUM"	REAL,
+        "MAXIMUM"	REAL,
+        "RISE_TIME"	REAL,
+        "OVERSHOOT"	REAL,
+        "OVERSHOOT_PCT"	REAL,
+        "SETTLING_TIME"	REAL,
+        "STEADY_MEAN"	REAL,
+        "STEADY_STDDEV"	REAL,
+        "ERROR_P50"	REAL,
+        "ERROR_P95"	REAL,
+        "DUTY_MEAN"	REAL,
+        "DUTY_STDDEV"	REAL,
+        "DUTY_P95"	REAL,
+        "ON_SECONDS"	REAL,
+        "ENERGY_J"	REAL,
+        PRIMARY KEY("FK_RUN_ID", "CHANNEL")
+    )""",
+    """CREATE TABLE IF NOT EXISTS "tblEvents" (
+        "PK_ID"	INTEGER PRIMARY KEY AUTOINCREMENT,
+        "FK_RUN_ID"	INTEGER,
+        "TIMESTAMP"	REAL NOT NULL,
+        "NAME"	TEXT NOT NULL,
+        "DETAIL"	TEXT
+    )""",
+)
+
+INSERT_SAMPLE = ("INSERT INTO tblSamples (FK_RUN_ID, CHANNEL, TIMESTAMP, TEMPERATURE, SETPOINT, OUTPUT, DUTY, HEATER) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+INSERT_EVENT = "INSERT INTO tblEvents (FK_RUN_ID, TIMESTAMP, NAME, DETAIL) VALUES (?, ?, ?, ?)"
+INSERT_STATS = "INSERT OR REPLACE INTO tblRunStats (FK_RUN_ID, {}) VALUES (?, {})".format(
+    ', '.join(field.upper() for field in RunStats._fields), ', '.join('?' * len(RunStats._fields)))
+
+RETRY_SECONDS = 0.5  # first retry of a refused batch, doubled up to MAX_RETRY_SECONDS
+MAX_RETRY_SECONDS = 10.0
+FAIL_SECONDS = 30.0  # refused writes for this long fail the run
+CLOSE_ATTEMPTS = 5
+
+
+def now_text():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def connect(path):
+    """ Open the test database for logging: WAL, so readers never block the writer. """
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # FULL in WAL mode: a committed batch survives a power cut, one fsync per batch
+    conn.execute("PRAGMA synchronous=FULL")
+    with conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+    return conn
+
+
+class RunLogger(threading.Thread):
+    """ Background writer for runs, samples and events.
+
+        The control worker only appends to a deque; this thread drains it
+        every batch_seconds (or sooner once batch_size rows are waiting) and
+        writes everything in one transaction with executemany. Each batch
+        commits independently, so a crash loses at most the batch in flight.
+        A batch the database refuses (e.g. locked by a reader) is kept and
+        retried with backoff; error is set once writes have failed for
+        fail_seconds, so the control worker can abort the run.
+
+        The run's SAMPLE_STORE picks where samples go: 'db' (tblSamples),
+        'file' (a sample_file in sample_dir, for long soak runs) or 'both'.
+        The file is synced once per batch, like the database, and its path
+        is logged as a 'sample_file' event of the run.
+    """
+
+    def __init__(self, path, batch_seconds=1.0, batch_size=5000, sample_dir=None, fail_seconds=FAIL_SECONDS):
+        super(RunLogger, self).__init__(name='RunLogger', daemon=True)
+        self.path = path
+        self.batch_seconds = batch_seconds
+        self.batch_size = batch_size
+        # samples/ next to the database unless given
+        self.sample_dir = sample_dir or os.path.join(os.path.dirname(os.path.abspath(path)), 'samples')
+        self.queue = collections.deque()
+        self.run_id = None  # set by the writer thread once the run row exists
+        self.sample_file = None  # SampleFileWriter of the current run, writer thread only
+        self.__db_samples = True
+        self.__wake = threading.Event()
+        self.__closed = False
+        self.fail_seconds = fail_seconds
+        self.error = None  # sqlite3.Error if the database could not be opened, or refused writes for fail_seconds
+        self.__ready = threading.Event()
+        self.__batch = []  # rows taken from the queue, kept until committed
+        self.__failing_since = None
+        self.__retry_at = 0.0
+
+    # ------------------------------------------------------------------
+    # Producer side, called from the control thread
+    # ------------------------------------------------------------------
+    def start_run(self, params):
+        self.queue.append(('run', params))
+        self.__wake.set()
+
+    def log(self, sample):
+        self.queue.append(('sample', sample))
+        if len(self.queue) >= self.batch_size:
+            self.__wake.set()
+
+    def event(self, name, detail=None):
+        self.queue.append(('event', (time.time(), name, detail)))
+
+    def stats(self, stats):
+        """ Final run_analytics.RunStats of each channel. """
+        self.queue.append(('stats', stats))
+
+    def end_run(self, status='complete'):
+        self.queue.append(('end', status))
+        self.__wake.set()
+
+    def wait_ready(self, timeout=5.0):
+        """ Block until the database is open; False if it could not be. """
+        self.__ready.wait(timeout)
+        return self.__ready.is_set() and self.error is None
+
+    def close(self, timeout=5.0):
+        self.__closed = True
+        self.__wake.set()
+        self.join(timeout)
+
+    # ------------------------------------------------------------------
+    # Writer thread
+    # ------------------------------------------------------------------
+    def run(self):
+        try:
+            conn = connect(self.path)
+            self.__recover(conn)
+        except sqlite3.Error as e:
+            self.error = e
+            self.__ready.set()
+            return
+        self.__ready.set()
+        delay = 0.0  # retry backoff while the database refuses writes
+        while True:
+            self.__wake.wait(self.batch_seconds if not delay else max(self.__retry_at - time.monotonic(), 0.0))
+            self.__wake.clear()
+            if self.__closed:
+                break
+            if delay and time.monotonic() < self.__retry_at:
+                continue  # woken by a full queue, keep backing off
+            delay = 0.0 if self.__try_flush(conn) else min(2 * delay or RETRY_SECONDS, MAX_RETRY_SECONDS)
+            self.__retry_at = time.monotonic() + delay
+        for _ in range(CLOSE_ATTEMPTS):
+            if self.__try_flush(conn) and not self.queue:
+                break
+            time.sleep(RETRY_SECONDS)
+        else:
+            print('Run log: {} rows not written to {}'.format(len(self.__batch) + len(self.queue), self.path),
+                  file=sys.stderr)
+        self.__close_sample_file()
+        conn.close()
+
+    @staticmethod
+    def __recover(conn):
+        # A run left open by a crash keeps all its committed samples, just mark it
+        with conn:
+            conn.execute("UPDATE tblRuns SET STATUS = 'aborted', ENDED = ? WHERE ENDED IS NULL", (now_text(),))
+
+    def __try_flush(self, conn):
+        """ Write the pending batch; False if the database refused it, which is kept for the next try. """
+        try:
+            self.__flush(conn)
+        except sqlite3.Error as e:
+            if self.__failing_since is None:
+                self.__failing_since = time.monotonic()
+                print('Run log: cannot write to {}, retrying: {}'.format(self.path, e), file=sys.stderr)
+            if time.monotonic() - self.__failing_since >= self.fail_seconds:
+                self.error = e  # the control worker aborts the run
+            return False
+        if self.__failing_since is not None:
+            print('Run log: writing to {} again'.format(self.path), file=sys.stderr)
+        self.__failing_since = None
+        self.error = None
+        return True
+
+    def __flush(self, conn):
+        if not self.__batch:
+            while True:
+                try:
+                    self.__batch.append(self.queue.popleft())
+                except IndexError:
+                    break
+        # Undone if the transaction fails, the batch is then written again from the start
+        state = (self.run_id, self.__db_samples, self.sample_file)
+        opened = []
+        file_ops = []  # (writer, samples) to append, or (writer, None) to close, once committed
+        try:
+            with conn:
+                self.__write_batch(conn, opened, file_ops)
+        except sqlite3.Error:
+            self.run_id, self.__db_samples, self.sample_file = state
+            for writer in opened:
+                writer.close()
+                os.remove(writer.path)
+                os.remove(writer.path + '.idx')
+            raise
+        self.__batch = []
+        for writer, samples in file_ops:
+            if samples is None:
+                writer.close()
+            else:
+                writer.append(samples)
+        if self.sample_file is not None:
+            self.sample_file.flush()
+
+    def __write_batch(self, conn, opened, file_ops):
+        rows = []
+        samples = []
+        for kind, data in self.__batch:
+            if kind == 'sample':
+                if self.__db_samples:
+                    rows.append((self.run_id, data.channel, data.timestamp, data.temperature,
+                                 data.setpoint, data.output, data.duty, int(data.heater)))
+                if self.sample_file is not None:
+                    samples.append(data)
+                continue
+            # Keep ordering: samples queued before a run change belong to the old run
+            self.__write_samples(conn, rows, samples, file_ops)
+            rows = []
+            samples = []
+            if kind == 'run':
+                self.__insert_run(conn, data)
+                self.__open_sample_file(conn, data, opened, file_ops)
+            elif kind == 'end':
+                self.__end_sample_file(file_ops)
+                conn.execute("UPDATE tblRuns SET ENDED = ?, STATUS = ? WHERE PK_ID = ?",
+                             (now_text(), data, self.run_id))
+            elif kind == 'event':
+                conn.execute(INSERT_EVENT, (self.run_id,) + data)
+            elif kind == 'stats':
+                conn.executemany(INSERT_STATS, [(self.run_id,) + tuple(row) for row in data])
+        self.__write_samples(conn, rows, samples, file_ops)
+
+    def __write_samples(self, conn, rows, samples, file_ops):
+        if rows:
+            conn.executemany(INSERT_SAMPLE, rows)
+        if samples:
+            file_ops.append((self.sample_file, samples))
+
+    def __open_sample_file(self, conn, params, opened, file_ops):
+        self.__end_sample_file(file_ops)
+        store = params.get('SAMPLE_STORE', 'db')
+        self.__db_samples = store != 'file'
+        if store not in ('file', 'both'):
+            return
+        path = run_file(self.sample_dir, self.run_id)
+        try:
+            os.makedirs(self.sample_dir, exist_ok=True)
+            self.sample_file = SampleFileWriter(path, params.get('CHANNELS') or [], dict(params, RUN_ID=self.run_id))
+            opened.append(self.sample_file)
+        except (OSError, ValueError) as e:
+            # Never lose the run over the file, fall back to tblSamples
+            self.__db_samples = True
+            conn.execute(INSERT_EVENT, (self.run_id, time.time(), 'sample_file_error', str(e)))
+            return
+        conn.execute(INSERT_EVENT, (self.run_id, time.time(), 'sample_file', path))
+
+    def __end_sample_file(self, file_ops):
+        if self.sample_file is not None:
+            file_ops.append((self.sample_file, None))
+            self.sample_file = None
+
+    def __close_sample_file(self):
+        if self.sample_file is not None:
+            self.sample_file.close()
+            self.sample_file = None
+
+    def __insert_run(self, conn, params):
+        cursor = conn.execute(
+            "INSERT INTO tblRuns (STARTED, MODE, SETPT, P, I, D, TC_FILTER, PARAMS) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (now_text(), params.get('MODE'), params.get('SETPT'), params.get('P'), params.get('I'),
+             params.get('D'), params.get('TC_FILTER'), json.dumps(params)))
+        self.run_id = cursor.lastrowid
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+""" Append-only binary sample files for long soak runs.
+
+    A .hts file is a 4 KiB header followed by fixed width little endian
+    records, one per Sample, in the order the worker produced them:
+
+        magic 'HTSAMPLE', u32 version, u32 JSON length, JSON, zero padding
+        records  timestamp f8, temperature f8, setpoint f8, output f8,
+                 duty f8, heater u1, channel u1   (42 bytes, packed)
+
+    The JSON holds the record dtype, the channel names (a record's channel
+    is an index into them), INDEX_EVERY and the run parameters. Timestamps
+    never decrease, so a time range is a contiguous slice of records.
+
+    Every INDEX_EVERY-th record's timestamp goes to a .hts.idx sidecar of
+    (record, timestamp) pairs. SampleFile memory-maps the records and finds
+    a time in O(log n): a bisect of the index, then a binary search of one
+    block. Reads return NumPy views of the map, nothing is copied or parsed
+    up front, so a multi-GB recording opens instantly.
+
+    Crash safety comes from appending only: the header is synced before
+    any record, each flush() syncs the records and only then appends their
+    index entries. A torn last record is ignored by the reader and an index
+    that does not match the records is rebuilt from them.
+
+        python3 sample_file.py samples/run_000042.hts --start 3600 --end 7200
+"""
+import argparse
+import json
+import math
+import os
+import struct
+import time
+
+import numpy
+
+import run_analytics
+
+MAGIC = b'HTSAMPLE'
+VERSION = 1
+HEADER_SIZE = 4096  # records start page aligned
+INDEX_EVERY = 4096  # records per index entry
+SUFFIX = '.hts'
+RECORD_DTYPE = numpy.dtype([
+    ('timestamp', '<f8'),
+    ('temperature', '<f8'),
+    ('setpoint', '<f8'),
+    ('output', '<f8'),
+    ('duty', '<f8'),
+    ('heater', 'u1'),
+    ('channel', 'u1'),
+])
+INDEX_DTYPE = numpy.dtype([('record', '<u8'), ('timestamp', '<f8')])
+_PREFIX = struct.Struct('<8sII')
+
+
+def run_file(directory, run_id):
+    """ Path of the sample file of a tblRuns run. """
+    return os.path.join(directory, 'run_{:06d}{}'.format(run_id, SUFFIX))
+
+
+def _fsync_directory(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_header(path):
+    """ The header JSON of a sample file. """
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise ValueError("{} is not a sample file".format(path))
+        magic, version, length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError("{} is not a sample file".format(path))
+        if version != VERSION:
+            raise ValueError("{}: sample file version {} not supported".format(path, version))
+        return json.loads(f.read(length).decode('utf-8'))
+
+
+class SampleFileWriter(object):
+    """ Appends Sample records to a new sample file.
+
+        append() only buffers in the file object; flush() makes everything
+        appended so far durable. Used by a single thread, the RunLogger.
+    """
+
+    def __init__(self, path, channels, metadata=None, index_every=INDEX_EVERY):
+        self.path = path
+        self.index_every = index_every
+        self.count = 0  # records appended
+        header = json.dumps({
+            'dtype': RECORD_DTYPE.descr,
+            'channels': list(channels),
+            'index_every': index_every,
+            'created': time.time(),
+            'metadata': metadata or {},
+        }, default=str).encode('utf-8')
+        if _PREFIX.size + len(header) > HEADER_SIZE:
+            raise ValueError("Sample file header is {} bytes, over {}".format(len(header), HEADER_SIZE))
+
+        self.__data = open(path, 'xb')
+        self.__data.write(_PREFIX.pack(MAGIC, VERSION, len(header)) + header)
+        self.__data.write(bytes(HEADER_SIZE - _PREFIX.size - len(header)))
+        self.__data.flush()
+        os.fsync(self.__data.fileno())
+        _fsync_directory(path)
+        self.__index = open(path + '.idx', 'wb')
+        self.__pending = []  # index entries of records not yet synced
+
+    def append(self, samples):
+        """ Append a list of control_worker.Sample (or tuples in its field order). """
+        if not samples:
+            return
+        records = numpy.array(samples, dtype=RECORD_DTYPE)
+        self.__data.write(records.tobytes())
+        first = -self.count % self.index_every
+        for i in range(first, len(records), self.index_every):
+            self.__pending.append((self.count + i, records['timestamp'][i]))
+        self.count += len(records)
+
+    def flush(self):
+        self.__data.flush()
+        os.fsync(self.__data.fileno())
+        # Entries only ever point at synced records; the index itself can be rebuilt
+        if self.__pending:
+            self.__index.write(numpy.array(self.__pending, dtype=INDEX_DTYPE).tobytes())
+            self.__index.flush()
+            self.__pending = []
+
+    def close(self):
+        self.flush()
+        self.__data.close()
+        self.__index.close()
+
+
+class SampleFile(object):
+    """ Read-only memory map of a sample file.
+
+        records is a structured NumPy array backed by the file; the map is
+        released when the SampleFile and every view of it are dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self.channels = self.header['channels']
+        self.metadata = self.header['metadata']
+        self.index_every = self.header['index_every']
+        dtype = numpy.dtype([tuple(field) for field in self.header['dtype']])
+        # A record torn by a crash is not counted
+        count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+        if count > 0:
+            self.records = numpy.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+        else:
+            self.records = numpy.zeros(0, dtype=dtype)
+        self.index = self.__load_index()
+        self.__index_times = numpy.ascontiguousarray(self.index['timestamp'])
+
+    def __len__(self):
+        return len(self.records)
+
+    def __load_index(self):
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b''
+        # Drop a torn last entry
+        entries = len(data) // INDEX_DTYPE.itemsize
+        index = numpy.frombuffer(data, dtype=INDEX_DTYPE, count=entries)
+        expected = (len(self.records) + self.index_every - 1) // self.index_every
+        index = index[:expected]
+        # Entries lag the records by at most one flush; a stale or foreign index is rebuilt
+        for entry in (0, -1)[:len(index)]:
+            record, timestamp = index[entry]
+            if record != entry % len(index) * self.index_every or timestamp != self.records['timestamp'][record]:
+                index = numpy.zeros(0, dtype=INDEX_DTYPE)
+                break
+        if len(index) < expected:
+            records = numpy.arange(len(index), expected, dtype='u8') * self.index_every
+            missing = numpy.zeros(len(records), dtype=INDEX_DTYPE)
+            missing['record'] = records
+            missing['timestamp'] = self.records['timestamp'][records]
+            index = numpy.concatenate([index, missing])
+        return index
+
+    def time_range(self):
+        """ (first, last) timestamp, None when there are no records. """
+        if not len(self.records):
+            return None
+        return float(self.records['timestamp'][0]), float(self.records['timestamp'][-1])
+
+    def seek(self, timestamp, side='left'):
+        """ Record number of the first sample at (side='left') or after ('right') timestamp. """
+        block = numpy.searchsorted(self.__index_times, timestamp, side)
+        # The answer lies in (entry block - 1, entry block]; search just those records
+        low = int(self.index['record'][block - 1]) if block > 0 else 0
+        high = int(self.index['record'][block]) if block < len(self.index) else len(self.records)
+        return low + int(numpy.searchsorted(self.records['timestamp'][low:high], timestamp, side))
+
+    def window(self, start=None, end=None, channel=None, max_points=None):
+        """ Samples with start <= timestamp <= end.
+
+            A view of the map unless channel is given; then only the
+            channel's records are copied out. max_points decimates to about
+            that many samples of the channel before anything is read.
+        """
+        first = 0 if start is None else self.seek(start)
+        last = len(self.records) if end is None else self.seek(end, 'right')
+        records = self.records[first:last]
+        if max_points:
+            channels = max(1, len(self.channels)) if channel is not None else 1
+            step = max(1, len(records) // (max_points * channels))
+            # Channels are interleaved; a step sharing a factor with their count would skip some
+            while math.gcd(step, channels) != 1:
+                step += 1
+            records = records[::step]
+        if channel is not None:
+            records = records[records['channel'] == channel]
+        return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a binary sample file')
+    parser.add_argument('path')
+    parser.add_argument('--start', type=float, help='run seconds, default first sample')
+    parser.add_argument('--end', type=float, help='run seconds, default last sample')
+    parser.add_argument('--band', type=float, default=1.0, help='settling band, C')
+    parser.add_argument('--watts', type=float, default=0.0, help='heater power for the energy estimate')
+    args = parser.parse_args()
+
+    recording = SampleFile(args.path)
+    span = recording.time_range()
+    print("{}: {} records, channels {}, {}".format(
+        args.path, len(recording), ', '.join(recording.channels),
+        'empty' if span is None else '{:.1f} s to {:.1f} s'.format(*span)))
+    records = recording.window(args.start, args.end)
+    for stats in run_analytics.analyse(records, args.band, args.watts):
+        name = recording.channels[stats.channel] if stats.channel < len(recording.channels) else stats.channel
+        print("{}: {} samples, min {} max {}".format(name, stats.samples, stats.minimum, stats.maximum))
+        print('    ' + run_analytics.summary(stats).replace('\n', '\n    '))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import math
+from collections import namedtuple
+
+import dbtables
+
+# One row of tblProfileSegments. kind is one of
+#   'step'  jump to target
+#   'ramp'  straight line to target over duration s, or at rate C/s
+#   'soak'  hold target (or the current setpoint) for duration s
+#   'hold'  hold target until every channel has been within +/- band for
+#           hold_seconds; duration > 0 is a timeout that fails the run
+#   'loop'  go back to segment loop_to, loop_count more times
+Segment = namedtuple('Segment', ['kind', 'target', 'duration', 'rate', 'band', 'hold_seconds',
+                                 'loop_to', 'loop_count', 'feed_forward'])
+# A row of tblProfiles with its segments in SEQ order. ff_gain / ff_tau /
+# ff_ambient describe the plant (simulator.ThermalPlant units) for
+# feed-forward; leave them NULL for none.
+Profile = namedtuple('Profile', ['name', 'segments', 'ff_gain', 'ff_tau', 'ff_ambient'])
+
+SEGMENT_KINDS = ('step', 'ramp', 'soak', 'hold', 'loop')
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS "tblProfiles" (
+        "PK_ID"	INTEGER PRIMARY KEY AUTOINCREMENT,
+        "NAME"	TEXT NOT NULL UNIQUE,
+        "FF_GAIN"	REAL,
+        "FF_TAU"	REAL,
+        "FF_AMBIENT"	REAL,
+        "DESCRIPTION"	TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS "tblProfileSegments" (
+        "PK_ID"	INTEGER PRIMARY KEY AUTOINCREMENT,
+        "FK_PROFILE_ID"	INTEGER NOT NULL,
+        "SEQ"	INTEGER NOT NULL,
+        "KIND"	TEXT NOT NULL,
+        "TARGET"	REAL,
+        "DURATION"	REAL,
+        "RATE"	REAL,
+        "BAND"	REAL,
+        "HOLD_SECONDS"	REAL,
+        "LOOP_TO"	INTEGER,
+        "LOOP_COUNT"	INTEGER,
+        "FEED_FORWARD"	REAL
+    )""",
+)
+
+# The example qualification profile a new database starts with
+DEFAULT_PROFILES = (
+    ('QUAL_CYCLE', 520.0, 240.0, 22.0, 'Ramp 150 C, soak, ramp 300 C, soak, cool to 50 C, twice'),
+)
+INSERT_PROFILE = ("INSERT OR IGNORE INTO tblProfiles (NAME, FF_GAIN, FF_TAU, FF_AMBIENT, DESCRIPTION) "
+                  "VALUES (?, ?, ?, ?, ?)")
+# (profile, seq, kind, target, duration, rate, band, hold_seconds, loop_to, loop_count)
+DEFAULT_SEGMENTS = (
+    ('QUAL_CYCLE', 0, 'ramp', 150.0, None, 2.0, None, None, None, None),
+    ('QUAL_CYCLE', 1, 'hold', 150.0, 600.0, None, 2.0, 30.0, None, None),
+    ('QUAL_CYCLE', 2, 'soak', 150.0, 300.0, None, None, None, None, None),
+    ('QUAL_CYCLE', 3, 'ramp', 300.0, None, 1.0, None, None, None, None),
+    ('QUAL_CYCLE', 4, 'hold', 300.0, 600.0, None, 2.0, 30.0, None, None),
+    ('QUAL_CYCLE', 5, 'soak', 300.0, 600.0, None, None, None, None, None),
+    ('QUAL_CYCLE', 6, 'ramp', 50.0, None, 0.5, None, None, None, None),
+    ('QUAL_CYCLE', 7, 'loop', None, None, None, None, None, 0, 1),
+)
+# Segments hang off the profile's PK_ID; a SEQ the profile already has is left alone
+INSERT_SEGMENT = ("INSERT INTO tblProfileSegments (FK_PROFILE_ID, SEQ, KIND, TARGET, DURATION, RATE, BAND, "
+                  "HOLD_SECONDS, LOOP_TO, LOOP_COUNT) "
+                  "SELECT p.PK_ID, :seq, :kind, :target, :duration, :rate, :band, :hold, :loop_to, :loop_count "
+                  "FROM tblProfiles p WHERE p.NAME = :profile AND NOT EXISTS "
+                  "(SELECT 1 FROM tblProfileSegments s WHERE s.FK_PROFILE_ID = p.PK_ID AND s.SEQ = :seq)")
+_SEGMENT_FIELDS = ('profile', 'seq', 'kind', 'target', 'duration', 'rate', 'band', 'hold', 'loop_to', 'loop_count')
+
+
+def _number(value, default=None):
+    return default if value is None or value == '' else float(value)
+
+
+def _ensure_tables(db):
+    dbtables.ensure_tables(db, SCHEMA, [(INSERT_PROFILE, DEFAULT_PROFILES),
+                                        (INSERT_SEGMENT, [dict(zip(_SEGMENT_FIELDS, segment))
+                                                          for segment in DEFAULT_SEGMENTS])])
+
+
+def _check_segment(segment, index):
+    """ What is wrong with the segment at position index, None if it can run. """
+    if segment.duration < 0:
+        return "DURATION must not be negative"
+    if segment.kind in ('step', 'ramp') and segment.target is None:
+        return "{} needs TARGET".format(segment.kind)
+    if segment.kind == 'ramp':
+        if segment.rate is not None and not segment.rate > 0:
+            return "RATE must be positive"
+        if segment.rate is None and not segment.duration > 0:
+            return "ramp needs a positive RATE or DURATION"
+    if segment.kind == 'soak' and not segment.duration > 0:
+        return "soak needs a positive DURATION"
+    if segment.kind == 'hold':
+        if not segment.band > 0:
+            return "BAND must be positive"
+        if segment.hold_seconds < 0:
+            return "HOLD_SECONDS must not be negative"
+    if segment.kind == 'loop':
+        if not 0 <= segment.loop_to < index:
+            return "LOOP_TO must be an earlier segment (0 to {})".format(index - 1)
+        if segment.loop_count < 0:
+            return "LOOP_COUNT must not be negative"
+    return None
+
+
+def profile_names(db):
+    _ensure_tables(db)
+    return [row['NAME'] for row in dbtables.table_to_dictionary(db, 'tblProfiles')]
+
+
+def load_profile(db, name):
+    """ Read a profile by name from tblProfiles / tblProfileSegments.
+
+        ValueError if it does not exist or a segment could not run, e.g. a
+        ramp without TARGET or a loop that does not jump back.
+    """
+    _ensure_tables(db)
+    rows = [row for row in dbtables.table_to_dictionary(db, 'tblProfiles') if row['NAME'] == name]
+    if not rows:
+        raise ValueError("No profile {} in tblProfiles".format(name))
+    row = rows[0]
+    segment_rows = sorted((segment for segment in dbtables.table_to_dictionary(db, 'tblProfileSegments')
+                           if segment['FK_PROFILE_ID'] == row['PK_ID']), key=lambda segment: segment['SEQ'])
+    segments = []
+    for segment in segment_rows:
+        if segment['KIND'] not in SEGMENT_KINDS:
+            raise ValueError("Profile {} segment {}: unknown kind {}".format(name, segment['SEQ'], segment['KIND']))
+        if segment['KIND'] == 'loop' and segment['LOOP_TO'] is None:
+            raise ValueError("Profile {} segment {}: loop needs LOOP_TO".format(name, segment['SEQ']))
+        segments.append(Segment(segment['KIND'], _number(segment['TARGET']), _number(segment['DURATION'], 0.0),
+                                _number(segment['RATE']), _number(segment['BAND'], 1.0),
+                                _number(segment['HOLD_SECONDS'], 0.0),
+                                int(segment['LOOP_TO'] or 0), int(segment['LOOP_COUNT'] or 0),
+                                _number(segment['FEED_FORWARD'], 0.0)))
+        problem = _check_segment(segments[-1], len(segments) - 1)
+        if problem:
+            raise ValueError("Profile {} segment {}: {}".format(name, segment['SEQ'], problem))
+    if not segments:
+        raise ValueError("Profile {} has no segments".format(name))
+    return Profile(name, tuple(segments), _number(row['FF_GAIN']), _number(row['FF_TAU']),
+                   _number(row['FF_AMBIENT']))
+
+
+class ProfileRunner(object):
+    """ Steps through a Profile as the control loop ticks.
+
+        update() is called once per tick with the run time and the channel
+        temperatures. Only the current segment is looked at, so a tick costs
+        O(1) whatever the length of the profile; a segment that ends
+        mid-tick hands over at its planned end time, so the schedule does not
+        drift with tick jitter.
+
+        After each update: setpoint, slope (C/s), feed_forward (duty 0..1),
+        index of the current segment, changed (index moved this tick), done
+        and status ('complete' or 'hold_timeout').
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.segments = profile.segments
+        self.index = -1
+        self.setpoint = None
+        self.slope = 0.0
+        self.feed_forward = 0.0
+        self.changed = False
+        self.done = False
+        self.status = None
+        self.__loops = {}  # loop segment index -> repeats left
+        self.__start_time = 0.0
+        self.__end_time = 0.0
+        self.__start_setpoint = 0.0
+        self.__target = 0.0
+        self.__in_band_since = None
+
+    def update(self, timestamp, temperatures):
+        self.changed = False
+        if self.done:
+            return self.setpoint
+        if self.index < 0:
+            # First ramp starts from where the heaters are now
+            valid = [t for t in temperatures if t == t]
+            self.setpoint = sum(valid) / len(valid) if valid else (self.segments[0].target or 0.0)
+            self.__enter(0, timestamp)
+
+        while not self.done:
+            segment = self.segments[self.index]
+            if segment.kind == 'hold':
+                if not self.__hold_satisfied(segment, timestamp, temperatures):
+                    if segment.duration > 0 and timestamp - self.__start_time >= segment.duration:
+                        self.__finish('hold_timeout')
+                    break
+                self.__enter(self.index + 1, timestamp)
+            elif timestamp >= self.__end_time:
+                self.setpoint = self.__target  # a ramp ended mid-tick, the next segment starts at its target
+                self.__enter(self.index + 1, self.__end_time)
+            else:
+                break
+
+        if not self.done:
+            self.setpoint = self.__start_setpoint + self.slope * (timestamp - self.__start_time)
+            if self.slope == 0.0:
+                self.setpoint = self.__target
+        self.feed_forward = self.__feed_forward()
+        return self.setpoint
+
+    def __hold_satisfied(self, segment, timestamp, temperatures):
+        if temperatures and all(abs(t - self.__target) <= segment.band for t in temperatures):
+            if self.__in_band_since is None:
+                self.__in_band_since = timestamp
+            return timestamp - self.__in_band_since >= segment.hold_seconds
+        self.__in_band_since = None
+        return False
+
+    def __finish(self, status):
+        self.done = True
+        self.status = status
+        self.slope = 0.0
+        self.changed = True
+
+    def __enter(self, index, timestamp):
+        while True:
+            if index >= len(self.segments):
+                self.__finish('complete')
+                return
+            segment = self.segments[index]
+            if segment.kind != 'loop':
+                break
+            # Loops take no time: jump straight to the target segment
+            remaining = self.__loops.get(index, segment.loop_count)
+            if remaining > 0:
+                self.__loops[index] = remaining - 1
+                index = segment.loop_to
+            else:
+                self.__loops.pop(index, None)  # an outer loop runs this one afresh
+                index += 1
+
+        self.index = index
+        self.changed = True
+        self.__start_time = timestamp
+        self.__start_setpoint = self.setpoint
+        self.__target = self.setpoint if segment.target is None else segment.target
+        self.__in_band_since = None
+        self.slope = 0.0
+        duration = segment.duration
+        if segment.kind == 'step':
+            duration = 0.0
+        elif segment.kind == 'ramp':
+            if segment.rate:
+                duration = abs(self.__target - self.setpoint) / segment.rate
+            if duration > 0:
+                self.slope = (self.__target - self.setpoint) / duration
+        elif segment.kind == 'hold':
+            duration = math.inf
+        self.__end_time = timestamp + duration
+        if self.slope == 0.0:
+            self.setpoint = self.__target
+
+    def __feed_forward(self):
+        # Inverse of the first order plant: duty holding the setpoint, plus
+        # the extra needed to follow the ramp
+        profile = self.profile
+        duty = 0.0
+        if profile.ff_gain and self.setpoint is not None:
+            duty = (self.setpoint - (profile.ff_ambient or 0.0)
+                    + (profile.ff_tau or 0.0) * self.slope) / profile.ff_gain
+        if 0 <= self.index < len(self.segments):
+            duty += self.segments[self.index].feed_forward
+        return min(1.0, max(0.0, duty))
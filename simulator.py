@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+""" Offline PID / bang-bang simulation against a thermal plant model.
+
+    The controller equations are the ones PID.GenOut and ControlWorker use,
+    evaluated with NumPy for many gain sets at once in fixed time steps:
+
+        Cp = Kp * e,  Ci += e * dt,  Cd = -dT / dt (low-pass filtered by d_filter)
+        out = clip(Cp + Ki * Ci + Kd * Cd, 0, SETPT),  duty = out / SETPT
+
+    with the integral held while the output is clamped and the error would
+    drive it further, as PID.SetOutputLimits does. PID itself cannot be
+    used here: each step depends on the plant's answer to the last one, and
+    the sets are stepped together. tests/test_simulator.py keeps the two
+    in agreement.
+
+    Metrics are accumulated while stepping, so memory stays O(gain sets)
+    however long the simulated run is.
+"""
+import argparse
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+# First order plus dead time model of the heater and its thermocouple.
+# gain: steady state rise above ambient at 100% duty (C), tau and dead_time in s
+ThermalPlant = namedtuple('ThermalPlant', ['gain', 'tau', 'dead_time', 'ambient'])
+
+# Tempco 150 W ceramic IR element, rough figures from a bang-bang run
+CERAMIC_150W = ThermalPlant(gain=520.0, tau=240.0, dead_time=8.0, ambient=22.0)
+
+METRICS = ('overshoot', 'rise_time', 'settling_time', 'ss_error', 'iae')
+
+
+def simulate(plant, Kp, Ki, Kd, setpoint, seconds, dt=1.0, mode='pid', hysteresis=1.0,
+             settle_band=1.0, ss_window=300.0, record=False, d_filter=0.0):
+    """ Simulate one run per gain set and return a dict of metric arrays.
+
+        Kp, Ki, Kd (and hysteresis for bang-bang) broadcast against each
+        other. Metrics:
+            overshoot      peak above setpoint, % of the step
+            rise_time      first time within 10% of the step from setpoint
+            settling_time  last time outside +/- settle_band, inf if never in
+            ss_error       setpoint - mean temperature over the last ss_window
+            iae            integral of |error|
+        With record=True the temperature and duty trajectories are returned
+        too, shape (steps, sets); keep the number of sets small for that.
+    """
+    Kp, Ki, Kd, hysteresis = numpy.broadcast_arrays(*(numpy.asarray(v, dtype=float).ravel()
+                                                      for v in (Kp, Ki, Kd, hysteresis)))
+    sets = Kp.shape[0]
+    steps = int(round(seconds / dt))
+    delay = int(round(plant.dead_time / dt))
+    a = numpy.exp(-dt / plant.tau)
+
+    temp = numpy.full(sets, float(plant.ambient))
+    duty_history = numpy.zeros((delay + 1, sets))
+    heater = numpy.zeros(sets, dtype=bool)
+    Ci = numpy.zeros(sets)
+    Cd = numpy.zeros(sets)
+    prev_temp = None
+
+    step_size = setpoint - plant.ambient
+    peak = temp.copy()
+    rise_time = numpy.full(sets, numpy.inf)
+    last_outside = numpy.zeros(sets)
+    iae = numpy.zeros(sets)
+    ss_sum = numpy.zeros(sets)
+    ss_start = max(0, steps - int(round(ss_window / dt)))
+
+    if record:
+        temp_log = numpy.empty((steps, sets))
+        duty_log = numpy.empty((steps, sets))
+
+    for k in range(steps):
+        t = (k + 1) * dt
+        err = setpoint - temp
+
+        if mode == 'pid':
+            # Derivative on measurement, no kick on the first step
+            derivative = 0.0 if prev_temp is None else (prev_temp - temp) / dt
+            Cd = Cd + (derivative - Cd) * dt / (d_filter + dt) if d_filter > 0 else derivative
+            prev_temp = temp
+            integral = Ci + err * dt
+            out = Kp * err + Ki * integral + Kd * Cd
+            hold = ((out > setpoint) & (Ki * err > 0)) | ((out < 0) & (Ki * err < 0))
+            Ci = numpy.where(hold, Ci, integral)
+            out = Kp * err + Ki * Ci + Kd * Cd
+            duty = numpy.clip(out / setpoint, 0.0, 1.0)
+        else:
+            heater = numpy.where(heater, temp < setpoint + hysteresis / 2, temp <= setpoint - hysteresis / 2)
+            duty = heater.astype(float)
+
+        # Dead time: the plant sees the duty from `delay` steps ago
+        duty_history[k % (delay + 1)] = duty
+        delayed = duty_history[(k + 1) % (delay + 1)]
+        temp = plant.ambient + a * (temp - plant.ambient) + (1.0 - a) * plant.gain * delayed
+
+        numpy.maximum(peak, temp, out=peak)
+        err = setpoint - temp
+        abs_err = numpy.abs(err)
+        iae += abs_err * dt
+        rise_time = numpy.where(numpy.isinf(rise_time) & (abs_err <= 0.1 * abs(step_size)), t, rise_time)
+        last_outside = numpy.where(abs_err > settle_band, t, last_outside)
+        if k >= ss_start:
+            ss_sum += temp
+        if record:
+            temp_log[k] = temp
+            duty_log[k] = duty
+
+    settling_time = numpy.where(last_outside >= steps * dt, numpy.inf, last_outside)
+    result = {
+        'overshoot': numpy.maximum(peak - setpoint, 0.0) / abs(step_size) * 100.0,
+        'rise_time': rise_time,
+        'settling_time': settling_time,
+        'ss_error': setpoint - ss_sum / max(1, steps - ss_start),
+        'iae': iae,
+    }
+    if record:
+        result['temperature'] = temp_log
+        result['duty'] = duty_log
+    return result
+
+
+def _simulate_chunk(args):
+    plant, Kp, Ki, Kd, kwargs = args
+    return simulate(plant, Kp, Ki, Kd, **kwargs)
+
+
+def sweep(plant, Kp, Ki, Kd, processes=None, chunk_size=2000, **kwargs):
+    """ Simulate flat arrays of gain sets, split across processes.
+
+        Returns a dict with the gain arrays and every metric array.
+    """
+    Kp, Ki, Kd = (numpy.asarray(v, dtype=float).ravel() for v in numpy.broadcast_arrays(Kp, Ki, Kd))
+    chunks = [(plant, Kp[i:i + chunk_size], Ki[i:i + chunk_size], Kd[i:i + chunk_size], kwargs)
+              for i in range(0, len(Kp), chunk_size)]
+    if processes == 1 or len(chunks) == 1:
+        results = [_simulate_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_simulate_chunk, chunks))
+
+    table = {'Kp': Kp, 'Ki': Ki, 'Kd': Kd}
+    for name in METRICS:
+        table[name] = numpy.concatenate([result[name] for result in results])
+    return table
+
+
+def grid_search(plant, kp_values, ki_values, kd_values, **kwargs):
+    """ Sweep the full Kp x Ki x Kd grid. """
+    Kp, Ki, Kd = numpy.meshgrid(kp_values, ki_values, kd_values, indexing='ij')
+    return sweep(plant, Kp, Ki, Kd, **kwargs)
+
+
+def random_search(plant, count, kp_range, ki_range, kd_range, seed=None, **kwargs):
+    """ Sweep `count` gain sets drawn log-uniformly from (low, high) ranges. """
+    rng = numpy.random.default_rng(seed)
+
+    def draw(low, high):
+        if low <= 0:
+            return rng.uniform(low, high, count)
+        return numpy.exp(rng.uniform(numpy.log(low), numpy.log(high), count))
+
+    return sweep(plant, draw(*kp_range), draw(*ki_range), draw(*kd_range), **kwargs)
+
+
+def rank(table, overshoot_limit=5.0, top=10):
+    """ Indices of the best gain sets: lowest IAE among those under the overshoot limit. """
+    score = numpy.where(table['overshoot'] <= overshoot_limit, table['iae'], numpy.inf)
+    order = numpy.argsort(score, kind='stable')
+    return order[numpy.isfinite(score[order])][:top]
+
+
+def _parse_range(text):
+    # "start:stop:num" -> linspace, or a single value
+    parts = [float(p) for p in text.split(':')]
+    if len(parts) == 1:
+        return numpy.array(parts)
+    return numpy.linspace(parts[0], parts[1], int(parts[2]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep PID gains against a simulated heater')
+    parser.add_argument('--kp', default='0:20:41', help='start:stop:num or a value')
+    parser.add_argument('--ki', default='0:0.05:26')
+    parser.add_argument('--kd', default='0')
+    parser.add_argument('--setpoint', type=float, default=300.0)
+    parser.add_argument('--seconds', type=float, default=4000.0)
+    parser.add_argument('--gain', type=float, default=CERAMIC_150W.gain)
+    parser.add_argument('--tau', type=float, default=CERAMIC_150W.tau)
+    parser.add_argument('--dead-time', type=float, default=CERAMIC_150W.dead_time)
+    parser.add_argument('--ambient', type=float, default=CERAMIC_150W.ambient)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--d-filter', type=float, default=0.0, help='derivative filter time constant, s')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    plant = ThermalPlant(args.gain, args.tau, args.dead_time, args.ambient)
+    table = grid_search(plant, _parse_range(args.kp), _parse_range(args.ki), _parse_range(args.kd),
+                        setpoint=args.setpoint, seconds=args.seconds, processes=args.processes,
+                        d_filter=args.d_filter)
+
+    print("{:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s}".format(
+        'Kp', 'Ki', 'Kd', 'OS %', 'rise s', 'settle s', 'ss err'))
+    for i in rank(table, top=args.top):
+        print("{:9.3f} {:9.5f} {:9.3f} {:9.2f} {:9.0f} {:9.0f} {:9.2f}".format(
+            table['Kp'][i], table['Ki'][i], table['Kd'][i], table['overshoot'][i],
+            table['rise_time'][i], table['settling_time'][i], table['ss_error'][i]))
+
+
+if __name__ == "__main__":
+    main()
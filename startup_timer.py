@@ -0,0 +1,34 @@
+import contextlib
+import threading
+import time
+
+
+class StartupTimer(object):
+    """ Wall clock time of each startup phase, for the --timing report.
+
+        Phases may run on different threads; each records its start and end
+        relative to the timer's creation, so overlap is visible.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter() - self.t0
+        try:
+            yield
+        finally:
+            self.phases.append((name, start, time.perf_counter() - self.t0, threading.current_thread().name))
+
+    def mark(self, name):
+        now = time.perf_counter() - self.t0
+        self.phases.append((name, now, now, threading.current_thread().name))
+
+    def report(self):
+        lines = ["{:<24s} {:>9s} {:>9s} {:>9s}  {}".format('phase', 'start ms', 'end ms', 'took ms', 'thread')]
+        for name, start, end, thread in sorted(self.phases, key=lambda phase: phase[1]):
+            lines.append("{:<24s} {:9.1f} {:9.1f} {:9.1f}  {}".format(
+                name, start * 1000, end * 1000, (end - start) * 1000, thread))
+        return '\n'.join(lines)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+""" Plant model identification from recorded runs.
+
+    A run is a series of (timestamp, heater duty 0..1, temperature) samples
+    at a fixed rate. The fit is an ARX least squares problem
+
+        y[k+1] = a1*y[k] (+ a2*y[k-1]) + b*u[k-d] + c
+
+    solved for every candidate dead time d. Only the normal equations are
+    kept per candidate, so a recording of any length can be streamed through
+    in chunks with constant memory.
+"""
+import argparse
+import csv
+import math
+from collections import namedtuple
+
+import numpy
+
+# Identified first order plus dead time model with 95% confidence half widths
+FopdtModel = namedtuple('FopdtModel', ['gain', 'tau', 'dead_time', 'ambient',
+                                       'gain_ci', 'tau_ci', 'rms_error', 'samples'])
+# Identified second order (two RC stages) model
+SecondOrderModel = namedtuple('SecondOrderModel', ['gain', 'tau1', 'tau2', 'dead_time', 'ambient',
+                                                   'gain_ci', 'rms_error', 'samples'])
+# Controller in duty units: duty = Kc * (e + 1/Ti * integral(e) + Td * de/dt)
+Tuning = namedtuple('Tuning', ['rule', 'Kc', 'Ti', 'Td'])
+
+Z95 = 1.96
+
+
+class ArxFitter(object):
+    """ Streaming least squares fit of the ARX model above. """
+
+    def __init__(self, dt, order=1, max_delay=60):
+        self.dt = dt
+        self.order = order
+        self.max_delay = max_delay
+        params = order + 2
+        delays = max_delay + 1
+        self.xtx = numpy.zeros((delays, params, params))
+        self.xty = numpy.zeros((delays, params))
+        self.yty = numpy.zeros(delays)
+        self.count = numpy.zeros(delays, dtype=int)
+        self.__tail_u = numpy.empty(0)
+        self.__tail_y = numpy.empty(0)
+
+    def update(self, duty, temperature):
+        """ Add the next chunk of samples, contiguous with the previous chunk. """
+        u = numpy.concatenate([self.__tail_u, numpy.asarray(duty, dtype=float)])
+        y = numpy.concatenate([self.__tail_y, numpy.asarray(temperature, dtype=float)])
+        history = max(self.max_delay, self.order - 1)
+        start = history  # first k with every regressor available
+        if len(y) - 1 > start:
+            target = y[start + 1:]
+            lags = [y[start - i:len(y) - 1 - i] for i in range(self.order)]
+            ones = numpy.ones_like(target)
+            for d in range(self.max_delay + 1):
+                x = numpy.column_stack(lags + [u[start - d:len(u) - 1 - d], ones])
+                self.xtx[d] += x.T @ x
+                self.xty[d] += x.T @ target
+                self.yty[d] += target @ target
+                self.count[d] += len(target)
+        # Keep just enough history to build regressors across the chunk boundary
+        keep = history + 1
+        self.__tail_u = u[-keep:]
+        self.__tail_y = y[-keep:]
+
+    def __solve(self, d):
+        theta = numpy.linalg.lstsq(self.xtx[d], self.xty[d], rcond=None)[0]
+        sse = self.yty[d] - 2 * theta @ self.xty[d] + theta @ self.xtx[d] @ theta
+        dof = max(1, self.count[d] - len(theta))
+        sigma2 = max(sse, 0.0) / dof
+        cov = sigma2 * numpy.linalg.pinv(self.xtx[d])
+        return theta, cov, sse
+
+    def best_delay(self):
+        sse = [self.__solve(d)[2] if self.count[d] > self.order + 2 else numpy.inf
+               for d in range(self.max_delay + 1)]
+        return int(numpy.argmin(sse))
+
+    def fopdt(self):
+        if self.order != 1:
+            raise ValueError("fopdt() needs an order 1 fitter")
+        d = self.best_delay()
+        theta, cov, sse = self.__solve(d)
+        a, b, c = theta
+        if not 0 < a < 1:
+            raise ValueError("Recording does not look like a stable first order response")
+        tau = -self.dt / math.log(a)
+        gain = b / (1 - a)
+        # Delta method through tau = -dt/ln(a) and K = b/(1-a)
+        dtau = numpy.array([self.dt / (a * math.log(a) ** 2), 0, 0])
+        dgain = numpy.array([b / (1 - a) ** 2, 1 / (1 - a), 0])
+        return FopdtModel(float(gain), tau, d * self.dt, float(c / (1 - a)),
+                          Z95 * math.sqrt(dgain @ cov @ dgain),
+                          Z95 * math.sqrt(dtau @ cov @ dtau),
+                          math.sqrt(max(sse, 0.0) / self.count[d]), int(self.count[d]))
+
+    def second_order(self):
+        if self.order != 2:
+            raise ValueError("second_order() needs an order 2 fitter")
+        d = self.best_delay()
+        theta, cov, sse = self.__solve(d)
+        a1, a2, b, c = theta
+        poles = numpy.roots([1, -a1, -a2])
+        if numpy.iscomplexobj(poles) or numpy.any(poles <= 0) or numpy.any(poles >= 1):
+            raise ValueError("Recording does not look like two stable real RC stages")
+        tau1, tau2 = sorted((-self.dt / math.log(p) for p in poles), reverse=True)
+        den = 1 - a1 - a2
+        dgain = numpy.array([b / den ** 2, b / den ** 2, 1 / den, 0])
+        return SecondOrderModel(float(b / den), tau1, tau2, d * self.dt, float(c / den),
+                                Z95 * math.sqrt(dgain @ cov @ dgain),
+                                math.sqrt(max(sse, 0.0) / self.count[d]), int(self.count[d]))
+
+
+def fit_fopdt(duty, temperature, dt, max_delay=60, chunk=100000):
+    """ Fit a FOPDT model to whole arrays, fed through the fitter in chunks. """
+    fitter = ArxFitter(dt, 1, max_delay)
+    for i in range(0, len(temperature), chunk):
+        fitter.update(duty[i:i + chunk], temperature[i:i + chunk])
+    return fitter.fopdt()
+
+
+def ziegler_nichols(model):
+    """ Ziegler-Nichols open loop (reaction curve) PID rule. """
+    theta = max(model.dead_time, 1e-3)
+    return Tuning('ziegler_nichols', 1.2 * model.tau / (model.gain * theta), 2 * theta, 0.5 * theta)
+
+
+def cohen_coon(model):
+    theta = max(model.dead_time, 1e-3)
+    r = theta / model.tau
+    return Tuning('cohen_coon',
+                  (1 / model.gain) * (1 / r) * (4.0 / 3.0 + r / 4),
+                  theta * (32 + 6 * r) / (13 + 8 * r),
+                  4 * theta / (11 + 2 * r))
+
+
+def imc(model, closed_loop_tau=None):
+    """ IMC PID for FOPDT; closed_loop_tau (lambda) defaults to the dead time. """
+    theta = max(model.dead_time, 1e-3)
+    lam = closed_loop_tau if closed_loop_tau is not None else theta
+    return Tuning('imc',
+                  (2 * model.tau + theta) / (model.gain * (2 * lam + theta)),
+                  model.tau + theta / 2,
+                  model.tau * theta / (2 * model.tau + theta))
+
+
+def pid_gains(tuning, setpoint):
+    """ Convert a duty-unit tuning to PID.Kp/Ki/Kd.
+
+        ControlWorker uses duty = GenOut(error) / SETPT and GenOut returns
+        Kp*e + Ki*integral(e) + Kd*de/dt, so the gains scale with SETPT.
+    """
+    kp = tuning.Kc * setpoint
+    return kp, kp / tuning.Ti, kp * tuning.Td
+
+
+def read_csv_chunks(path, chunk=100000):
+    """ Yield (timestamp, duty, temperature) arrays from a CSV with those columns. """
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        rows = []
+        for row in reader:
+            rows.append((float(row['timestamp']), float(row['duty']), float(row['temperature'])))
+            if len(rows) == chunk:
+                yield tuple(numpy.array(rows).T)
+                rows = []
+        if rows:
+            yield tuple(numpy.array(rows).T)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit a plant model to a recorded run and propose PID gains')
+    parser.add_argument('csv', help='CSV with timestamp, duty and temperature columns')
+    parser.add_argument('--order', type=int, choices=(1, 2), default=1)
+    parser.add_argument('--max-delay', type=int, default=60, help='in samples')
+    parser.add_argument('--setpoint', type=float, default=300.0)
+    args = parser.parse_args()
+
+    # Every delay needs more regression rows than the model has parameters
+    needed = args.max_delay + args.order + 4
+    fitter = None
+    samples = 0
+    for timestamp, duty, temperature in read_csv_chunks(args.csv):
+        samples += len(timestamp)
+        if fitter is None:
+            if len(timestamp) < 2:
+                break  # no sample interval to speak of
+            fitter = ArxFitter(float(numpy.median(numpy.diff(timestamp))), args.order, args.max_delay)
+        fitter.update(duty, temperature)
+    if samples < needed:
+        parser.error("{} has {} samples, the fit needs at least {} (--max-delay + order + 4)".format(
+            args.csv, samples, needed))
+
+    try:
+        if args.order == 2:
+            print(fitter.second_order())
+            return
+        model = fitter.fopdt()
+    except ValueError as e:
+        parser.exit(1, "sysid: {}\n".format(e))
+    print("K = {:.1f} +/- {:.1f} C, tau = {:.1f} +/- {:.1f} s, dead time = {:.1f} s, ambient = {:.1f} C".format(
+        model.gain, model.gain_ci, model.tau, model.tau_ci, model.dead_time, model.ambient))
+    for rule in (imc(model), ziegler_nichols(model), cohen_coon(model)):
+        kp, ki, kd = pid_gains(rule, args.setpoint)
+        print("{:<16s} P = {:.4f}  I = {:.6f}  D = {:.4f}".format(rule.rule, kp, ki, kd))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules live flat in the repository root
+sys.path.insert(0, ROOT)
+
+
+def wait_for(condition, timeout=5.0):
+    """ Poll condition() until it is true; fails the test after timeout seconds. """
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """ A private copy of HtrTest.db; the MCP9600 register map only lives there. """
+    path = str(tmp_path / 'HtrTest.db')
+    shutil.copy(os.path.join(ROOT, 'HtrTest.db'), path)
+    return path
+
+
+@pytest.fixture
+def rack(db):
+    """ (hal.Simulation at 100x, ChannelManager on it); CH1 is the only enabled channel. """
+    pytest.importorskip('numpy')
+    import hal
+    from channel_manager import ChannelManager
+    simulation = hal.Simulation(db, speed=100)
+    manager = ChannelManager(db, simulation.io, bus_factory=simulation.bus_factory)
+    yield simulation, manager
+    manager.close()
+
+
+@pytest.fixture
+def worker(rack):
+    """ A started ControlWorker on the simulated rack. """
+    from control_worker import ControlWorker
+    worker = ControlWorker(rack[1], period=1.0)
+    worker.start()
+    yield worker
+    worker.shutdown()
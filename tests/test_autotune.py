@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+import hal
+from autotune import RelayAutotune
+from bang_bang import bang_bang
+from simulator import CERAMIC_150W
+
+
+@pytest.mark.parametrize('heater_on, tempc, heater', [
+    (False, 98.0, True),
+    (False, 99.0, True),
+    (False, 99.5, False),
+    (True, 100.5, True),
+    (True, 101.0, False),
+])
+def test_bang_bang_hysteresis(heater_on, tempc, heater):
+    assert bang_bang(heater_on, tempc, 100.0, 2.0) == heater
+
+
+def relay_run(tuner, seconds=20000):
+    clock = hal.VirtualClock()
+    plant = hal.HeaterPlant(CERAMIC_150W, clock, dt=1.0)
+    for t in range(seconds):
+        clock.now = float(t)
+        plant.set_level(1 if tuner.update(clock.now, plant.temperature()) else 0)
+        if tuner.done:
+            break
+    return tuner
+
+
+def test_relay_autotune_on_the_model_plant():
+    tuner = relay_run(RelayAutotune(150.0, 2.0))
+    assert tuner.done and not tuner.failed
+    # A few dead times per oscillation; the first, heat-up cycle is not used
+    assert 30 < tuner.Tu < 80
+    assert tuner.periods[0] > 2 * tuner.Tu
+    Kp, Ki, Kd = tuner.pid_gains('classic')
+    assert Kp > 0 and Ki > 0 and Kd > 0
+    assert tuner.pid_gains('no_overshoot')[0] < Kp
+
+
+def test_relay_autotune_gives_up():
+    tuner = relay_run(RelayAutotune(150.0, 2.0, tolerance=0.0, max_cycles=6))
+    assert tuner.done and tuner.failed
+    assert not tuner.update(1e6, 20.0)
@@ -0,0 +1,86 @@
+import math
+import sqlite3
+import time
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import hal  # noqa: E402
+from channel_manager import ChannelManager, channel_rows  # noqa: E402
+
+
+@pytest.fixture
+def full_rack(db):
+    """ All four channels enabled, CH1/CH2 on bus 1 and CH3/CH4 on bus 3, in real time. """
+    channel_rows(db)  # creates the default channels
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute("UPDATE tblChannels SET ENABLED = 1")
+        conn.execute("UPDATE tblChannels SET BUS = 3 WHERE NAME IN ('CH3', 'CH4')")
+    conn.close()
+    simulation = hal.Simulation(db)
+    manager = ChannelManager(db, simulation.io, bus_factory=simulation.bus_factory)
+    yield simulation, manager
+    manager.close()
+
+
+def test_channels_come_from_tblChannels(rack, full_rack):
+    assert [channel.name for channel in rack[1].channels] == ['CH1']
+    manager = full_rack[1]
+    assert [(channel.name, channel.bus, channel.heater_pin) for channel in manager.channels] == [
+        ('CH1', 1, 'HTR_PWR1'), ('CH2', 1, 'BCM5'), ('CH3', 3, 'BCM6'), ('CH4', 3, 'BCM12')]
+    assert sorted(manager.buses) == [1, 3]
+    assert manager.read_ids() == [0x40] * 4
+
+
+def test_read_all_sweeps_every_bus(full_rack):
+    simulation, manager = full_rack
+    read = manager.read_all()
+    assert sorted(channel.index for channel in read) == [0, 1, 2, 3]
+    assert all(channel.temperature == pytest.approx(22.0, abs=0.1) for channel in read)
+
+
+def test_missing_sensor_reads_nan_alone(full_rack):
+    simulation, manager = full_rack
+    del simulation.devices[3][0x60]  # CH3 unplugged
+    manager.read_all()
+    temperatures = [channel.temperature for channel in manager.channels]
+    assert math.isnan(temperatures[2])
+    assert not any(math.isnan(t) for t in temperatures[:2] + temperatures[3:])
+
+
+def test_read_updated_only_returns_new_conversions(full_rack):
+    simulation, manager = full_rack
+    manager.set_adc_resolution(16)
+    assert manager.conversion_time() == 0.080
+    for channel in manager.channels:
+        channel.tc.clear_status()
+    assert manager.read_updated() == []
+    time.sleep(0.1)
+    assert len(manager.read_updated()) == 4
+    # The flags were cleared by the read, nothing is new until the next conversion
+    assert manager.read_updated() == []
+
+
+def test_heater_and_pwm_drive_the_plants(full_rack):
+    simulation, manager = full_rack
+    ch2 = manager.channels[1]
+    manager.set_heater(ch2, True)
+    assert ch2.heater_on and simulation.plants['BCM5'].level == 1
+    manager.configure_pwm('soft', 1.0, 100)
+    ch4 = manager.channels[3]
+    manager.set_duty(ch4, 0.25)
+    assert manager.pwm is not None and ch4.duty_cycle == 0.25
+    manager.all_heaters_off()
+    assert manager.pwm is None
+    assert all(plant.level == 0 for plant in simulation.plants.values())
+
+
+def test_unusable_pwm_mode_falls_back_to_soft(full_rack, capsys):
+    manager = full_rack[1]
+    manager.configure_pwm('hardware', 0.01, 100)
+    manager.start_pwm()
+    assert 'falling back to soft PWM' in capsys.readouterr().err
+    assert manager.pwm_config['mode'] == 'soft'
+    assert set(manager.pwm.duty) == {'HTR_PWR1', 'BCM5', 'BCM6', 'BCM12'}
@@ -0,0 +1,25 @@
+import time
+
+import pytest
+
+from conftest import wait_for
+
+HTR_PWR1 = 4  # BCM pin of CH1's heater
+
+
+def test_pid_nan_reading_turns_pwm_off(rack, worker):
+    simulation, manager = rack
+    worker.send('gains', 5.0, 0.0, 0.0)
+    worker.send('start', {'MODE': 'pid', 'SETPT': 300, 'SECONDS': 100000})
+    wait_for(lambda: manager.pwm is not None and manager.pwm.duty.get('HTR_PWR1', 0) > 0.5)
+
+    simulation.devices[1].clear()  # thermocouple pulled
+    wait_for(lambda: worker.status[0].temperature != worker.status[0].temperature)
+    wait_for(lambda: simulation.gpio.levels[HTR_PWR1] == 0)
+    assert worker.running
+    assert manager.pwm.duty['HTR_PWR1'] == 0.0
+    # The engine keeps running but never fires the pin again
+    for _ in range(50):
+        assert simulation.gpio.levels[HTR_PWR1] == 0
+        time.sleep(0.002)
+    assert worker.status[0].duty == 0.0
@@ -0,0 +1,109 @@
+import csv
+import gzip
+import json
+import os
+import sqlite3
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import exporter  # noqa: E402
+from control_worker import Sample  # noqa: E402
+from parameters import ParameterStore  # noqa: E402
+from run_logger import RunLogger  # noqa: E402
+
+
+def record_run(path, store='db', samples=300):
+    """ Log one two-channel run through RunLogger; returns its samples in channel, time order. """
+    ParameterStore(path).close()
+    logger = RunLogger(path, batch_seconds=0.01)
+    logger.start()
+    logger.start_run({'MODE': 'pid', 'SETPT': 300, 'SAMPLE_STORE': store, 'CHANNELS': ['CH1', 'CH2']})
+    logged = []
+    for i in range(samples):
+        for channel in (0, 1):
+            sample = Sample(float(i), 20.0 + i + channel, 300.0, 1.5, 0.25, i % 2 == 0, channel)
+            logger.log(sample)
+            logged.append(sample)
+    logger.end_run()
+    logger.close()
+    return [tuple(float(getattr(s, column)) for column in exporter.COLUMNS)
+            for s in sorted(logged, key=lambda s: (s.channel, s.timestamp))]
+
+
+def read_csv(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='') as f:
+        rows = list(csv.reader(f))
+    assert tuple(rows[0]) == exporter.COLUMNS
+    return [tuple(float(value) for value in row) for row in rows[1:]]
+
+
+@pytest.mark.parametrize('store', ['db', 'file'])
+@pytest.mark.parametrize('suffix', ['.csv', '.csv.gz'])
+def test_csv_export(tmp_path, store, suffix):
+    path = str(tmp_path / 'runs.db')
+    expected = record_run(path, store)
+    out = str(tmp_path / ('run' + suffix))
+    exporter.export_run(path, 1, out, chunk=64)
+    assert read_csv(out) == expected
+    with open(out + '.json') as f:
+        metadata = json.load(f)
+    assert metadata['STATUS'] == 'complete'
+    assert metadata['PARAMS']['SAMPLE_STORE'] == store
+    assert metadata['parameters']['MODE'] == 'pid'
+
+
+@pytest.mark.parametrize('store', ['db', 'file'])
+def test_chunks_and_channel(tmp_path, store):
+    path = str(tmp_path / 'runs.db')
+    expected = record_run(path, store)
+    conn = sqlite3.connect(path)
+    try:
+        chunks = list(exporter.iter_chunks(conn, 1, channel=1, chunk=100))
+    finally:
+        conn.close()
+    assert all(len(rows) <= 100 for rows in chunks)
+    assert [tuple(map(float, row)) for rows in chunks for row in rows] == expected[300:]
+
+
+def test_missing_sample_file_and_run(tmp_path):
+    path = str(tmp_path / 'runs.db')
+    record_run(path, 'file')
+    sample_dir = os.path.join(str(tmp_path), 'samples')
+    for name in os.listdir(sample_dir):
+        os.remove(os.path.join(sample_dir, name))
+    with pytest.raises(ValueError, match='does not exist'):
+        exporter.export_run(path, 1, str(tmp_path / 'run.csv'))
+    with pytest.raises(ValueError, match='No run 2'):
+        exporter.export_run(path, 2, str(tmp_path / 'run.csv'))
+    with pytest.raises(ValueError, match='Unknown export format'):
+        exporter.export_run(path, 1, str(tmp_path / 'run.xlsx'))
+
+
+def test_database_without_runs(db, tmp_path):
+    with pytest.raises(ValueError, match='No runs'):
+        exporter.export_run(db, 1, str(tmp_path / 'run.csv'))
+
+
+def test_parquet_export(tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'runs.db')
+    expected = record_run(path)
+    out = str(tmp_path / 'run.parquet')
+    exporter.export_run(path, 1, out, chunk=64)
+    table = parquet.read_table(out)
+    assert list(zip(*(map(float, table[column].to_pylist()) for column in exporter.COLUMNS))) == expected
+    assert json.loads(table.schema.metadata[b'heatertest'])['MODE'] == 'pid'
+
+
+def test_hdf5_export(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    path = str(tmp_path / 'runs.db')
+    expected = record_run(path)
+    out = str(tmp_path / 'run.h5')
+    exporter.export_run(path, 1, out, chunk=64)
+    with h5py.File(out, 'r') as f:
+        columns = [f['samples'][column][:].tolist() for column in exporter.COLUMNS]
+    assert [tuple(map(float, row)) for row in zip(*columns)] == expected
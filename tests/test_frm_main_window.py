@@ -0,0 +1,46 @@
+import types
+
+import pytest
+
+pytest.importorskip('PyQt5')
+pytest.importorskip('pyqtgraph')
+
+from frmMainWindow import ApplicationWindow
+
+
+class StatusBar(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def showMessage(self, message, timeout=0):
+        self.messages.append(message)
+
+
+def window(events):
+    status_bar = StatusBar()
+    return types.SimpleNamespace(
+        channel=0,
+        worker=types.SimpleNamespace(drain_events=lambda: events),
+        win=types.SimpleNamespace(widget_led=types.SimpleNamespace(value=True)),
+        statusBar=lambda: status_bar,
+    )
+
+
+def test_segment_event_without_channel_is_shown():
+    fake = window([('segment', None, (1, 'ramp', 250.0))])
+    ApplicationWindow._ApplicationWindow__process_events(fake)
+    assert fake.statusBar().messages == ["Profile segment 1: ramp to 250.0"]
+
+
+def test_run_finished_turns_led_off():
+    fake = window([('run_finished', None, 'complete')])
+    ApplicationWindow._ApplicationWindow__process_events(fake)
+    assert fake.win.widget_led.value is False
+    assert fake.statusBar().messages == ["Run complete"]
+
+
+def test_other_channel_events_are_ignored():
+    fake = window([('autotune_failed', 1, None)])
+    ApplicationWindow._ApplicationWindow__process_events(fake)
+    assert fake.statusBar().messages == []
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import GPIO_config
+import hal
+
+
+@pytest.fixture
+def io():
+    return GPIO_config.io(gpio=hal.SimGpio())
+
+
+def test_hardware_pwm_pins_are_left_alone_until_driven(io):
+    io.setup_heater('BCM12')
+    io.setup_heater('BCM5')
+    assert 12 not in io.gpio.levels
+    assert io.gpio.levels[5] == 0
+    io.set_heater('BCM12', False)
+    assert 12 not in io.gpio.levels
+    io.set_heater('BCM12', True)
+    assert io.gpio.levels[12] == 1
+
+
+def test_hardware_pwm_checks(io):
+    assert isinstance(io.create_pwm('hardware', pins=['BCM12', 'BCM13']), GPIO_config.HardwarePwm)
+    with pytest.raises(ValueError, match='no hardware PWM on HTR_PWR1'):
+        io.create_pwm('hardware', pins=['HTR_PWR1'])
+    with pytest.raises(ValueError, match='BCM12 and BCM18 share PWM channel 0'):
+        io.create_pwm('hardware', pins=['BCM12', 'BCM18'])
+    io.set_heater('BCM13', True)
+    with pytest.raises(ValueError, match='BCM13 .* was driven as a GPIO'):
+        io.create_pwm('hardware', pins=['BCM13'])
+
+
+def test_soft_pwm_sets_its_pins_up(io):
+    engine = io.create_pwm('soft', period=0.01, resolution=10)
+    engine.set_duty('BCM19', 1.0)
+    engine.start()
+    try:
+        for _ in range(1000):
+            if io.gpio.levels.get(19):
+                break
+            time.sleep(0.001)
+        assert io.gpio.levels[19] == 1
+    finally:
+        engine.stop()
+    assert io.gpio.levels[19] == 0
+
+
+class StopAt(hal.VirtualClock):
+    """ Virtual time that stops the engine waiting on it once `end` is reached. """
+
+    def __init__(self, end):
+        super(StopAt, self).__init__()
+        self.end = end
+
+    def wait(self, event, timeout):
+        self.now += max(0.0, timeout)
+        if self.now >= self.end - timeout / 2:  # summed slots drift by rounding
+            event.set()
+        return event.is_set()
+
+
+def run_engine(mode, duty, seconds, **kwargs):
+    """ Run a PWM engine on virtual time; returns (on seconds, level changes) of BCM19. """
+    clock = StopAt(seconds)
+    io = GPIO_config.io(gpio=hal.SimGpio(), clock=clock)
+    edges = []
+    io.gpio.watch(19, lambda level: edges.append((clock.now, level)))
+    engine = io.create_pwm(mode, **kwargs)
+    engine.set_duty('BCM19', duty)
+    engine.run()  # returns at `end`, no thread needed
+    engine.stop()
+    on = sum(t1 - t0 for (t0, level), (t1, _) in zip(edges, edges[1:]) if level)
+    return on, edges
+
+
+@pytest.mark.parametrize('duty', [0.0, 0.05, 0.3, 0.999, 1.0])
+def test_soft_pwm_duty(duty):
+    on, edges = run_engine('soft', duty, 10.0, period=1.0, resolution=100)
+    assert on == pytest.approx(10.0 * round(duty * 100) / 100, abs=1e-6)
+    # One on and one off edge per period at most
+    assert len([level for t, level in edges if level]) <= 10
+
+
+def test_burst_fire_spreads_half_cycles():
+    on, edges = run_engine('burst', 0.25, 1.0, mains_hz=50)
+    half_cycle = 0.01
+    assert on == pytest.approx(0.25, abs=half_cycle)
+    # Every 4th half cycle, never two in a row
+    pulses = [t1 - t0 for (t0, level), (t1, _) in zip(edges, edges[1:]) if level]
+    assert pulses and all(pulse == pytest.approx(half_cycle) for pulse in pulses)
+
+
+def test_hardware_pwm_writes_sysfs(io, tmp_path):
+    for channel in (0, 1):
+        (tmp_path / 'pwm{}'.format(channel)).mkdir()
+    pwm = io.create_pwm('hardware', period=0.001, pins=['BCM12', 'BCM13'])
+    pwm.SYSFS = str(tmp_path)
+    pwm.set_duty('BCM12', 0.25)
+    pwm.set_duty('BCM13', 2.0)
+
+    def read(name):
+        return (tmp_path / name).read_text()
+    assert (read('pwm0/period'), read('pwm0/enable'), read('pwm0/duty_cycle')) == ('1000000', '1', '250000')
+    assert read('pwm1/duty_cycle') == '1000000'
+    assert pwm.level == {'BCM12': True, 'BCM13': True}
+    pwm.stop()
+    assert (read('pwm0/enable'), read('pwm0/duty_cycle'), read('pwm1/enable')) == ('0', '0', '0')
+    assert pwm.duty == {}
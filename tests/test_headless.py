@@ -0,0 +1,24 @@
+import importlib.util
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import headless
+
+SIMULATED = ['--simulate', '200', '--metrics-port', '0', '--mode', 'pid', '--setpoint', '30', '--seconds', '5']
+
+
+def test_pass_and_fail_verdicts(db):
+    assert headless.main(['--db', db, '--tolerance', '100'] + SIMULATED) == headless.EXIT_PASS
+    assert headless.main(['--db', db, '--tolerance', '0.001'] + SIMULATED) == headless.EXIT_FAIL
+
+
+@pytest.mark.skipif(importlib.util.find_spec('RPi') is not None, reason='RPi.GPIO is installed')
+def test_missing_rig_is_an_error(db, capsys):
+    assert headless.main(['--db', db, '--metrics-port', '0', '--seconds', '5']) == headless.EXIT_ERROR
+    assert 'Test rig not available' in capsys.readouterr().err
+
+
+def test_unknown_profile_is_an_error(db):
+    assert headless.main(['--db', db, '--setpoint-profile', 'NO_SUCH'] + SIMULATED) == headless.EXIT_ERROR
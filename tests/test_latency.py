@@ -0,0 +1,70 @@
+import json
+import math
+import random
+
+import pytest
+
+from conftest import wait_for
+
+import latency
+from latency import LatencyHistogram, LoopLatency
+
+
+def test_percentiles_within_one_percent():
+    rng = random.Random(2)
+    values = [rng.lognormvariate(math.log(0.002), 1.0) for _ in range(50000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == len(values)
+    assert snapshot['mean_ms'] == pytest.approx(1000.0 * sum(values) / len(values), rel=1e-3)
+    for p in latency.PERCENTILES:
+        exact = values[math.ceil(p / 100.0 * len(values)) - 1] * 1000.0
+        assert snapshot['p{:g}_ms'.format(p).replace('.', '')] == pytest.approx(exact, rel=0.01, abs=0.001)
+    assert snapshot['max_ms'] == pytest.approx(values[-1] * 1000.0, abs=0.001)
+
+
+def test_small_values_are_exact_and_large_ones_clamped():
+    histogram = LatencyHistogram(highest=1.0)
+    for us in (0, 1, 2, 200):
+        histogram.record(us / 1e6)
+    histogram.record(-0.5)  # a clock step backwards counts as 0
+    assert histogram.snapshot()['p50_ms'] == 0.001
+    histogram.record(30.0)  # over highest: bucketed at the top, max still exact
+    snapshot = histogram.snapshot()
+    assert snapshot['max_ms'] == 30000.0
+    assert snapshot['p999_ms'] <= 30000.0
+
+
+def test_empty_snapshot():
+    snapshot = LatencyHistogram().snapshot()
+    assert snapshot['count'] == 0
+    assert all(value is None for key, value in snapshot.items() if key != 'count')
+
+
+def test_loop_latency_dump_and_reset(tmp_path):
+    loop = LoopLatency()
+    loop.record('tick', 0.004)
+    loop.record('tick', 0.006)
+    path = str(tmp_path / 'latency.json')
+    loop.dump(path)
+    with open(path) as f:
+        dumped = json.load(f)
+    assert set(dumped['stages']) == set(latency.STAGES)
+    assert dumped['stages']['tick']['count'] == 2
+    table = latency.format_table(dumped)
+    assert table.splitlines()[0].split() == ['stage', 'count', 'p50', 'ms', 'p99', 'ms', 'max', 'ms']
+    assert 'wake' in table and '--' in table
+    loop.reset()
+    assert loop.snapshot()['stages']['tick']['count'] == 0
+
+
+def test_worker_records_every_tick_stage(worker):
+    worker.send('start', {'MODE': 'bang_bang', 'SETPT': 100, 'SECONDS': 100000})
+    wait_for(lambda: worker.latency.snapshot()['stages']['tick']['count'] >= 5)
+    stages = worker.latency.snapshot()['stages']
+    for stage in ('wake', 'i2c_read', 'control', 'gpio_write', 'tick'):
+        assert stages[stage]['count'] >= 5
+    assert stages['plot_update']['count'] == 0
@@ -0,0 +1,121 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+import hal  # noqa: E402
+import mcp9600  # noqa: E402
+from mcp9600 import MCP9600, decode_raw_adc, decode_temperature  # noqa: E402
+
+
+@pytest.fixture
+def sensor(db):
+    """ (MCP9600 on a SimBus, its plant, the VirtualClock driving both). """
+    clock = hal.VirtualClock()
+    plant = hal.HeaterPlant(hal.CERAMIC_150W, clock)
+    device = hal.SimMcp9600(plant, clock)
+    return MCP9600(db, hal.SimBus({0x66: device})), plant, clock
+
+
+@pytest.mark.parametrize('msb, lsb, tempc', [
+    (0x00, 0x00, 0.0),
+    (0x01, 0x90, 25.0),
+    (0x12, 0xC1, 300.0625),
+    (0xFF, 0xFF, -0.0625),
+    (0xFE, 0x70, -25.0),
+])
+def test_decode_temperature(msb, lsb, tempc):
+    assert decode_temperature(msb, lsb) == tempc
+
+
+def test_decode_raw_adc_sign_extends():
+    assert decode_raw_adc(0x00, 0x01, 0x00) == 256
+    assert decode_raw_adc(0xFF, 0xFF, 0xFF) == -1
+    assert decode_raw_adc(0x80, 0x00, 0x00) == -0x800000
+
+
+def test_register_map_is_compiled_once(db):
+    reg_map = mcp9600.load_register_map(db)
+    assert mcp9600.load_register_map(db) is reg_map
+    assert reg_map['Status'].address == mcp9600.REG_STATUS
+    assert reg_map['RawAdcData'].size == 3
+    field = reg_map['ThermocoupleSensorConfiguration'].bits['FilterCoefficients']
+    assert mcp9600.get_field(0xFF, field) == field.mask
+    with pytest.raises(TypeError):
+        reg_map['Status'] = None
+
+
+def test_reads_follow_the_plant(sensor):
+    device, plant, clock = sensor
+    assert device.mcp9600_read_id() == 0x40
+    plant.set_level(1)
+    clock.now += 600.0
+    assert device.read_tc() == pytest.approx(plant.temperature(), abs=0.0625)
+    assert device.read_cold_junction() == plant.model.ambient
+
+
+def test_fields_and_resolution(sensor):
+    device = sensor[0]
+    device.write_tc_filter_value(5)
+    assert device.read_tc_filter() == 5
+    device.write_tc_filter_value(0)
+    assert device.read_tc_filter() == 0
+    device.set_adc_resolution(12)
+    assert device.read_field('DeviceConguration', 'AdcResolution') == mcp9600.ADC_RESOLUTION[12]
+    assert device.conversion_time() == mcp9600.CONVERSION_TIME[12]
+
+
+def test_conversion_ready_clears_the_flag(sensor):
+    device, plant, clock = sensor
+    device.set_adc_resolution(16)
+    device.clear_status()
+    assert not device.conversion_ready()
+    clock.now += mcp9600.CONVERSION_TIME[16]
+    assert device.conversion_ready()
+    assert not device.conversion_ready()
+
+
+def test_decode_snapshot():
+    status = mcp9600.STATUS_TH_UPDATED | mcp9600.STATUS_INPUT_RANGE | 0x05
+    snapshot = mcp9600.decode_snapshot([status], [0x12, 0xC0], [0x11, 0x40], [0x01, 0x80], [0xFF, 0xFF, 0xF0])
+    assert snapshot == mcp9600.Snapshot(300.0, 276.0, 24.0, -16, status, True, False, True, 0x05)
+
+
+class CountingBus(hal.SimBus):
+    def __init__(self, devices):
+        super(CountingBus, self).__init__(devices)
+        self.transfers = 0
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        self.transfers += 1
+        return super(CountingBus, self).read_i2c_block_data(i2c_addr, register, length)
+
+
+class RdwrBus(CountingBus):
+    """ SimBus with smbus2's combined transfer: a pointer write, then a read, per register. """
+
+    def i2c_rdwr(self, *msgs):
+        self.transfers += 1
+        for write, read in zip(msgs[::2], msgs[1::2]):
+            data = self.devices[read.addr].read(list(write)[0], read.len)
+            for i, byte in enumerate(data):
+                read.buf[i] = bytes([byte])
+
+
+@pytest.mark.parametrize('bus_class', [CountingBus, RdwrBus])
+def test_read_snapshot(db, bus_class):
+    if bus_class is RdwrBus:
+        pytest.importorskip('smbus2')
+    clock = hal.VirtualClock()
+    plant = hal.HeaterPlant(hal.CERAMIC_150W, clock)
+    bus = bus_class({0x66: hal.SimMcp9600(plant, clock)})
+    device = MCP9600(db, bus)
+    plant.set_level(1)
+    clock.now += 300.0
+    bus.transfers = 0
+
+    snapshot = device.read_snapshot()
+    assert bus.transfers == (1 if bus_class is RdwrBus else len(mcp9600.SNAPSHOT_REGISTERS))
+    assert snapshot.hot_junction == pytest.approx(plant.temperature(), abs=0.0625)
+    assert snapshot.cold_junction == plant.model.ambient
+    assert snapshot.junction_delta == pytest.approx(snapshot.hot_junction - snapshot.cold_junction, abs=0.0625)
+    assert snapshot.th_updated and not snapshot.burst_complete and snapshot.alerts == 0
@@ -0,0 +1,39 @@
+import math
+import types
+
+import pytest
+
+pytest.importorskip('numpy')  # control_worker pulls in the analytics and PID modules
+
+import latency
+import metrics
+from control_worker import ChannelStatus
+
+
+def worker(temperature, setpoint=300.0, output=0.0):
+    status = ChannelStatus('CH1', 1.5, temperature, setpoint, output, 0.25, True, 1.0, 2.0, 3.0, 7)
+    return types.SimpleNamespace(running=True, status=(status,), ticks=7, relays={'1': True},
+                                 stats=[], latency=latency.LoopLatency())
+
+
+@pytest.mark.parametrize('value, text', [
+    (math.nan, 'NaN'),
+    (math.inf, '+Inf'),
+    (-math.inf, '-Inf'),
+    (None, 'NaN'),
+    (True, '1'),
+    (3, '3'),
+    (21.5, '21.5'),
+])
+def test_value(value, text):
+    assert metrics._value(value) == text
+
+
+@pytest.mark.parametrize('openmetrics', [False, True])
+def test_non_finite_samples(openmetrics):
+    text = metrics.render(worker(math.nan, math.inf, -math.inf), openmetrics)
+    assert 'heatertest_temperature_celsius{channel="CH1"} NaN' in text
+    assert 'heatertest_setpoint_celsius{channel="CH1"} +Inf' in text
+    assert 'heatertest_pid_output{channel="CH1"} -Inf' in text
+    assert 'nan' not in text and ' inf' not in text
+    assert text.endswith('# EOF\n') == openmetrics
@@ -0,0 +1,52 @@
+import sqlite3
+
+from conftest import wait_for
+
+from parameters import ParameterStore
+
+
+def stored(path, parameter):
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute("SELECT VALUE FROM tblParameters WHERE PARAMETER = ?", (parameter,)).fetchone()
+    finally:
+        conn.close()
+    return row and row[0]
+
+
+def rename(path, old, new):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(old, new))
+    conn.close()
+
+
+def test_changes_are_written_once_quiet(tmp_path):
+    path = str(tmp_path / 'params.db')
+    store = ParameterStore(path, debounce=0.05)
+    seen = []
+    store.subscribe(lambda name, value: seen.append((name, value)), ['P'])
+    for value in (6.0, 6.5, 7.0):
+        store.set('P', value)
+    store.set('SETPT', 250)
+    assert store['P'] == 7.0
+    assert seen == [('P', 6.0), ('P', 6.5), ('P', 7.0)]
+    wait_for(lambda: stored(path, 'P') == '7.0')
+    assert stored(path, 'SETPT') == '250'
+    store.close()
+
+
+def test_failed_write_keeps_the_changes(tmp_path, capsys):
+    path = str(tmp_path / 'params.db')
+    store = ParameterStore(path, debounce=0.05)
+    rename(path, 'tblParameters', 'tblMoved')  # every upsert now fails
+    store.set('P', 8.0)
+    assert store.flush() is False
+    assert 'Cannot save settings' in capsys.readouterr().err
+
+    rename(path, 'tblMoved', 'tblParameters')
+    # The retry timer writes them without another set()
+    wait_for(lambda: stored(path, 'P') == '8.0')
+    assert store.flush() is True
+    store.close()
+    assert ParameterStore(path).value('P') == 8.0
@@ -0,0 +1,95 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from PID import PID  # noqa: E402
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def controller(Kp=2.0, Ki=0.1, Kd=0.5, **kwargs):
+    pid = PID(**kwargs)
+    pid.SetKp(Kp)
+    pid.SetKi(Ki)
+    pid.SetKd(Kd)
+    return pid
+
+
+def test_injected_clock_gives_dt():
+    clock = FakeClock()
+    pid = controller(Kp=0.0, Ki=1.0, Kd=0.0, clock=clock)
+    clock.now += 2.0
+    assert pid.GenOut(3.0) == 6.0
+    clock.now += 0.5
+    assert pid.GenOut(3.0) == 7.5
+
+
+def test_fixed_dt_ignores_the_clock():
+    pid = controller(Kp=1.0, Ki=0.5, Kd=2.0, clock=FakeClock(), dt=0.25)
+    assert pid.GenOut(4.0) == pytest.approx(4.0 + 0.5 * 1.0 + 2.0 * 16.0)
+    assert pid.GenOut(4.0) == pytest.approx(4.0 + 0.5 * 2.0)
+
+
+def test_derivative_on_measurement_has_no_kick():
+    pid = controller(Kp=0.0, Ki=0.0, Kd=1.0, dt=1.0)
+    assert pid.GenOut(50.0, 20.0) == 0.0
+    # Setpoint jump: the error leaps but the measurement does not
+    assert pid.GenOut(150.0, 20.0) == 0.0
+    assert pid.GenOut(148.0, 22.0) == -2.0
+
+
+def test_anti_windup_holds_the_integral_at_the_limit():
+    pid = controller(Kp=1.0, Ki=0.1, Kd=0.0, dt=1.0)
+    pid.SetOutputLimits(0.0, 50.0)
+    for _ in range(100):
+        assert pid.GenOut(100.0) == 50.0
+    assert pid.Ci == 0.0
+    # Once the error drops the output leaves the limit at once, no wound-up integral to unwind
+    assert pid.GenOut(10.0) == pytest.approx(11.0)
+    assert pid.GenOut(-5.0) == pytest.approx(0.0)
+
+
+def test_derivative_filter():
+    pid = controller(Kp=0.0, Ki=0.0, Kd=1.0, dt=1.0)
+    pid.SetDerivativeFilter(3.0)
+    pid.GenOut(0.0, 0.0)
+    outputs = [pid.GenOut(0.0, -4.0)] + [pid.GenOut(0.0, -4.0) for _ in range(3)]
+    assert outputs[0] == pytest.approx(1.0)  # a quarter of the 4 C/s step
+    assert outputs[1] == pytest.approx(0.75)
+    assert all(a > b for a, b in zip(outputs, outputs[1:]))
+
+
+@pytest.mark.parametrize('limits, d_filter', [(None, 0.0), ((0.0, 30.0), 0.0), (None, 5.0), ((0.0, 30.0), 5.0)])
+def test_batch_equals_one_call_per_sample(limits, d_filter):
+    rng = numpy.random.default_rng(3)
+    errors = rng.normal(10.0, 20.0, 500)
+    measurements = 100.0 - errors
+    timestamps = 100.0 + numpy.cumsum(rng.uniform(0.5, 1.5, 500))
+
+    clock = FakeClock()
+    one, batch = controller(clock=clock), controller(clock=clock)
+    for pid in (one, batch):
+        pid.SetDerivativeFilter(d_filter)
+        if limits:
+            pid.SetOutputLimits(*limits)
+    expected = []
+    for error, measurement, timestamp in zip(errors, measurements, timestamps):
+        clock.now = timestamp
+        expected.append(one.GenOut(error, measurement))
+    outputs = batch.GenOutBatch(errors, measurements, timestamps)
+
+    numpy.testing.assert_allclose(outputs, expected, rtol=1e-9, atol=1e-9)
+    for name in ('Cp', 'Ci', 'Cd', 'prev_err', 'prevtm'):
+        assert getattr(batch, name) == pytest.approx(getattr(one, name))
+
+
+def test_batch_needs_time():
+    with pytest.raises(ValueError):
+        controller().GenOutBatch([1.0, 2.0])
+    assert len(controller(dt=1.0).GenOutBatch([])) == 0
@@ -0,0 +1,65 @@
+import json
+import socket
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from conftest import wait_for
+from remote_api import RemoteApi
+
+
+@pytest.fixture
+def api(db, worker):
+    api = RemoteApi(worker, db, port=0, host='127.0.0.1')
+    api.start()
+    assert api.wait_ready()
+    yield api
+    api.close()
+
+
+@pytest.fixture
+def request_api(api):
+    """ request(cmd, args) -> reply, over one connection. """
+    connection = socket.create_connection(('127.0.0.1', api.port), timeout=5)
+    lines = connection.makefile('r')
+
+    def request(cmd, args=None):
+        connection.sendall((json.dumps({'id': 1, 'cmd': cmd, 'args': args or {}}) + '\n').encode())
+        while True:
+            reply = json.loads(lines.readline())
+            if 'type' not in reply:  # skip stream lines
+                return reply
+
+    yield request
+    connection.close()
+
+
+def test_switch_to_autotune_mid_run(worker, request_api):
+    assert request_api('start', {'MODE': 'bang_bang', 'SETPT': 100, 'SECONDS': 100000})['ok']
+    wait_for(lambda: worker.ticks > 3)
+    assert request_api('set', {'name': 'MODE', 'value': 'autotune'})['ok']
+    ticks = worker.ticks
+    wait_for(lambda: worker.ticks > ticks + 5)
+    assert worker.running
+    assert all(channel.autotune is not None for channel in worker.channels)
+    assert 'error' not in [name for name, channel, data in worker.drain_events()]
+
+
+@pytest.mark.parametrize('gains', [
+    {'P': float('nan'), 'I': 0.0, 'D': 0.0},
+    {'P': 1.0, 'I': float('inf'), 'D': 0.0},
+    {'P': 1.0, 'I': 0.0, 'D': '0.5'},
+    {'P': -1.0, 'I': 0.0, 'D': 0.0},
+    {'P': 1.0, 'I': 11.0, 'D': 0.0},
+])
+def test_bad_gains_are_rejected(worker, request_api, gains):
+    reply = request_api('gains', gains)
+    assert not reply['ok']
+    assert worker.channels[0].pid.Kp == 0
+
+
+def test_gains_reach_the_channel(worker, request_api):
+    assert request_api('gains', {'P': 2.5, 'I': 0.01, 'D': 0.5, 'channel': 0})['ok']
+    pid = worker.channels[0].pid
+    wait_for(lambda: (pid.Kp, pid.Ki, pid.Kd) == (2.5, 0.01, 0.5))
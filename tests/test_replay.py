@@ -0,0 +1,73 @@
+import math
+import sqlite3
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import hal
+import headless
+import setpoint_profile
+from replay import ReplayController, replay_run
+
+
+@pytest.mark.parametrize('mode', ['pid', 'bang_bang'])
+def test_nan_sample_gives_zero_duty(mode):
+    controller = ReplayController(mode, 5.0, 0.0, 0.0, 1.0, hal.VirtualClock())
+    duties = controller.run([1.0, 2.0, 3.0], [100.0, math.nan, 100.0], [300.0] * 3)
+    assert list(duties) == [1.0, 0.0, 1.0]
+
+
+def test_batch_matches_step_on_a_ramp_with_feed_forward():
+    timestamps = [float(t) for t in range(1, 400)]
+    setpoints = [50.0 + 0.5 * t for t in timestamps]
+    temperatures = [s - 3.0 + math.sin(t / 20.0) for t, s in zip(timestamps, setpoints)]
+    temperatures[100] = math.nan
+    feed_forwards = [0.1 + 0.0005 * t for t in timestamps]
+
+    batch = ReplayController('pid', 2.0, 0.05, 1.0, 1.0, hal.VirtualClock()).run(
+        timestamps, temperatures, setpoints, feed_forwards)
+    clock = hal.VirtualClock()
+    single = ReplayController('pid', 2.0, 0.05, 1.0, 1.0, clock)
+    stepped = []
+    for timestamp, tempc, setpt, ff in zip(timestamps, temperatures, setpoints, feed_forwards):
+        clock.now = timestamp
+        stepped.append(single.step(tempc, setpt, ff))
+    assert batch == pytest.approx(stepped)
+    assert batch[100] == 0.0
+
+
+@pytest.fixture
+def profile_db(db):
+    setpoint_profile.profile_names(db)  # creates the profile tables
+    conn = sqlite3.connect(db)
+    with conn:
+        profile = conn.execute("INSERT INTO tblProfiles (NAME, FF_GAIN, FF_TAU, FF_AMBIENT) "
+                               "VALUES ('SHORT', 520, 240, 22)").lastrowid
+        conn.executemany("INSERT INTO tblProfileSegments (FK_PROFILE_ID, SEQ, KIND, TARGET, DURATION, RATE) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         [(profile, 0, 'ramp', 80, None, 1.0), (profile, 1, 'soak', 80, 30, None)])
+    conn.close()
+    return db
+
+
+def profile_run(db, mode):
+    assert headless.main(['--db', db, '--simulate', '200', '--metrics-port', '0', '--mode', mode,
+                          '--setpoint-profile', 'SHORT', '--tolerance', '1000']) == headless.EXIT_PASS
+    conn = sqlite3.connect(db)
+    run_id = conn.execute("SELECT MAX(PK_ID) FROM tblRuns").fetchone()[0]
+    conn.close()
+    return run_id
+
+
+def test_profile_run_replays_with_its_feed_forward(profile_db):
+    result, = replay_run(profile_db, profile_run(profile_db, 'pid'))
+    assert result.samples > 50
+    assert result.differing == 0
+
+
+def test_pid_replay_of_a_bang_bang_profile_run_is_refused(profile_db):
+    run_id = profile_run(profile_db, 'bang_bang')
+    with pytest.raises(ValueError, match='feed-forward was not recorded'):
+        replay_run(profile_db, run_id, mode='pid')
+    assert replay_run(profile_db, run_id)[0].differing == 0
@@ -0,0 +1,41 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from control_worker import Sample
+from ring_buffer import SampleRingBuffer
+
+
+def filled(count, capacity=1000):
+    buffer = SampleRingBuffer(capacity)
+    buffer.extend(Sample(float(i), 20.0 + i, 300.0, 0.0, 0.5, True, 0) for i in range(count))
+    return buffer
+
+
+def test_latest_is_a_contiguous_view_after_wrapping():
+    buffer = filled(2500)
+    latest = buffer.latest()
+    assert len(latest) == 1000
+    assert latest.base is buffer.data
+    assert list(latest['timestamp'][[0, -1]]) == [1500.0, 2499.0]
+
+
+def test_decimation_is_aligned_to_the_sample_index():
+    buffer = filled(10)
+    assert list(buffer.latest(step=3)['timestamp']) == [0.0, 3.0, 6.0, 9.0]
+    buffer.append(Sample(10.0, 30.0, 300.0, 0.0, 0.5, True, 0))
+    assert list(buffer.latest(step=3)['timestamp']) == [0.0, 3.0, 6.0, 9.0]
+
+
+def test_window_seconds():
+    assert list(filled(100).window(5)['timestamp']) == [94.0, 95.0, 96.0, 97.0, 98.0, 99.0]
+
+
+def test_window_max_points():
+    buffer = filled(100000, capacity=1 << 17)
+    points = buffer.window(0, 1, 2000)
+    assert 1000 < len(points) <= 2000
+    # A power of two step keeps the drawn points in place between redraws
+    assert set(numpy.diff(points['timestamp'])) == {64.0}
+    assert len(buffer.window(800, 1, 2000)) == 801
+    assert set(numpy.diff(buffer.window(0, 3, 2000)['timestamp'])) == {96.0}
@@ -0,0 +1,78 @@
+import math
+import random
+import statistics
+from collections import namedtuple
+
+import pytest
+
+from run_analytics import ChannelAnalytics, P2Quantile, Welford, summary
+
+Sample = namedtuple('Sample', ['timestamp', 'temperature', 'setpoint', 'output', 'duty', 'heater', 'channel'])
+
+
+def first_order(start, target, tau, t):
+    return target + (start - target) * math.exp(-t / tau)
+
+
+def feed(analytics, times, temperature, setpoint, duty=0.5, new_step=None):
+    for t in times:
+        analytics.update(Sample(float(t), temperature(t), setpoint(t), 0.0, duty, duty > 0, 0), new_step)
+
+
+def test_welford_and_p2_match_exact_statistics():
+    rng = random.Random(1)
+    values = [rng.gauss(10.0, 3.0) for _ in range(20000)]
+    welford = Welford()
+    p95 = P2Quantile(0.95)
+    for value in values:
+        welford.add(value)
+        p95.add(value)
+    assert welford.mean == pytest.approx(statistics.mean(values))
+    assert welford.stddev == pytest.approx(statistics.stdev(values))
+    assert (welford.minimum, welford.maximum) == (min(values), max(values))
+    assert p95.value() == pytest.approx(sorted(values)[int(0.95 * len(values))], abs=0.1)
+
+
+def test_step_response():
+    analytics = ChannelAnalytics(0, band=1.0, watts=100.0)
+    feed(analytics, range(2000), lambda t: first_order(20.0, 120.0, 100.0, t), lambda t: 100.0)
+    stats = analytics.snapshot()
+    # 10% to 90% of the 80 C step on the way to 120 C
+    assert stats.rise_time == pytest.approx(100.0 * math.log(92.0 / 28.0), abs=1.0)
+    assert stats.overshoot == pytest.approx(20.0, abs=0.01)
+    assert stats.overshoot_pct == pytest.approx(25.0, abs=0.1)
+    assert stats.settling_time is None  # it settles at 120 C, outside the band
+    assert stats.on_seconds == pytest.approx(0.5 * 1999)
+    assert stats.energy_j == pytest.approx(100.0 * 0.5 * 1999)
+    assert 'overshoot 20.0 C' in summary(stats)
+
+
+def test_ramp_is_one_step():
+    analytics = ChannelAnalytics(0, band=1.0)
+    # Ramp 20 -> 220 C at 2 C/s, tracked 3 C behind, then held
+    setpoint = lambda t: min(20.0 + 2.0 * t, 220.0)  # noqa: E731
+    temperature = lambda t: min(20.0 + 2.0 * max(t - 1.5, 0), 220.0)  # noqa: E731
+    feed(analytics, range(200), temperature, setpoint)
+    stats = analytics.snapshot()
+    assert stats.rise_time is None
+    assert stats.settling_time == pytest.approx(101.0, abs=1.0)
+    assert stats.overshoot_pct == 0.0
+
+
+def test_jump_starts_a_new_step():
+    analytics = ChannelAnalytics(0, band=1.0)
+    feed(analytics, range(100), lambda t: 100.0, lambda t: 100.0)
+    assert analytics.snapshot().settling_time == 0.0
+    feed(analytics, range(100, 300), lambda t: first_order(100.0, 150.0, 20.0, t - 100), lambda t: 150.0)
+    stats = analytics.snapshot()
+    assert stats.settling_time == pytest.approx(20.0 * math.log(50.0), abs=1.0)
+    assert stats.rise_time == pytest.approx(20.0 * math.log(9.0), abs=1.0)
+
+
+def test_caller_decides_steps():
+    analytics = ChannelAnalytics(0, band=1.0)
+    feed(analytics, range(100), lambda t: 100.0, lambda t: 100.0, new_step=False)
+    # A 3 C move is below the jump threshold but the caller says it is a step
+    feed(analytics, [100], lambda t: 100.0, lambda t: 103.0, new_step=True)
+    feed(analytics, range(101, 200), lambda t: 103.0, lambda t: 103.0, new_step=False)
+    assert analytics.snapshot().settling_time == pytest.approx(1.0)
@@ -0,0 +1,109 @@
+import sqlite3
+
+import pytest
+
+from conftest import wait_for
+
+pytest.importorskip('numpy')
+import run_logger  # noqa: E402
+from control_worker import ControlWorker, Sample  # noqa: E402
+from run_logger import RunLogger  # noqa: E402
+
+
+@pytest.fixture
+def impatient(monkeypatch):
+    """ Writer connections give up on a lock after 50 ms instead of 5 s. """
+    connect = run_logger.connect
+
+    def fast_connect(path):
+        conn = connect(path)
+        conn.execute('PRAGMA busy_timeout=50')
+        return conn
+    monkeypatch.setattr(run_logger, 'connect', fast_connect)
+    monkeypatch.setattr(run_logger, 'RETRY_SECONDS', 0.05)
+
+
+def lock(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('BEGIN EXCLUSIVE')
+    return conn
+
+
+def count(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def sample(i):
+    return Sample(float(i), 20.0 + i, 100.0, 1.0, 0.5, True, 0)
+
+
+def test_locked_batch_is_kept_and_retried(tmp_path, impatient, capsys):
+    path = str(tmp_path / 'runs.db')
+    logger = RunLogger(path, batch_seconds=0.01)
+    logger.start()
+    assert logger.wait_ready()
+
+    holder = lock(path)
+    logger.start_run({'MODE': 'pid'})
+    for i in range(10):
+        logger.log(sample(i))
+    wait_for(lambda: 'retrying' in capsys.readouterr().err)
+    for i in range(10, 20):
+        logger.log(sample(i))
+    holder.rollback()
+    holder.close()
+
+    logger.end_run()
+    logger.close()
+    assert logger.is_alive() is False
+    assert logger.error is None
+    assert count(path, 'SELECT COUNT(*) FROM tblRuns') == 1
+    assert count(path, 'SELECT COUNT(*) FROM tblSamples') == 20
+    assert count(path, "SELECT STATUS FROM tblRuns") == 'complete'
+
+
+def test_sample_file_is_not_duplicated_by_a_retry(tmp_path, impatient, capsys):
+    path = str(tmp_path / 'runs.db')
+    logger = RunLogger(path, batch_seconds=0.01)
+    logger.start()
+    assert logger.wait_ready()
+
+    holder = lock(path)
+    logger.start_run({'MODE': 'pid', 'SAMPLE_STORE': 'file', 'CHANNELS': ['CH1']})
+    for i in range(5):
+        logger.log(sample(i))
+    wait_for(lambda: 'retrying' in capsys.readouterr().err)
+    holder.rollback()
+    holder.close()
+    logger.end_run()
+    logger.close()
+
+    from sample_file import SampleFile, run_file
+    assert len(SampleFile(run_file(logger.sample_dir, 1))) == 5
+    assert count(path, "SELECT COUNT(*) FROM tblEvents WHERE NAME = 'sample_file'") == 1
+
+
+def test_persistent_failure_aborts_the_run(rack, tmp_path, impatient):
+    path = str(tmp_path / 'runs.db')
+    logger = RunLogger(path, batch_seconds=0.01, fail_seconds=0.2)
+    logger.start()
+    assert logger.wait_ready()
+    worker = ControlWorker(rack[1], period=1.0, logger=logger)
+    worker.start()
+    holder = lock(path)
+    try:
+        worker.send('start', {'MODE': 'pid', 'SETPT': 300, 'SECONDS': 100000})
+        wait_for(lambda: worker.running)
+        wait_for(lambda: not worker.running)
+        assert ('run_finished', None, 'error') in worker.events
+        assert any(name == 'error' and 'Run log' in data for name, channel, data in worker.events)
+    finally:
+        holder.rollback()
+        holder.close()
+        worker.shutdown()
+        logger.close()
+    assert count(path, "SELECT STATUS FROM tblRuns") == 'error'
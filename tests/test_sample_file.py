@@ -0,0 +1,93 @@
+import os
+import sys
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import sample_file  # noqa: E402
+from sample_file import SampleFile, SampleFileWriter  # noqa: E402
+
+
+def samples(start, count, channels=2):
+    """ count samples per channel, 0.5 s apart from start, channels interleaved. """
+    return [(start + 0.5 * i, 20.0 + i, 100.0, 1.0, 0.5, i % 3 == 0, channel)
+            for i in range(count) for channel in range(channels)]
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """ Path of a closed two-channel file of 5000 samples per channel, written in 10 flushes. """
+    path = sample_file.run_file(str(tmp_path), 7)
+    writer = SampleFileWriter(path, ['CH1', 'CH2'], {'RUN_ID': 7}, index_every=64)
+    for batch in range(10):
+        writer.append(samples(250.0 * batch, 500))
+        writer.flush()
+    writer.close()
+    return path
+
+
+def test_round_trip(recording):
+    assert recording.endswith('run_000007.hts')
+    data = SampleFile(recording)
+    assert len(data) == 10000
+    assert data.channels == ['CH1', 'CH2'] and data.metadata == {'RUN_ID': 7}
+    assert data.time_range() == (0.0, 2499.5)
+    assert data.records[3].tolist() == (0.5, 21.0, 100.0, 1.0, 0.5, 0, 1)
+    assert isinstance(data.records, numpy.memmap)
+
+
+def test_seek_and_window(recording):
+    data = SampleFile(recording)
+    times = numpy.asarray(data.records['timestamp'])
+    for t in (-1.0, 0.0, 0.25, 31.5, 1000.0, 1000.2, 2499.5, 3000.0):
+        assert data.seek(t) == numpy.searchsorted(times, t, 'left')
+        assert data.seek(t, 'right') == numpy.searchsorted(times, t, 'right')
+    window = data.window(100.0, 200.0)
+    assert window['timestamp'][0] == 100.0 and window['timestamp'][-1] == 200.0
+    assert len(window) == 2 * 201
+    ch2 = data.window(100.0, 200.0, channel=1)
+    assert (ch2['channel'] == 1).all() and len(ch2) == 201
+
+
+def test_window_decimation_keeps_every_channel(recording):
+    data = SampleFile(recording)
+    for channel in (0, 1):
+        window = data.window(channel=channel, max_points=100)
+        assert 90 <= len(window) <= 110
+        assert (window['channel'] == channel).all()
+
+
+def test_torn_record_and_stale_index(recording):
+    # A crash mid-record, and an index that lost its last flush
+    with open(recording, 'ab') as f:
+        f.write(b'\x01' * 20)
+    with open(recording + '.idx', 'r+b') as f:
+        f.truncate(5 * sample_file.INDEX_DTYPE.itemsize + 3)
+    data = SampleFile(recording)
+    assert len(data) == 10000
+    assert len(data.index) == 10000 // 64 + 1
+    assert data.seek(2000.0) == 8000
+
+
+def test_foreign_index_is_rebuilt(recording, tmp_path):
+    other = sample_file.run_file(str(tmp_path), 8)
+    writer = SampleFileWriter(other, ['CH1'], index_every=64)
+    writer.append(samples(5000.0, 1000, channels=1))
+    writer.close()
+    os.replace(other + '.idx', recording + '.idx')
+    data = SampleFile(recording)
+    assert data.seek(1234.0) == 2 * 2468
+
+
+def test_existing_file_is_not_overwritten(recording):
+    with pytest.raises(FileExistsError):
+        SampleFileWriter(recording, ['CH1'])
+
+
+def test_cli(recording, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['sample_file.py', recording, '--start', '0', '--end', '100'])
+    sample_file.main()
+    out = capsys.readouterr().out
+    assert '10000 records, channels CH1, CH2, 0.0 s to 2499.5 s' in out
+    assert 'CH1: 201 samples' in out and 'CH2: 201 samples' in out
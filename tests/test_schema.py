@@ -0,0 +1,34 @@
+import sqlite3
+
+import channel_manager
+import parameters
+import setpoint_profile
+
+
+def test_empty_database_is_seeded(tmp_path):
+    path = str(tmp_path / 'empty.db')
+    sqlite3.connect(path).close()
+
+    store = parameters.ParameterStore(path)
+    assert store.get('MODE') == 'pid'
+    assert store.value('P') == 5.0
+    assert [row['NAME'] for row in channel_manager.channel_rows(path)] == ['CH1', 'CH2', 'CH3', 'CH4']
+    profile = setpoint_profile.load_profile(path, 'QUAL_CYCLE')
+    assert [segment.kind for segment in profile.segments] == ['ramp', 'hold', 'soak', 'ramp', 'hold', 'soak',
+                                                               'ramp', 'loop']
+
+
+def test_stored_values_are_kept(tmp_path):
+    path = str(tmp_path / 'old.db')
+    parameters.ParameterStore(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("UPDATE tblParameters SET VALUE = '7.5' WHERE PARAMETER = 'P'")
+        conn.execute("DELETE FROM tblParameters WHERE PARAMETER = 'D_FILTER'")
+    conn.close()
+
+    store = parameters.ParameterStore(path)
+    assert store.value('P') == 7.5
+    assert store.value('D_FILTER') == 0.0
+    setpoint_profile.profile_names(path)
+    assert len(setpoint_profile.load_profile(path, 'QUAL_CYCLE').segments) == 8
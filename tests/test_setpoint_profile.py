@@ -0,0 +1,105 @@
+import sqlite3
+
+import pytest
+
+import setpoint_profile
+from setpoint_profile import Profile, ProfileRunner, Segment, load_profile
+
+COLUMNS = ('KIND', 'TARGET', 'DURATION', 'RATE', 'BAND', 'HOLD_SECONDS', 'LOOP_TO', 'LOOP_COUNT')
+
+
+def add_profile(path, name, rows):
+    """ Store a profile; rows are dicts of tblProfileSegments columns, in SEQ order. """
+    setpoint_profile.profile_names(path)  # creates the tables
+    conn = sqlite3.connect(path)
+    with conn:
+        profile_id = conn.execute("INSERT INTO tblProfiles (NAME) VALUES (?)", (name,)).lastrowid
+        for seq, row in enumerate(rows):
+            conn.execute("INSERT INTO tblProfileSegments (FK_PROFILE_ID, SEQ, {}) VALUES (?, ?, {})".format(
+                ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                (profile_id, seq) + tuple(row.get(column) for column in COLUMNS))
+    conn.close()
+
+
+def segment(kind, target=None, duration=0.0, rate=None, band=1.0, hold_seconds=0.0, loop_to=0, loop_count=0):
+    return Segment(kind, target, duration, rate, band, hold_seconds, loop_to, loop_count, 0.0)
+
+
+@pytest.mark.parametrize('rows, message', [
+    ([{'KIND': 'ramp', 'RATE': 1.0}], 'segment 0: ramp needs TARGET'),
+    ([{'KIND': 'ramp', 'TARGET': 100.0, 'RATE': 0.0}], 'RATE must be positive'),
+    ([{'KIND': 'ramp', 'TARGET': 100.0, 'RATE': -2.0}], 'RATE must be positive'),
+    ([{'KIND': 'ramp', 'TARGET': 100.0}], 'positive RATE or DURATION'),
+    ([{'KIND': 'step'}], 'step needs TARGET'),
+    ([{'KIND': 'soak', 'TARGET': 100.0}], 'soak needs a positive DURATION'),
+    ([{'KIND': 'hold', 'TARGET': 100.0, 'BAND': 0.0}], 'BAND must be positive'),
+    ([{'KIND': 'step', 'TARGET': 100.0}, {'KIND': 'loop', 'LOOP_TO': 1, 'LOOP_COUNT': 1}], 'segment 1: LOOP_TO'),
+    ([{'KIND': 'step', 'TARGET': 100.0}, {'KIND': 'loop', 'LOOP_TO': -1, 'LOOP_COUNT': 1}], 'LOOP_TO'),
+    ([{'KIND': 'step', 'TARGET': 100.0}, {'KIND': 'loop', 'LOOP_COUNT': 1}], 'loop needs LOOP_TO'),
+    ([{'KIND': 'step', 'TARGET': 100.0}, {'KIND': 'loop', 'LOOP_TO': 0, 'LOOP_COUNT': -1}], 'LOOP_COUNT'),
+    ([{'KIND': 'wait'}], 'unknown kind'),
+    ([], 'no segments'),
+])
+def test_bad_profiles_are_refused(tmp_path, rows, message):
+    path = str(tmp_path / 'profiles.db')
+    add_profile(path, 'BAD', rows)
+    with pytest.raises(ValueError, match=message):
+        load_profile(path, 'BAD')
+
+
+def test_default_profile_loads(tmp_path):
+    path = str(tmp_path / 'profiles.db')
+    profile = load_profile(path, 'QUAL_CYCLE')
+    assert profile.segments[-1] == segment('loop', loop_to=0, loop_count=1)
+    with pytest.raises(ValueError, match='No profile'):
+        load_profile(path, 'MISSING')
+
+
+def test_ramp_starts_from_temperature_and_keeps_schedule():
+    runner = ProfileRunner(Profile('P', (segment('ramp', 100.0, rate=2.0), segment('soak', duration=10.0)),
+                                   None, None, None))
+    assert runner.update(0.0, [20.0, 22.0]) == 21.0
+    assert runner.slope == 2.0
+    assert runner.update(10.0, [40.0]) == 41.0
+    # The ramp ends at 39.5 s, the soak runs from then, not from the late tick
+    assert runner.update(40.3, [100.0]) == 100.0
+    assert runner.index == 1 and runner.changed
+    runner.update(49.4, [100.0])
+    assert not runner.done
+    runner.update(49.6, [100.0])
+    assert runner.done and runner.status == 'complete'
+
+
+def test_hold_waits_for_band_and_times_out():
+    hold = segment('hold', 100.0, duration=60.0, band=2.0, hold_seconds=5.0)
+    runner = ProfileRunner(Profile('P', (hold, segment('step', 50.0)), None, None, None))
+    runner.update(0.0, [99.0, 101.5])
+    runner.update(4.0, [99.0, 101.5])
+    runner.update(6.0, [99.0, 101.5])
+    assert runner.setpoint == 50.0 and runner.index == 1
+
+    runner = ProfileRunner(Profile('P', (hold,), None, None, None))
+    runner.update(0.0, [90.0])
+    runner.update(59.0, [90.0])
+    assert not runner.done
+    runner.update(60.0, [90.0])
+    assert runner.done and runner.status == 'hold_timeout'
+
+
+def test_loops_repeat_and_nest():
+    segments = (segment('step', 10.0), segment('soak', duration=1.0),
+                segment('step', 20.0), segment('soak', duration=1.0),
+                segment('loop', loop_to=2, loop_count=1),
+                segment('loop', loop_to=0, loop_count=1))
+    runner = ProfileRunner(Profile('P', segments, None, None, None))
+    setpoints = [runner.update(float(t), [0.0]) for t in range(10)]
+    assert setpoints[:8] == [10.0, 20.0, 20.0, 10.0, 20.0, 20.0, 20.0, 20.0]
+    assert runner.done
+
+
+def test_feed_forward_follows_setpoint_and_slope():
+    runner = ProfileRunner(Profile('P', (segment('ramp', 300.0, rate=1.0),), 520.0, 240.0, 22.0))
+    runner.update(0.0, [22.0])
+    assert runner.feed_forward == pytest.approx((22.0 - 22.0 + 240.0) / 520.0)
+    runner.update(100.0, [122.0])
+    assert runner.feed_forward == pytest.approx((122.0 - 22.0 + 240.0) / 520.0)
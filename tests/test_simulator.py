@@ -0,0 +1,74 @@
+import math
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from bang_bang import bang_bang  # noqa: E402
+from PID import PID  # noqa: E402
+from simulator import CERAMIC_150W, grid_search, rank, simulate  # noqa: E402
+
+SETPOINT = 300.0
+SECONDS = 1500.0
+
+
+def reference(plant, controller, dt=1.0):
+    """ The same plant stepped with a scalar controller(temp) -> duty, one sample at a time. """
+    a = math.exp(-dt / plant.tau)
+    delay = int(round(plant.dead_time / dt))
+    duties = [0.0] * delay
+    temp = plant.ambient
+    temps = []
+    outputs = []
+    for _ in range(int(round(SECONDS / dt))):
+        duty = controller(temp)
+        duties.append(duty)
+        temp = plant.ambient + a * (temp - plant.ambient) + (1.0 - a) * plant.gain * duties[-delay - 1]
+        temps.append(temp)
+        outputs.append(duty)
+    return numpy.array(temps), numpy.array(outputs)
+
+
+@pytest.mark.parametrize('Kp, Ki, Kd, d_filter', [
+    (5.0, 0.001, 0.0, 0.0),
+    (12.0, 0.05, 0.0, 0.0),  # winds up against the limit on the way up
+    (4.0, 0.01, 30.0, 0.0),
+    (4.0, 0.01, 30.0, 10.0),
+])
+def test_pid_matches_PID_class(Kp, Ki, Kd, d_filter):
+    pid = PID(dt=1.0)
+    pid.SetKp(Kp)
+    pid.SetKi(Ki)
+    pid.SetKd(Kd)
+    pid.SetDerivativeFilter(d_filter)
+    pid.SetOutputLimits(0, SETPOINT)
+    temps, duties = reference(CERAMIC_150W, lambda temp: pid.GenOut(SETPOINT - temp, temp) / SETPOINT)
+
+    result = simulate(CERAMIC_150W, Kp, Ki, Kd, SETPOINT, SECONDS, d_filter=d_filter, record=True)
+    numpy.testing.assert_allclose(result['temperature'][:, 0], temps, rtol=1e-9, atol=1e-9)
+    numpy.testing.assert_allclose(result['duty'][:, 0], duties, rtol=1e-9, atol=1e-12)
+
+
+def test_bang_bang_matches_shared_rule():
+    state = {'on': False}
+
+    def controller(temp):
+        state['on'] = bang_bang(state['on'], temp, SETPOINT, 2.0)
+        return 1.0 if state['on'] else 0.0
+    temps, duties = reference(CERAMIC_150W, controller)
+
+    result = simulate(CERAMIC_150W, 0, 0, 0, SETPOINT, SECONDS, mode='bang_bang', hysteresis=2.0, record=True)
+    numpy.testing.assert_allclose(result['temperature'][:, 0], temps, rtol=1e-9)
+    assert (result['duty'][:, 0] == duties).all()
+
+
+def test_gain_sets_are_independent():
+    table = grid_search(CERAMIC_150W, [2.0, 8.0], [0.0, 0.01], [0.0], setpoint=SETPOINT, seconds=SECONDS,
+                        processes=1)
+    for i in range(4):
+        single = simulate(CERAMIC_150W, table['Kp'][i], table['Ki'][i], table['Kd'][i], SETPOINT, SECONDS)
+        for name in ('overshoot', 'iae', 'ss_error'):
+            assert table[name][i] == pytest.approx(single[name][0])
+    # Proportional only never reaches the setpoint, so the best sets have integral action
+    best = rank(table, overshoot_limit=100.0, top=2)
+    assert all(table['Ki'][i] > 0 for i in best)
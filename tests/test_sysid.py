@@ -0,0 +1,96 @@
+import math
+import sys
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import sysid  # noqa: E402
+from simulator import ThermalPlant  # noqa: E402
+
+PLANT = ThermalPlant(gain=400.0, tau=120.0, dead_time=6.0, ambient=22.0)
+
+
+def record(plant, seconds=4000, dt=1.0, noise=0.0, seed=0):
+    """ (duty, temperature) of the FOPDT plant under a random duty, held 60 s at a time. """
+    rng = numpy.random.default_rng(seed)
+    steps = int(seconds / dt)
+    duty = numpy.repeat(rng.uniform(0.0, 1.0, steps // 60 + 1), 60)[:steps]
+    delay = int(round(plant.dead_time / dt))
+    a = math.exp(-dt / plant.tau)
+    temperature = numpy.empty(steps)
+    temperature[0] = plant.ambient
+    for k in range(steps - 1):
+        u = duty[k - delay] if k >= delay else 0.0
+        temperature[k + 1] = plant.ambient + a * (temperature[k] - plant.ambient) + (1 - a) * plant.gain * u
+    return duty, temperature + rng.normal(0.0, noise, steps)
+
+
+def test_fopdt_recovers_the_plant():
+    duty, temperature = record(PLANT)
+    model = sysid.fit_fopdt(duty, temperature, 1.0, max_delay=20)
+    assert model.gain == pytest.approx(PLANT.gain, rel=1e-6)
+    assert model.tau == pytest.approx(PLANT.tau, rel=1e-6)
+    assert model.dead_time == PLANT.dead_time
+    assert model.ambient == pytest.approx(PLANT.ambient, rel=1e-6)
+    assert model.rms_error < 1e-3  # rounding in the normal equations
+
+
+def test_noisy_fit_and_confidence():
+    duty, temperature = record(PLANT, seconds=20000, noise=0.25)
+    model = sysid.fit_fopdt(duty, temperature, 1.0, max_delay=20)
+    assert model.dead_time == PLANT.dead_time
+    assert abs(model.gain - PLANT.gain) < 3 * model.gain_ci
+    assert abs(model.tau - PLANT.tau) < 3 * model.tau_ci
+    assert model.rms_error == pytest.approx(0.25 * math.sqrt(1 + math.exp(-2 / 120)), rel=0.1)
+
+
+def test_chunks_give_the_same_fit():
+    duty, temperature = record(PLANT, noise=0.1)
+    whole = sysid.fit_fopdt(duty, temperature, 1.0, max_delay=20)
+    chunked = sysid.fit_fopdt(duty, temperature, 1.0, max_delay=20, chunk=97)
+    for field in whole._fields:
+        assert getattr(chunked, field) == pytest.approx(getattr(whole, field))
+
+
+def test_unstable_recording_is_refused():
+    temperature = 22.0 + 0.01 * numpy.arange(500) ** 2
+    with pytest.raises(ValueError, match='stable first order'):
+        sysid.fit_fopdt(numpy.zeros(500), temperature, 1.0, max_delay=5)
+
+
+def test_tuning_rules():
+    model = sysid.FopdtModel(400.0, 120.0, 6.0, 22.0, 0, 0, 0, 0)
+    imc = sysid.imc(model)
+    assert imc.Kc == pytest.approx(246.0 / (400.0 * 18.0))
+    assert imc.Ti == 123.0
+    assert imc.Td == pytest.approx(720.0 / 246.0)
+    zn = sysid.ziegler_nichols(model)
+    assert (zn.Kc, zn.Ti, zn.Td) == (pytest.approx(0.06), 12.0, 3.0)
+    kp, ki, kd = sysid.pid_gains(imc, 300.0)
+    assert kp == pytest.approx(imc.Kc * 300.0)
+    assert ki == pytest.approx(kp / imc.Ti)
+    assert kd == pytest.approx(kp * imc.Td)
+
+
+def write_csv(path, duty, temperature):
+    with open(path, 'w') as f:
+        f.write('timestamp,duty,temperature\n')
+        for i, (u, y) in enumerate(zip(duty, temperature)):
+            f.write('{},{},{}\n'.format(float(i), u, y))
+
+
+def test_cli(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / 'run.csv')
+    write_csv(path, *record(PLANT, seconds=2000))
+    monkeypatch.setattr(sys, 'argv', ['sysid', path, '--max-delay', '20'])
+    sysid.main()
+    out = capsys.readouterr().out
+    assert 'K = 400.0' in out and 'dead time = 6.0 s' in out
+    assert out.count(' P = ') == 3
+
+    write_csv(path, *record(PLANT, seconds=10))
+    with pytest.raises(SystemExit) as exit_info:
+        sysid.main()
+    assert exit_info.value.code == 2
+    assert 'the fit needs at least 25' in capsys.readouterr().err
@@ -0,0 +1,39 @@
+import importlib
+import io
+import os
+import sys
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_ui(ui_file, module_name):
+    """ Import the Python module compiled from a Qt Designer file.
+
+        uic.loadUi parses the XML on every start. Here it is compiled to
+        module_name.py once, next to this file, and recompiled only when the
+        .ui is newer, so a normal start is a plain (bytecode cached) import
+        and PyQt5.uic is not loaded at all. If the directory is read-only the
+        compiled source is executed from memory instead.
+    """
+    ui_path = os.path.join(HERE, ui_file)
+    py_path = os.path.join(HERE, module_name + '.py')
+    if os.path.exists(py_path) and os.path.getmtime(py_path) >= os.path.getmtime(ui_path):
+        return importlib.import_module(module_name)
+
+    from PyQt5 import uic
+    source = io.StringIO()
+    uic.compileUi(ui_path, source)
+    try:
+        # Write then rename, a half written module must never be imported
+        with open(py_path + '.tmp', 'w') as f:
+            f.write(source.getvalue())
+        os.replace(py_path + '.tmp', py_path)
+    except OSError:
+        module = types.ModuleType(module_name)
+        exec(compile(source.getvalue(), ui_path, 'exec'), module.__dict__)
+        sys.modules[module_name] = module
+        return module
+    importlib.invalidate_caches()
+    sys.modules.pop(module_name, None)
+    return importlib.import_module(module_name)